@@ -5,29 +5,100 @@ Allows Node.js backend to trigger Python scraping jobs
 
 import asyncio
 import json
-from typing import Dict, List
-from workflows.scraping_flow import scrape_market_data_flow
-from supabase import create_client, Client
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from workflows.scraping_flow import ADAPTIVE_SCRAPING, scrape_batch_flow, scrape_market_data_flow
+from pricing_scrapers.query_index import QueryIndex, normalize_query
+from pricing_scrapers.regions import normalize_region
+from pricing_scrapers.storage import ListingStore, get_listing_store
+from pricing_scrapers.admission import (
+    BACKGROUND,
+    BATCH,
+    INTERACTIVE,
+    AdmissionController,
+    Overloaded,
+    get_admission_controller,
+)
+from pricing_scrapers.coordination import Coordinator, get_coordinator
+from pricing_scrapers.aggregates import bucket_start, combine_aggregates, window_start
+from pricing_scrapers.history import trend_series
+from pricing_scrapers.metrics import CACHE_LOOKUPS, SCRAPES_DEDUPLICATED, SCRAPES_IN_FLIGHT
+from pricing_scrapers.tracing import current_span, span, traced
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Minimum cosine similarity for serving a related cached query instead of scraping
+SIMILAR_QUERY_THRESHOLD = float(os.getenv('SIMILAR_QUERY_THRESHOLD', 0.6))
+
+# Seconds cached listing lookups are shared between workers (0 disables)
+SHARED_CACHE_TTL = float(os.getenv('SHARED_CACHE_TTL', 30))
+
+# Seconds a worker reuses a shared cache entry without reading it again
+# (0 disables); bounds how long other workers serve listings a scrape replaced
+LOCAL_CACHE_TTL = float(os.getenv('LOCAL_CACHE_TTL', 5))
+
+# Local cache entries kept before expired ones are dropped
+LOCAL_CACHE_MAX_ENTRIES = 1024
+
+# Scrape ownership lease, renewed while the scrape runs; a crashed owner's
+# scrape is taken over after this long
+SCRAPE_LEASE_SECONDS = float(os.getenv('SCRAPE_LEASE_SECONDS', 60))
+
+# Longest wait for another caller's scrape of the same category before
+# giving up with a 503
+SCRAPE_WAIT_TIMEOUT = float(os.getenv('SCRAPE_WAIT_TIMEOUT', 600))
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a listing store timestamp into an aware UTC datetime"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def category_key(business_type: str, offering_type: str, query: str, region: str) -> str:
+    """Identity of a scrape: category, region and normalized query"""
+    return f'{business_type}:{offering_type}:{normalize_region(region)}:{normalize_query(query)}'
+
+
+def count_cache_lookup(result: str):
+    """Count a listing cache lookup result and note it on the active span"""
+    CACHE_LOOKUPS.labels('listings', result).inc()
+    active = current_span()
+    if active:
+        active.set(cache=result)
+
 
 class ScraperAPI:
     """API interface for triggering scraping jobs"""
     
-    def __init__(self):
-        supabase_url = os.getenv('SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+    def __init__(self, store: ListingStore = None, admission: AdmissionController = None,
+                 coordinator: Coordinator = None):
+        self.store = store or get_listing_store()
+        self.admission = admission or get_admission_controller()
+        self.coordinator = coordinator or get_coordinator()
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.query_indexes: Dict[str, QueryIndex] = {}
+        self.index_synced_at: Optional[datetime] = None
+        # Cache lookups run in threads and share the query indexes
+        self.index_lock = threading.Lock()
+        self.local_cache: Dict[str, Tuple[float, List[Dict]]] = {}
+        self.refresh_tasks: Dict[str, asyncio.Task] = {}
     
     async def scrape_and_fetch(
         self,
         business_type: str,
         offering_type: str,
         query: str,
-        region: str = 'global'
+        region: str = 'global',
+        priority: int = INTERACTIVE
     ) -> List[Dict]:
         """
         Trigger scraping and return results
@@ -37,42 +108,230 @@ class ScraperAPI:
             offering_type: 'product' or 'service'
             query: Search query/niche
             region: Geographic region
+            priority: Admission priority (INTERACTIVE, BATCH or BACKGROUND)
             
         Returns:
             List of market listings
+            
+        Raises:
+            Overloaded: No scrape slot was free (see pricing_scrapers.admission),
+                or another caller's scrape of the category ran past
+                SCRAPE_WAIT_TIMEOUT
         """
         
-        # Step 1: Trigger scraping flow
-        print(f"Triggering scraping for {business_type} {offering_type}: {query}")
-        flow_result = scrape_market_data_flow(
-            business_type=business_type,
-            offering_type=offering_type,
-            query=query,
-            region=region
-        )
+        region = normalize_region(region)
         
-        # Step 2: Wait for scraping to complete (in production, use async/polling)
-        await asyncio.sleep(5)
+        # Only one scrape per category runs across all workers; the others
+        # wait for it and read its results
+        lease = f'scrape:{category_key(business_type, offering_type, query, region)}'
+        owner = f'{self.instance_id}:{uuid.uuid4().hex[:8]}'
+        waiting_since = time.time()
+        deadline = time.monotonic() + SCRAPE_WAIT_TIMEOUT
+        while True:
+            if self.coordinator.holder(lease):
+                SCRAPES_DEDUPLICATED.inc()
+                print(f"Waiting for the running scrape of '{query}' ({region})")
+                with span('await_scrape', query=query, region=region):
+                    await self.wait_for_lease(lease, deadline)
+            if self.scraped_since(lease, waiting_since):
+                with span('fetch_listings', query=query):
+                    return await asyncio.to_thread(self.store.fetch_listings, query, region)
+            # Nobody holds the lease (or its owner died): scrape ourselves
+            
+            # The slot is taken before the lease, so a lease is only ever held
+            # by a running scrape; a queued background refresh never makes an
+            # interactive caller wait behind it
+            async with self.admission.slot(priority):
+                if not self.coordinator.acquire(lease, owner, SCRAPE_LEASE_SECONDS):
+                    # Another caller took the lease while we queued; wait for it
+                    continue
+                if self.scraped_since(lease, waiting_since):
+                    # Its scrape finished while we queued
+                    self.coordinator.release(lease, owner)
+                    break
+                renewing = asyncio.create_task(self.renew_lease(lease, owner))
+                try:
+                    # Step 1: Trigger scraping flow (off the event loop, so cached reads keep flowing)
+                    print(f"Triggering scraping for {business_type} {offering_type}: {query} ({region})")
+                    with SCRAPES_IN_FLIGHT.track_inprogress(), span('scrape_flow', query=query, region=region):
+                        flow_result = await asyncio.to_thread(
+                            scrape_market_data_flow,
+                            business_type=business_type,
+                            offering_type=offering_type,
+                            query=query,
+                            region=region,
+                            # A waiting caller gets every source at once
+                            adaptive=ADAPTIVE_SCRAPING and priority != INTERACTIVE
+                        )
+                    
+                    # Step 2: Wait for scraping to complete (in production, use async/polling)
+                    await asyncio.sleep(5)
+                    self.invalidate_listings(query, region)
+                    self.coordinator.cache_set(f'scraped:{lease}', time.time(), ttl=3600)
+                finally:
+                    renewing.cancel()
+                    self.coordinator.release(lease, owner)
+            break
         
-        # Step 3: Fetch results from Supabase
-        result = self.supabase.table('market_listings')\
-            .select('*')\
-            .ilike('category', f'%{query}%')\
-            .order('scraped_at', desc=True)\
-            .limit(50)\
-            .execute()
+        # Step 3: Fetch results from the listing store
+        with span('fetch_listings', query=query):
+            return await asyncio.to_thread(self.store.fetch_listings, query, region)
+    
+    def invalidate_listings(self, query: str, region: str):
+        """Drop cached lookups of a query after it was scraped (this worker's copies, and the shared ones)"""
+        prefix = f'listings:{region}:{normalize_query(query)}:'
+        self.coordinator.cache_delete(prefix)
+        for key in [key for key in list(self.local_cache) if key.startswith(prefix)]:
+            self.local_cache.pop(key, None)
+    
+    def scraped_since(self, lease: str, since: float) -> bool:
+        """Whether the scrape holding `lease` last finished after `since` (time.time())"""
+        finished = self.coordinator.cache_get(f'scraped:{lease}')
+        return bool(finished and finished >= since)
+    
+    async def wait_for_lease(self, lease: str, deadline: float = None, poll_interval: float = 0.5):
+        """
+        Wait until nobody holds a lease (released, or expired with its owner)
+
+        Raises:
+            Overloaded: The lease is still held at `deadline` (time.monotonic())
+        """
+        while self.coordinator.holder(lease):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Overloaded(
+                    f"scrape {lease} still running after {SCRAPE_WAIT_TIMEOUT:.0f}s", status_code=503,
+                    retry_after=self.admission.retry_after()
+                )
+            await asyncio.sleep(poll_interval)
+    
+    async def renew_lease(self, lease: str, owner: str):
+        """Keep a scrape lease alive until cancelled"""
+        while True:
+            await asyncio.sleep(SCRAPE_LEASE_SECONDS / 3)
+            if not self.coordinator.renew(lease, owner, SCRAPE_LEASE_SECONDS):
+                print(f"Lost scrape lease {lease}; another worker may scrape it too")
+                return
+    
+    async def scrape_batch(
+        self,
+        business_type: str,
+        offering_type: str,
+        queries: List[str],
+        region: str = 'global',
+        priority: int = BATCH
+    ) -> Dict:
+        """
+        Scrape many queries with one spider run per source and batch
         
-        return result.data if result.data else []
+        Args:
+            business_type: 'digital' or 'physical'
+            offering_type: 'product' or 'service'
+            queries: Search queries/niches
+            region: Geographic region
+            priority: Admission priority (INTERACTIVE, BATCH or BACKGROUND)
+            
+        Returns:
+            Aggregated results of the spider runs
+            
+        Raises:
+            Overloaded: No scrape slot was free (see pricing_scrapers.admission)
+        """
+        region = normalize_region(region)
+        print(f"Triggering batch scraping for {business_type} {offering_type}: {len(queries)} queries ({region})")
+        async with self.admission.slot(priority):
+            with SCRAPES_IN_FLIGHT.track_inprogress(), span('scrape_batch_flow', queries=len(queries), region=region):
+                return await asyncio.to_thread(
+                    scrape_batch_flow,
+                    business_type=business_type,
+                    offering_type=offering_type,
+                    queries=queries,
+                    region=region
+                )
     
-    def get_cached_market_data(
+    @traced('cache_lookup')
+    def find_cached_listings(
+        self,
+        query: str,
+        max_age_hours: int = 24,
+        region: str = 'global'
+    ) -> List[Dict]:
+        """
+        Look up cached listings for a query, falling back to a similar cached query
+
+        Args:
+            query: Search query
+            max_age_hours: Maximum age of cached data in hours
+            region: Geographic region
+
+        Returns:
+            Newest-first listings, or an empty list if fewer than 10 are cached
+        """
+        region = normalize_region(region)
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+
+        # Check for recent data, through the cache shared by all workers
+        shared_key = f'listings:{region}:{normalize_query(query)}:{max_age_hours}'
+        listings = self.shared_cache_get(shared_key) if SHARED_CACHE_TTL else None
+        if listings is None:
+            if SHARED_CACHE_TTL:
+                CACHE_LOOKUPS.labels('shared', 'miss').inc()
+            listings = self.store.fetch_listings(query, region, since=cutoff)
+            if SHARED_CACHE_TTL:
+                self.coordinator.cache_set(shared_key, listings, SHARED_CACHE_TTL)
+                self.local_cache_put(shared_key, listings)
+        else:
+            CACHE_LOOKUPS.labels('shared', 'hit').inc()
+        
+        if len(listings) >= 10:
+            print(f"Using cached data ({len(listings)} listings)")
+            count_cache_lookup('hit')
+            return listings
+        
+        # Serve a closely related query that is already cached
+        match = self.find_similar_cached_query(query, max_age_hours, region)
+        if match:
+            matched_query, score = match
+            listings = self.store.fetch_listings(matched_query, region, since=cutoff, exact=True)
+
+            if len(listings) >= 10:
+                print(f"Using cached data for similar query '{matched_query}' (score {score})")
+                count_cache_lookup('similar')
+                return [
+                    {**listing, 'matched_query': matched_query, 'match_score': score}
+                    for listing in listings
+                ]
+
+        count_cache_lookup('miss')
+        return []
+
+    def shared_cache_get(self, key: str) -> Optional[List[Dict]]:
+        """Shared cache entry, reused from this worker's copy for LOCAL_CACHE_TTL seconds"""
+        local = self.local_cache.get(key)
+        if local and local[0] > time.monotonic():
+            return local[1]
+        listings = self.coordinator.cache_get(key)
+        if listings is not None:
+            self.local_cache_put(key, listings)
+        return listings
+
+    def local_cache_put(self, key: str, listings: List[Dict]):
+        if not LOCAL_CACHE_TTL:
+            return
+        now = time.monotonic()
+        if len(self.local_cache) >= LOCAL_CACHE_MAX_ENTRIES:
+            self.local_cache = {k: entry for k, entry in list(self.local_cache.items()) if entry[0] > now}
+        self.local_cache[key] = (now + min(LOCAL_CACHE_TTL, SHARED_CACHE_TTL), listings)
+
+    async def get_cached_market_data(
         self,
         business_type: str,
         offering_type: str,
         query: str,
-        max_age_hours: int = 24
+        max_age_hours: int = 24,
+        region: str = 'global'
     ) -> List[Dict]:
         """
-        Get cached market data from Supabase
+        Get cached market data from the listing store
         Returns existing data if fresh enough, otherwise triggers new scrape
         
         Args:
@@ -80,29 +339,229 @@ class ScraperAPI:
             offering_type: 'product' or 'service'
             query: Search query
             max_age_hours: Maximum age of cached data in hours
+            region: Geographic region
             
         Returns:
             List of market listings
         """
         
-        # Check for recent data
-        result = self.supabase.table('market_listings')\
-            .select('*')\
-            .ilike('category', f'%{query}%')\
-            .gte('scraped_at', f'now() - interval \'{max_age_hours} hours\'')\
-            .order('scraped_at', desc=True)\
-            .limit(50)\
-            .execute()
-        
-        if result.data and len(result.data) >= 10:
-            print(f"Using cached data ({len(result.data)} listings)")
-            return result.data
+        # Store reads block, so they run in a thread rather than on the event loop
+        listings = await asyncio.to_thread(self.find_cached_listings, query, max_age_hours, region)
+        if listings:
+            return listings
         
         # No recent data, trigger new scrape
         print("No recent data found, triggering new scrape")
-        return asyncio.run(self.scrape_and_fetch(
-            business_type, offering_type, query
-        ))
+        return await self.scrape_and_fetch(
+            business_type, offering_type, query, region
+        )
+
+    async def get_market_data_swr(
+        self,
+        business_type: str,
+        offering_type: str,
+        query: str,
+        region: str = 'global',
+        soft_ttl_hours: int = 24,
+        hard_ttl_hours: int = 168
+    ) -> Dict:
+        """
+        Stale-while-revalidate lookup
+        Serves the freshest cached listings immediately and refreshes them in the
+        background once past the soft TTL; only blocks on a scrape past the hard TTL
+        
+        Args:
+            business_type: 'digital' or 'physical'
+            offering_type: 'product' or 'service'
+            query: Search query
+            region: Geographic region
+            soft_ttl_hours: Age after which cached data is served as stale and refreshed
+            hard_ttl_hours: Age after which cached data is not served at all
+            
+        Returns:
+            Dict with data, age_hours, stale and refreshing
+        """
+        
+        listings = await asyncio.to_thread(self.find_cached_listings, query, hard_ttl_hours, region)
+        if not listings:
+            print("No cached data within hard TTL, triggering new scrape")
+            data = await self.scrape_and_fetch(business_type, offering_type, query, region)
+            return {'data': data, 'age_hours': 0.0, 'stale': False, 'refreshing': False}
+        
+        newest = max(parse_timestamp(listing['scraped_at']) for listing in listings)
+        age_hours = (datetime.now(timezone.utc) - newest).total_seconds() / 3600
+        stale = age_hours > soft_ttl_hours
+        
+        refreshing = False
+        if stale:
+            count_cache_lookup('stale')
+            refreshing = self.schedule_refresh(business_type, offering_type, query, region)
+        
+        return {
+            'data': listings,
+            'age_hours': round(age_hours, 2),
+            'stale': stale,
+            'refreshing': refreshing,
+        }
+
+    def schedule_refresh(
+        self,
+        business_type: str,
+        offering_type: str,
+        query: str,
+        region: str = 'global'
+    ) -> bool:
+        """
+        Start a background scrape unless one is already running for this query
+        (in any worker) or the scrape queue is full
+        
+        Returns:
+            True if a refresh is running for the query after this call
+        """
+        key = category_key(business_type, offering_type, query, region)
+        task = self.refresh_tasks.get(key)
+        if task and not task.done():
+            return True
+        if self.coordinator.holder(f'scrape:{key}'):
+            return True
+        
+        try:
+            self.admission.check(BACKGROUND)
+        except Overloaded as e:
+            print(f"Not refreshing '{query}' while scrapes are backed up: {e}")
+            return False
+        
+        async def refresh():
+            try:
+                await self.scrape_and_fetch(business_type, offering_type, query, region, priority=BACKGROUND)
+            except Overloaded as e:
+                print(f"Background refresh for '{query}' not admitted: {e}")
+            except Exception as e:
+                print(f"Background refresh failed for '{query}': {e}")
+            finally:
+                self.refresh_tasks.pop(key, None)
+        
+        print(f"Scheduling background refresh for '{query}'")
+        self.refresh_tasks[key] = asyncio.create_task(refresh())
+        return True
+
+    def get_price_stats(
+        self,
+        query: str,
+        regions: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        days: int = 30,
+        group_by: str = 'source',
+        include_outliers: bool = False
+    ) -> List[Dict]:
+        """
+        Price stats for a query, merged from the stored daily sketches
+        
+        Args:
+            query: Search query
+            regions: Regions to merge (default: global)
+            sources: Sources to merge, e.g. ['Fiverr', 'Upwork'] (default: all)
+            days: Window of days ending today
+            group_by: 'source' for one entry per source, 'all' to merge sources
+            include_outliers: Count prices flagged as outliers
+            
+        Returns:
+            List of dicts with currency (USD), window and the merged summary;
+            listings scraped in different currencies are merged on price_usd
+        """
+        rows = self.store.fetch_aggregates(
+            normalize_query(query),
+            regions=regions or ['global'],
+            sources=sources,
+            since_bucket=window_start(days),
+        )
+        return combine_aggregates(rows, group_by, include_outliers)
+
+    def get_price_history(
+        self,
+        query: str,
+        regions: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        resolution: str = 'day',
+        days: int = 30,
+        group_by: str = 'source',
+        include_outliers: bool = False
+    ) -> List[Dict]:
+        """
+        Price trend series for a query from the stored time buckets
+        
+        Args:
+            query: Search query
+            regions: Regions to merge (default: global)
+            sources: Sources to include (default: all)
+            resolution: 'hour', 'day' or 'week'
+            days: How far back the series goes
+            group_by: 'source' for one series per source, 'all' to merge sources
+            include_outliers: Count prices flagged as outliers
+            
+        Returns:
+            List of series, each with currency and points ordered by bucket
+        """
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        rows = self.store.fetch_aggregates(
+            normalize_query(query),
+            regions=regions or ['global'],
+            sources=sources,
+            resolution=resolution,
+            since_bucket=bucket_start(since, resolution),
+        )
+        return trend_series(rows, group_by, include_outliers)
+
+    def sync_query_index(self, max_age_hours: int = 24):
+        """
+        Add category keys with data scraped since the last sync to the index
+
+        Args:
+            max_age_hours: How far back to look on the first sync
+        """
+        since = self.index_synced_at or (
+            datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+        )
+
+        for row in self.store.fetch_categories(since):
+            if not row.get('category') or not row.get('scraped_at'):
+                continue
+            scraped_at = parse_timestamp(row['scraped_at'])
+            region = normalize_region(row.get('region'))
+            index = self.query_indexes.setdefault(region, QueryIndex())
+            index.update(normalize_query(row['category']), scraped_at)
+            if self.index_synced_at is None or scraped_at > self.index_synced_at:
+                self.index_synced_at = scraped_at
+
+    def find_similar_cached_query(
+        self,
+        query: str,
+        max_age_hours: int = 24,
+        region: str = 'global'
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Find the closest category key with fresh cached data in the same region
+
+        Args:
+            query: Search query
+            max_age_hours: Maximum age of cached data in hours
+            region: Geographic region
+
+        Returns:
+            (matched_query, score) above SIMILAR_QUERY_THRESHOLD, or None
+        """
+        with self.index_lock:
+            try:
+                self.sync_query_index(max_age_hours)
+            except Exception as e:
+                print(f"Failed to sync query index: {e}")
+
+            index = self.query_indexes.get(normalize_region(region))
+            if not index:
+                return None
+
+            fresh_since = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+            return index.best_match(query, SIMILAR_QUERY_THRESHOLD, fresh_since)
 
 
 def main():
@@ -119,7 +578,7 @@ def main():
     query = sys.argv[3]
     
     api = ScraperAPI()
-    results = api.get_cached_market_data(business_type, offering_type, query)
+    results = asyncio.run(api.get_cached_market_data(business_type, offering_type, query))
     
     print(f"\nFound {len(results)} listings:")
     for listing in results[:5]:
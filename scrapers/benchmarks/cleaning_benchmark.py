@@ -0,0 +1,85 @@
+"""
+Benchmark: cleaning and validation throughput
+Compares the per-item path (clean_item, DataCleaningPipeline), with and
+without a pydantic MarketListing per item, against the vectorized batch path
+(clean_batch, BatchCleaningPipeline) at several batch sizes.
+Usage: python benchmarks/cleaning_benchmark.py [items]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pydantic import ValidationError
+from pricing_scrapers.cleaning import clean_batch, clean_item, column_values
+from pricing_scrapers.items import MarketListing
+
+
+def make_items(count: int, seed: int = 7):
+    """Synthetic raw items shaped like spider output"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        items.append({
+            'source': rng.choice(['Fiverr', 'Upwork', 'Etsy', 'IndiaMART']),
+            'title': f'Listing {i}',
+            'price': rng.choice([f'${rng.randint(5, 5000):,}', f'₹{rng.randint(100, 90000):,}', 'Contact']),
+            'currency': 'USD',
+            'rating': rng.choice([str(round(rng.uniform(1, 5), 1)), str(round(rng.uniform(1, 10), 1)), None]),
+            'reviews': rng.choice([f'{rng.randint(0, 5000):,}', f'{rng.randint(1, 9)}k', None]),
+            'delivery_time': rng.choice([f'{rng.randint(1, 14)} days', f'{rng.randint(1, 4)} weeks', None]),
+            'category': 'logo design',
+        })
+    return items
+
+
+def bench(name, fn, items):
+    start = time.perf_counter()
+    rejected = fn([dict(item) for item in items])
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {len(items) / elapsed:>12,.0f} items/sec  ({rejected:,} rejected)")
+
+
+def cleaned(items):
+    rejected = 0
+    for item in items:
+        fields, reason = clean_item(item)
+        rejected += reason is not None
+    return rejected
+
+
+def cleaned_pydantic(items):
+    """Cleaning plus a MarketListing per item, the pydantic equivalent of clean_item's validation"""
+    rejected = 0
+    for item in items:
+        fields, reason = clean_item(item)
+        try:
+            MarketListing(**{**item, **(fields or {})})
+        except ValidationError:
+            rejected += 1
+    return rejected
+
+
+def batched(size):
+    def clean(items):
+        rejected = 0
+        for start in range(0, len(items), size):
+            fields, reasons = clean_batch(items[start:start + size])
+            column_values(fields)  # handing values back to the items is part of the cost
+            rejected += int((reasons != '').sum())
+        return rejected
+    return clean
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    items = make_items(count)
+
+    print(f"Cleaning {count:,} items")
+    bench('clean_item', cleaned, items)
+    bench('clean_item + pydantic', cleaned_pydantic, items)
+    for size in (100, 1000, 5000, 20000):
+        bench(f'clean_batch ({size})', batched(size), items)
@@ -0,0 +1,209 @@
+"""
+Load test: cached read throughput of the API with 1..N uvicorn workers
+Starts server.py against a seeded local SQLite store for each worker count
+and hammers GET /cache/{query} from several client processes. Besides
+throughput it reports the server's CPU time per request (Linux), which sets
+the ceiling when the load generator shares the machine's cores:
+max req/s ≈ cores / CPU per request.
+Usage: python benchmarks/load_test.py [workers ...] [--seconds S] [--connections C] [--clients P]
+       python benchmarks/load_test.py 1 2 4 --seconds 15
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import httpx
+from pricing_scrapers.storage import SQLiteStore
+
+SERVER_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+QUERIES = [
+    'logo design', 'web development', 'graphic design', 'seo audit', 'copywriting',
+    'video editing', 'mobile app', 'wordpress theme', 'data entry', 'voice over',
+]
+
+
+def seed_store(path: str, per_query: int = 40, seed: int = 7):
+    """Fresh listings for every query, so /cache always hits"""
+    rng = random.Random(seed)
+    store = SQLiteStore(path)
+    store.insert_listings([
+        {
+            'source': rng.choice(['Fiverr', 'Upwork', 'Freelancer']),
+            'title': f'{query} #{i}',
+            'price': rng.randint(5, 2000),
+            'currency': 'USD',
+            'price_usd': rng.randint(5, 2000),
+            'rating': round(rng.uniform(3, 5), 1),
+            'reviews': rng.randint(0, 3000),
+            'category': query,
+            'region': 'global',
+        }
+        for query in QUERIES
+        for i in range(per_query)
+    ])
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(workers: int, port: int, directory: str) -> subprocess.Popen:
+    env = {
+        **{key: value for key, value in os.environ.items() if not key.startswith('SUPABASE_')},
+        'PORT': str(port),
+        'WEB_CONCURRENCY': str(workers),
+        'ENVIRONMENT': 'production',
+        'LISTING_STORE': 'sqlite',
+        'LOCAL_STORE_PATH': os.path.join(directory, 'listings.db'),
+        'COORDINATION_PATH': os.path.join(directory, 'coordination.db'),
+        'DEMAND_PATH': os.path.join(directory, 'demand.db'),
+        'CIRCUIT_BREAKER_PATH': os.path.join(directory, 'circuit_breaker.db'),
+        'RUN_LEDGER_PATH': os.path.join(directory, 'run_ledger.db'),
+        'WORK_QUEUE_PATH': os.path.join(directory, 'work_queue.db'),
+        'FX_CACHE_PATH': os.path.join(directory, 'fx_rates.json'),
+        'SPOOL_DIR': os.path.join(directory, 'spool'),
+        'TRACE_DIR': os.path.join(directory, 'traces'),
+        'TRACE_SAMPLE_RATE': '0',
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(directory, f'metrics-{workers}'),
+    }
+    return subprocess.Popen(
+        [sys.executable, 'server.py'], cwd=SERVER_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def server_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU of a process and its descendants (Linux /proc), or None"""
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    parents, cpu = {}, {}
+    try:
+        entries = [entry for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return None
+    for entry in entries:
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        cpu[int(entry)] = (int(fields[11]) + int(fields[12])) / ticks
+
+    def descends(child: int) -> bool:
+        while child > 1:
+            if child == pid:
+                return True
+            child = parents.get(child, 0)
+        return False
+
+    return sum(seconds for process, seconds in cpu.items() if descends(process))
+
+
+def wait_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f'{url}/health', timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'server at {url} did not come up')
+
+
+async def hammer(url: str, seconds: float, connections: int):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + seconds
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        async def connection(worker: int):
+            nonlocal errors
+            rng = random.Random(worker)
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(f'/cache/{rng.choice(QUERIES)}')
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(connection(i) for i in range(connections)))
+    return latencies, errors
+
+
+def client_process(args):
+    url, seconds, connections = args
+    return asyncio.run(hammer(url, seconds, connections))
+
+
+def run(workers: int, seconds: float, connections: int, clients: int, directory: str) -> dict:
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = start_server(workers, port, directory)
+    try:
+        wait_ready(url)
+        # Warm up every worker's connections and the shared cache
+        client_process((url, 2, connections))
+        cpu_before = server_cpu_seconds(server.pid)
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(client_process, [(url, seconds, connections // clients or 1)] * clients)
+        cpu_after = server_cpu_seconds(server.pid)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        'workers': workers,
+        'requests': len(latencies),
+        'errors': sum(result[1] for result in results),
+        'rps': len(latencies) / seconds,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        'cpu_ms': (cpu_after - cpu_before) * 1000 / len(latencies) if latencies and cpu_before is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('workers', nargs='*', type=int, default=[1, 2, 4])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--connections', type=int, default=64, help='concurrent requests in flight')
+    parser.add_argument('--clients', type=int, default=2, help='load generator processes')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs; {args.connections} connections from {args.clients} client processes, "
+          f"{args.seconds:.0f}s per run")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'CPU ms/req':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        seed_store(os.path.join(directory, 'listings.db'))
+        baseline = None
+        for workers in args.workers:
+            result = run(workers, args.seconds, args.connections, args.clients, directory)
+            baseline = baseline or result['rps']
+            cpu_ms = f"{result['cpu_ms']:.2f}" if result['cpu_ms'] is not None else '-'
+            print(f"{workers:>8} {result['rps']:>10,.0f} {result['rps'] / baseline:>7.2f}x "
+                  f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7} {cpu_ms:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Admission control for scrapes started by the API
+Every scrape (one Prefect flow, several spider processes and browsers) needs
+a slot; at most SCRAPE_CONCURRENCY run at once. Others wait in a priority
+queue: interactive requests (a caller is waiting on /scrape) go ahead of
+batch and background work (stale-while-revalidate refreshes, /scrape/async),
+and SCRAPE_INTERACTIVE_RESERVED slots are only ever given to interactive
+requests, so background work cannot fill the box.
+
+When the queue holds SCRAPE_QUEUE_LIMIT waiting scrapes, new ones are
+rejected (429); a waiting caller that gets no slot within
+SCRAPE_QUEUE_TIMEOUT seconds is turned away (503). Both carry a Retry-After
+estimated from recent scrape durations. Cached reads never need a slot.
+
+With a coordinator (COORDINATION_PATH, see coordination.py) the slot count
+is shared by every API process on the host: a running scrape also holds one
+of the leases 'scrape-slot:0' .. 'scrape-slot:<limit - 1>', the top
+SCRAPE_INTERACTIVE_RESERVED of them only for interactive scrapes. Priority
+ordering and the wait queue stay per process; waiters poll for a slot freed
+in another process.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import socket
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from pricing_scrapers.coordination import Coordinator, get_coordinator
+from pricing_scrapers.metrics import (
+    SCRAPE_QUEUE_DEPTH,
+    SCRAPE_QUEUE_WAIT_SECONDS,
+    SCRAPE_SLOTS_IN_USE,
+    SCRAPES_REJECTED,
+)
+
+INTERACTIVE, BATCH, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch', BACKGROUND: 'background'}
+
+# Assumed scrape duration before any has finished (for Retry-After)
+DEFAULT_SCRAPE_SECONDS = 60
+
+# Coordinator leases holding the shared slots
+SLOT_LEASE_PREFIX = 'scrape-slot:'
+
+
+class Overloaded(Exception):
+    """A scrape was not admitted; status_code is 429 or 503"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded scrape concurrency with a priority wait queue
+
+    Args:
+        limit: Scrapes running at once
+        max_waiting: Scrapes allowed to wait for a slot
+        max_wait_seconds: Longest wait of interactive and batch scrapes
+            (background scrapes wait as long as it takes)
+        reserved_interactive: Slots only interactive scrapes may use
+        coordinator: Share the slots with every process using it
+            (default: slots are per process)
+        slot_ttl: Lifetime of a shared slot lease, renewed while held, so
+            the slots of a crashed process come back
+        poll_interval: Seconds between checks for shared slots freed in
+            other processes
+    """
+
+    def __init__(self, limit: int = 3, max_waiting: int = 20, max_wait_seconds: float = 30,
+                 reserved_interactive: int = 1, coordinator: Coordinator = None, slot_ttl: float = 60,
+                 poll_interval: float = 0.5):
+        self.limit = max(limit, 1)
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.reserved_interactive = min(max(reserved_interactive, 0), self.limit - 1)
+        self.running = {priority: 0 for priority in PRIORITY_NAMES}
+        self._waiters: List[tuple] = []  # heap of (priority, sequence, enqueued, future)
+        self._sequence = itertools.count()
+        self._durations = deque(maxlen=50)
+        self.coordinator = coordinator
+        self.slot_ttl = slot_ttl
+        self.poll_interval = poll_interval
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.shared: Dict[int, List[str]] = {priority: [] for priority in PRIORITY_NAMES}
+        self._maintenance: Optional[asyncio.Task] = None
+        self._renewed_at = 0.0
+
+    def _can_run(self, priority: int) -> bool:
+        running = sum(self.running.values())
+        if running >= self.limit:
+            return False
+        if priority != INTERACTIVE:
+            return running - self.running[INTERACTIVE] < self.limit - self.reserved_interactive
+        return True
+
+    def _waiting(self) -> List[tuple]:
+        return [waiter for waiter in self._waiters if not waiter[3].done()]
+
+    def _take_shared(self, priority: int) -> bool:
+        """Take a free shared slot lease; reserved slots (the top ones) only for interactive scrapes"""
+        names = [f'{SLOT_LEASE_PREFIX}{index}' for index in range(self.limit)]
+        if priority == INTERACTIVE:
+            names.reverse()
+        else:
+            names = names[:self.limit - self.reserved_interactive]
+        held = {name for leases in self.shared.values() for name in leases}
+        for name in names:
+            if name not in held and self.coordinator.acquire(name, self.owner, self.slot_ttl):
+                self.shared[priority].append(name)
+                return True
+        return False
+
+    def _start(self, priority: int) -> bool:
+        """Take a slot if one is free for this priority"""
+        if not self._can_run(priority):
+            return False
+        if self.coordinator and not self._take_shared(priority):
+            return False
+        self.running[priority] += 1
+        SCRAPE_SLOTS_IN_USE.labels(PRIORITY_NAMES[priority]).inc()
+        return True
+
+    def _maintain_shared(self):
+        """Keep renewing shared slots and polling for freed ones while any are held or awaited"""
+        if self.coordinator and (self._maintenance is None or self._maintenance.done()):
+            self._maintenance = asyncio.get_running_loop().create_task(self._maintain())
+
+    async def _maintain(self):
+        while self._waiting() or any(self.shared.values()):
+            await asyncio.sleep(self.poll_interval)
+            if time.monotonic() - self._renewed_at >= self.slot_ttl / 3:
+                self._renewed_at = time.monotonic()
+                for name in [name for leases in self.shared.values() for name in leases]:
+                    self.coordinator.acquire(name, self.owner, self.slot_ttl)
+            self._wake()
+
+    def _update_depth(self):
+        depth = {priority: 0 for priority in PRIORITY_NAMES}
+        for priority, _, _, _ in self._waiting():
+            depth[priority] += 1
+        for priority, waiting in depth.items():
+            SCRAPE_QUEUE_DEPTH.labels(PRIORITY_NAMES[priority]).set(waiting)
+
+    def _wake(self):
+        """Hand free slots to waiters, highest priority first"""
+        while self._waiters:
+            priority, _, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._start(priority):
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        self._update_depth()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free for a new request"""
+        mean = sum(self._durations) / len(self._durations) if self._durations else DEFAULT_SCRAPE_SECONDS
+        rounds = math.ceil((len(self._waiting()) + 1) / self.limit)
+        return int(min(max(mean * rounds, 1), 600))
+
+    def check(self, priority: int = BACKGROUND):
+        """Raise Overloaded if a scrape of this priority would be rejected now"""
+        if not self._can_run(priority) and len(self._waiting()) >= self.max_waiting:
+            SCRAPES_REJECTED.labels(PRIORITY_NAMES[priority], 'queue_full').inc()
+            raise Overloaded(
+                f"scrape queue is full ({len(self._waiting())} waiting)", status_code=429,
+                retry_after=self.retry_after()
+            )
+
+    async def acquire(self, priority: int = INTERACTIVE) -> float:
+        """
+        Wait for a slot
+
+        Returns:
+            Seconds waited
+
+        Raises:
+            Overloaded: queue full (429) or no slot within max_wait_seconds (503)
+        """
+        self._maintain_shared()
+        waiting_ahead = any(waiter[0] <= priority for waiter in self._waiting())
+        if not waiting_ahead and self._start(priority):
+            SCRAPE_QUEUE_WAIT_SECONDS.labels(PRIORITY_NAMES[priority]).observe(0)
+            return 0.0
+
+        self.check(priority)
+        enqueued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), enqueued, future))
+        self._update_depth()
+        timeout = None if priority == BACKGROUND else self.max_wait_seconds
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait ended
+                self.release(priority)
+            else:
+                future.cancel()
+            self._wake()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            SCRAPES_REJECTED.labels(PRIORITY_NAMES[priority], 'timeout').inc()
+            raise Overloaded(
+                f"no scrape slot free within {self.max_wait_seconds:.0f}s", status_code=503,
+                retry_after=self.retry_after()
+            ) from None
+        waited = time.monotonic() - enqueued
+        SCRAPE_QUEUE_WAIT_SECONDS.labels(PRIORITY_NAMES[priority]).observe(waited)
+        return waited
+
+    def release(self, priority: int, duration: float = None):
+        """Give a slot back, noting how long the scrape took"""
+        self.running[priority] -= 1
+        SCRAPE_SLOTS_IN_USE.labels(PRIORITY_NAMES[priority]).dec()
+        if self.shared[priority]:
+            self.coordinator.release(self.shared[priority].pop(), self.owner)
+        if duration is not None:
+            self._durations.append(duration)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE):
+        """Hold a slot while the block runs; yields the seconds waited"""
+        waited = await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(priority, time.monotonic() - started)
+
+    def status(self) -> Dict:
+        """Slots in use and waiting scrapes per priority, oldest wait, Retry-After"""
+        waiting = self._waiting()
+        now = time.monotonic()
+        return {
+            'limit': self.limit,
+            'reserved_interactive': self.reserved_interactive,
+            'running': {PRIORITY_NAMES[priority]: count for priority, count in self.running.items()},
+            **({'running_all_processes': len(self.coordinator.leases(SLOT_LEASE_PREFIX))} if self.coordinator else {}),
+            'waiting': {
+                name: sum(1 for waiter in waiting if waiter[0] == priority) for priority, name in PRIORITY_NAMES.items()
+            },
+            'max_waiting': self.max_waiting,
+            'oldest_wait_seconds': round(now - min(waiter[2] for waiter in waiting), 2) if waiting else None,
+            'retry_after': self.retry_after(),
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Shared controller configured from the environment"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            limit=int(os.getenv('SCRAPE_CONCURRENCY', 3)),
+            max_waiting=int(os.getenv('SCRAPE_QUEUE_LIMIT', 20)),
+            max_wait_seconds=float(os.getenv('SCRAPE_QUEUE_TIMEOUT', 30)),
+            reserved_interactive=int(os.getenv('SCRAPE_INTERACTIVE_RESERVED', 1)),
+            coordinator=get_coordinator(),
+        )
+    return _controller
@@ -0,0 +1,316 @@
+"""
+Per-category price aggregates maintained at ingest
+One aggregate per (category_key, source, region, currency) and hourly, daily
+and weekly bucket is updated as items are scraped. Each carries exact
+count/min/max/sum and mergeable KLL quantile sketches, so stats over any set
+of sources, regions and time buckets are answered by merging a handful of
+stored aggregates instead of reading listings.
+
+Prices are aggregated in USD (price_usd), so listings scraped in different
+currencies merge into one distribution; the currency key field only labels
+the currency the listings were scraped in.
+
+Deltas are merged into the stored aggregates with optimistic concurrency:
+read the row from the authoritative store, merge, and write it back only if
+its version is unchanged, retrying otherwise, so concurrent writers on any
+node never overwrite each other's counts. Each delta carries an id recorded
+in the row, so a replayed delta is not counted twice.
+"""
+
+import math
+import random
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from time import sleep
+from typing import Dict, Iterable, List, Optional, Tuple
+from pricing_scrapers.sketches import KLLSketch
+
+AGGREGATE_KEY_FIELDS = ('category_key', 'source', 'region', 'currency', 'resolution', 'bucket')
+
+# Currency of every aggregated price
+AGGREGATE_CURRENCY = 'USD'
+
+# Bucket sizes maintained at ingest, finest first
+RESOLUTIONS = ('hour', 'day', 'week')
+
+# Scale applied to quality weights before they are rounded to whole sketch units
+WEIGHT_SCALE = 4
+
+# Read-merge-swap attempts per delta before giving up to a later replay
+MERGE_ATTEMPTS = 8
+
+# Ids of the latest deltas merged into a row, kept to skip replays
+APPLIED_DELTA_HISTORY = 50
+
+
+class AggregateConflict(Exception):
+    """A delta lost every swap to concurrent writers"""
+
+
+def quality_weight(rating: Optional[float], reviews: Optional[int]) -> float:
+    """
+    Weight of a listing in the quality-weighted median
+
+    Well-reviewed, highly rated listings count more; unrated listings are
+    treated as average (3/5) with no reviews.
+    """
+    rating = rating if rating is not None else 3.0
+    reviews = reviews or 0
+    return (rating / 5.0) * (1.0 + math.log1p(reviews))
+
+
+def normalized_price(listing: Dict) -> Optional[float]:
+    """A listing's price in AGGREGATE_CURRENCY: price_usd, or the price of a USD listing without one"""
+    price = listing.get('price_usd')
+    if price is None and (listing.get('currency') or 'USD') == AGGREGATE_CURRENCY:
+        price = listing.get('price')
+    return price
+
+
+def in_aggregate_currency(row: Dict) -> bool:
+    """
+    Whether a stored aggregate row holds AGGREGATE_CURRENCY prices (rows
+    written before aggregates were normalized hold prices in their currency;
+    `python -m pricing_scrapers.history backfill` rebuilds them)
+    """
+    return row['currency'] == AGGREGATE_CURRENCY or (row.get('data') or {}).get('unit') == AGGREGATE_CURRENCY
+
+
+def bucket_start(scraped_at, resolution: str = 'day') -> str:
+    """
+    Start of the bucket containing a scrape timestamp
+
+    Args:
+        scraped_at: datetime or ISO string (naive values are UTC)
+        resolution: 'hour', 'day' or 'week' (weeks start on Monday)
+
+    Returns:
+        UTC ISO timestamp, e.g. '2025-11-10T00:00:00+00:00'
+    """
+    if scraped_at is None:
+        scraped_at = datetime.now(timezone.utc)
+    if isinstance(scraped_at, str):
+        scraped_at = datetime.fromisoformat(scraped_at.replace('Z', '+00:00'))
+    if scraped_at.tzinfo is None:
+        scraped_at = scraped_at.replace(tzinfo=timezone.utc)
+    start = scraped_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    if resolution in ('day', 'week'):
+        start = start.replace(hour=0)
+    if resolution == 'week':
+        start -= timedelta(days=start.weekday())
+    elif resolution not in ('hour', 'day'):
+        raise ValueError(f"Unknown resolution: {resolution}")
+    return start.isoformat()
+
+
+class PriceAggregate:
+    """
+    Mergeable price summary
+
+    count/min/max/sum are exact; percentiles come from a KLL sketch and the
+    quality-weighted median from a second sketch fed with quality weights.
+    Prices flagged as outliers go to a nested aggregate, so stats exclude
+    them by default and can still include them on request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.sum = 0.0
+        self.sketch = KLLSketch()
+        self.weighted_sketch = KLLSketch()
+        self.outliers: Optional['PriceAggregate'] = None
+        self.updated_at: Optional[str] = None
+
+    def add(self, price: float, weight: float = 1.0, outlier: bool = False):
+        """Add one price"""
+        if outlier:
+            self.outliers = self.outliers or PriceAggregate()
+            self.outliers.add(price, weight)
+            self.updated_at = self.outliers.updated_at
+            return
+        self.count += 1
+        self.sum += price
+        self.min = price if self.min is None else min(self.min, price)
+        self.max = price if self.max is None else max(self.max, price)
+        self.sketch.update(price)
+        self.weighted_sketch.update(price, max(1, round(weight * WEIGHT_SCALE)))
+        self.updated_at = datetime.now(timezone.utc).isoformat()
+
+    def merge(self, other: 'PriceAggregate') -> 'PriceAggregate':
+        """Fold another aggregate (other source, region or time window) into this one"""
+        if other.outliers:
+            self.outliers = (self.outliers or PriceAggregate()).merge(other.outliers)
+            self.updated_at = max(filter(None, [self.updated_at, other.updated_at]), default=None)
+        if not other.count:
+            return self
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        self.weighted_sketch.merge(other.weighted_sketch)
+        self.updated_at = max(filter(None, [self.updated_at, other.updated_at]), default=None)
+        return self
+
+    def summary(self, include_outliers: bool = False) -> Dict:
+        """Stats payload served by /stats"""
+        outliers = self.outliers.count if self.outliers else 0
+        if include_outliers and outliers:
+            combined = PriceAggregate.from_dict(self.to_dict())
+            combined.outliers = None
+            return {**combined.merge(self.outliers).summary(), 'outliers': outliers}
+
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': round(self.sum / self.count, 2) if self.count else None,
+            'p10': self.sketch.quantile(0.10),
+            'p50': self.sketch.quantile(0.50),
+            'p90': self.sketch.quantile(0.90),
+            'weighted_median': self.weighted_sketch.quantile(0.50),
+            'rank_error': round(self.sketch.rank_error(), 4),
+            'outliers': outliers,
+            'updated_at': self.updated_at,
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'sum': self.sum,
+            'unit': AGGREGATE_CURRENCY,
+            'sketch': self.sketch.to_dict(),
+            'weighted_sketch': self.weighted_sketch.to_dict(),
+            **({'outliers': self.outliers.to_dict()} if self.outliers else {}),
+            'updated_at': self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'PriceAggregate':
+        aggregate = cls()
+        if data:
+            aggregate.count = data.get('count', 0)
+            aggregate.min = data.get('min')
+            aggregate.max = data.get('max')
+            aggregate.sum = data.get('sum', 0.0)
+            aggregate.sketch = KLLSketch.from_dict(data.get('sketch'))
+            aggregate.weighted_sketch = KLLSketch.from_dict(data.get('weighted_sketch'))
+            aggregate.outliers = cls.from_dict(data['outliers']) if data.get('outliers') else None
+            aggregate.updated_at = data.get('updated_at')
+
+            # Aggregates written before sketches kept recent (price, weight) samples
+            for price, weight in data.get('samples', []):
+                aggregate.sketch.update(price)
+                aggregate.weighted_sketch.update(price, max(1, round(weight * WEIGHT_SCALE)))
+        return aggregate
+
+
+def delta_records(deltas: Dict[Tuple, PriceAggregate]) -> List[Dict]:
+    """
+    Deltas as self-contained records (key fields, data and a unique id), the
+    form they are spooled and merged in
+    """
+    return [
+        {'id': uuid.uuid4().hex, **dict(zip(AGGREGATE_KEY_FIELDS, key)), 'data': delta.to_dict()}
+        for key, delta in deltas.items()
+    ]
+
+
+def merge_delta(store, record: Dict, attempts: int = MERGE_ATTEMPTS) -> bool:
+    """
+    Merge one delta record into its stored aggregate (read, merge, swap)
+
+    Returns:
+        False if the delta had already been merged
+
+    Raises:
+        AggregateConflict: every attempt lost to a concurrent writer
+    """
+    key = {field: record[field] for field in AGGREGATE_KEY_FIELDS}
+    delta = PriceAggregate.from_dict(record['data'])
+    for attempt in range(attempts):
+        if attempt:
+            sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        row = store.fetch_aggregate(key)
+        # A bucket still holding local-currency prices is started over
+        current = row['data'] if row and in_aggregate_currency(row) else {}
+        applied = current.get('applied_deltas', [])
+        if record['id'] in applied:
+            return False
+        merged = PriceAggregate.from_dict(current).merge(delta)
+        data = {**merged.to_dict(), 'applied_deltas': (applied + [record['id']])[-APPLIED_DELTA_HISTORY:]}
+        if store.swap_aggregate({**key, 'data': data, 'updated_at': merged.updated_at}, row['version'] if row else None):
+            return True
+    raise AggregateConflict(f"gave up merging into {key} after {attempts} conflicting writes")
+
+
+def merge_delta_records(store, records: List[Dict]) -> int:
+    """
+    Merge delta records into the stored aggregates
+
+    Returns:
+        Number of aggregates written (replayed deltas are skipped)
+    """
+    return sum(merge_delta(store, record) for record in records)
+
+
+def merge_into_store(store, deltas: Dict[Tuple, PriceAggregate]) -> int:
+    """
+    Merge freshly ingested deltas into the stored aggregates
+
+    Args:
+        store: ListingStore
+        deltas: PriceAggregate per (category_key, source, region, currency, resolution, bucket)
+
+    Returns:
+        Number of aggregates written
+    """
+    return merge_delta_records(store, delta_records(deltas))
+
+
+def combine_aggregates(rows: Iterable[Dict], group_by: str = 'source', include_outliers: bool = False) -> List[Dict]:
+    """
+    Merge stored aggregate rows at query time
+
+    Prices are in AGGREGATE_CURRENCY whatever the listings' currency;
+    group_by='source' keeps sources apart, group_by='all' merges sources,
+    regions and days. Rows still holding local-currency prices are skipped.
+    Outlier prices are only counted with include_outliers.
+
+    Returns:
+        One summary per group, listing the currencies the prices were scraped in
+    """
+    groups: Dict[Optional[str], PriceAggregate] = {}
+    buckets: Dict[Optional[str], List[str]] = {}
+    currencies: Dict[Optional[str], set] = {}
+    for row in rows:
+        if not in_aggregate_currency(row):
+            continue
+        key = row['source'] if group_by == 'source' else None
+        groups.setdefault(key, PriceAggregate()).merge(PriceAggregate.from_dict(row['data']))
+        buckets.setdefault(key, []).append(row.get('bucket'))
+        currencies.setdefault(key, set()).add(row['currency'])
+
+    results = []
+    for source, aggregate in sorted(groups.items(), key=lambda g: g[0] or ''):
+        days = sorted(filter(None, buckets[source]))
+        results.append({
+            **({'source': source} if group_by == 'source' else {}),
+            'currency': AGGREGATE_CURRENCY,
+            'scraped_currencies': sorted(currencies[source]),
+            'from': days[0] if days else None,
+            'to': days[-1] if days else None,
+            **aggregate.summary(include_outliers),
+        })
+    return results
+
+
+def window_start(days: int, today: Optional[date] = None) -> str:
+    """First daily bucket of a window of `days` days ending today"""
+    today = today or datetime.now(timezone.utc).date()
+    return bucket_start(datetime.combine(today - timedelta(days=max(days, 1) - 1), time()), 'day')
@@ -0,0 +1,240 @@
+"""
+Columnar archive of raw scrape output
+Items are streamed into zstd-compressed Parquet files partitioned by
+scrape date, source and category:
+
+    <ARCHIVE_DIR>/dt=2025-11-08/src=fiverr/cat=logo-design/part-<run>-<n>.parquet
+
+so historical analysis reads only the partitions and columns it needs.
+"""
+
+import os
+import re
+import uuid
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Optional
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from pricing_scrapers.storage import to_utc_iso
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'archive')
+
+ARCHIVE_SCHEMA = pa.schema([
+    ('source', pa.string()),
+    ('title', pa.string()),
+    ('price', pa.float64()),
+    ('currency', pa.string()),
+    ('price_usd', pa.float64()),
+    ('rating', pa.float64()),
+    ('reviews', pa.int64()),
+    ('delivery_time', pa.int64()),
+    ('seller_name', pa.string()),
+    ('seller_level', pa.string()),
+    ('description', pa.string()),
+    ('category', pa.string()),
+    ('region', pa.string()),
+    ('url', pa.string()),
+    ('is_outlier', pa.bool_()),
+    ('scraped_at', pa.timestamp('us', tz='UTC')),
+])
+
+PARTITION_SCHEMA = pa.schema([
+    ('dt', pa.string()),
+    ('src', pa.string()),
+    ('cat', pa.string()),
+])
+
+
+def partition_slug(value: str) -> str:
+    """Filesystem-safe partition value ('Logo Design' -> 'logo-design')"""
+    return re.sub(r'[^a-z0-9]+', '-', (value or 'unknown').lower()).strip('-') or 'unknown'
+
+
+def _column_value(field: pa.Field, value):
+    if value is None or value == '':
+        return None
+    if pa.types.is_timestamp(field.type):
+        return datetime.fromisoformat(to_utc_iso(value))
+    if pa.types.is_floating(field.type):
+        return float(value)
+    if pa.types.is_integer(field.type):
+        return int(value)
+    if pa.types.is_boolean(field.type):
+        return bool(value)
+    return str(value)
+
+
+class ArchiveWriter:
+    """
+    Buffers rows per partition and writes each partition as Parquet row groups
+
+    Args:
+        root: Archive root directory
+        run_id: Identifies this writer's files within a partition
+        rows_per_file: Rows buffered per partition before a file is written
+    """
+
+    def __init__(self, root: str = None, run_id: str = None, rows_per_file: int = 5000):
+        self.root = root or os.getenv('ARCHIVE_DIR', DEFAULT_ARCHIVE_DIR)
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.rows_per_file = rows_per_file
+        self.buffers: Dict[tuple, List[Dict]] = defaultdict(list)
+        self.files_written = 0
+        self.rows_written = 0
+
+    def write(self, item: Dict):
+        """Buffer one item, flushing its partition once it is large enough"""
+        scraped_at = to_utc_iso(item.get('scraped_at'))
+        key = (scraped_at[:10], partition_slug(item.get('source')), partition_slug(item.get('category')))
+        self.buffers[key].append({**item, 'scraped_at': scraped_at})
+        if len(self.buffers[key]) >= self.rows_per_file:
+            self._flush_partition(key)
+
+    def _flush_partition(self, key: tuple):
+        rows = self.buffers.pop(key, [])
+        if not rows:
+            return
+
+        table = pa.Table.from_pydict(
+            {
+                field.name: [_column_value(field, row.get(field.name)) for row in rows]
+                for field in ARCHIVE_SCHEMA
+            },
+            schema=ARCHIVE_SCHEMA,
+        )
+        dt, src, cat = key
+        directory = os.path.join(self.root, f'dt={dt}', f'src={src}', f'cat={cat}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'part-{self.run_id}-{self.files_written:05d}.parquet')
+        pq.write_table(table, path, compression='zstd')
+
+        self.files_written += 1
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Write all buffered partitions"""
+        for key in list(self.buffers):
+            self._flush_partition(key)
+
+
+class ArchiveFeedExporter:
+    """
+    Scrapy extension streaming scraped items into the Parquet archive
+    Enabled with ARCHIVE_ENABLED; ARCHIVE_DIR sets the root directory
+    """
+
+    def __init__(self, root: str, rows_per_file: int):
+        self.root = root
+        self.rows_per_file = rows_per_file
+        self.writer: Optional[ArchiveWriter] = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ARCHIVE_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            root=crawler.settings.get('ARCHIVE_DIR') or None,
+            rows_per_file=crawler.settings.getint('ARCHIVE_ROWS_PER_FILE', 5000),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.writer = ArchiveWriter(self.root, rows_per_file=self.rows_per_file)
+
+    def item_scraped(self, item, response, spider):
+        self.writer.write(dict(item))
+
+    def spider_closed(self, spider):
+        self.writer.close()
+        spider.logger.info(
+            f'Archived {self.writer.rows_written} items in {self.writer.files_written} files '
+            f'under {self.writer.root}'
+        )
+
+
+def _day(value) -> str:
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+
+def scan(
+    columns: Optional[List[str]] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    sources: Optional[List[str]] = None,
+    categories: Optional[List[str]] = None,
+    root: str = None,
+):
+    """
+    Read selected columns from the archive
+
+    Partition filters prune directories before any file is opened, and only
+    the requested columns are decoded.
+
+    Args:
+        columns: Columns to read (default: all)
+        start: First scrape date (inclusive)
+        end: Last scrape date (inclusive)
+        sources: Source names, e.g. ['Fiverr', 'Upwork']
+        categories: Categories, e.g. ['logo design']
+        root: Archive root directory
+
+    Returns:
+        pandas DataFrame
+    """
+    root = root or os.getenv('ARCHIVE_DIR', DEFAULT_ARCHIVE_DIR)
+    if not os.path.isdir(root):
+        return ARCHIVE_SCHEMA.empty_table().to_pandas()[columns or ARCHIVE_SCHEMA.names]
+
+    dataset = ds.dataset(
+        root,
+        schema=pa.unify_schemas([ARCHIVE_SCHEMA, PARTITION_SCHEMA]),
+        format='parquet',
+        partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'),
+    )
+
+    expression = None
+    conditions = []
+    if start:
+        conditions.append(ds.field('dt') >= _day(start))
+    if end:
+        conditions.append(ds.field('dt') <= _day(end))
+    if sources:
+        conditions.append(ds.field('src').isin([partition_slug(s) for s in sources]))
+    if categories:
+        conditions.append(ds.field('cat').isin([partition_slug(c) for c in categories]))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(columns=columns or ARCHIVE_SCHEMA.names, filter=expression)
+    return table.to_pandas()
+
+
+def main():
+    """CLI: python -m pricing_scrapers.archive [category] [days]"""
+    import sys
+    from datetime import timedelta
+
+    category = sys.argv[1] if len(sys.argv) > 1 else None
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    frame = scan(
+        columns=['source', 'price', 'scraped_at'],
+        start=date.today() - timedelta(days=days),
+        categories=[category] if category else None,
+    )
+    print(f"{len(frame)} archived listings")
+    if len(frame):
+        print(frame.groupby('source')['price'].describe())
+
+
+if __name__ == '__main__':
+    main()
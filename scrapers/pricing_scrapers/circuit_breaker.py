@@ -0,0 +1,335 @@
+"""
+Per-source circuit breaker
+Tracks the outcome of every crawl per spider across runs. A source whose
+recent crawls keep yielding nothing (changed markup, bot challenges, outages)
+is opened and skipped outright instead of launching a browser and waiting out
+selector timeouts and retries; after a cooldown one probe crawl is let through
+(half-open) and either closes the breaker again or reopens it for longer.
+
+    closed --(CIRCUIT_FAILURE_THRESHOLD failed runs in a row)--> open
+    open --(cooldown elapsed)--> half_open (one probe crawl)
+    half_open --(probe succeeds)--> closed
+    half_open --(probe fails)--> open (cooldown doubled, up to the maximum)
+
+A run fails when it scrapes no items or when at least CIRCUIT_ERROR_RATE of
+its requests errored. State lives in a small SQLite file shared by the API,
+Prefect flows and spider processes.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from scrapy import signals
+from scrapy.exceptions import CloseSpider, NotConfigured
+
+DEFAULT_CIRCUIT_BREAKER_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'circuit_breaker.db')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+OPEN_REASON = 'circuit_open'
+
+# Outcomes kept per source for status reporting
+OUTCOME_HISTORY = 20
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class CircuitBreaker:
+    """
+    Persistent closed/open/half-open state per source
+
+    Args:
+        path: SQLite file (CIRCUIT_BREAKER_PATH)
+        failure_threshold: Consecutive failed runs that open the breaker
+        error_rate: Share of errored requests that makes a run count as failed
+        cooldown_minutes: First open period; doubled after each failed probe
+        max_cooldown_minutes: Upper bound of the open period
+        probe_timeout_minutes: A probe not reported back within this time is
+            assumed lost and another probe is allowed
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS circuit_breakers (
+            source TEXT PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'closed',
+            consecutive_failures INTEGER NOT NULL DEFAULT 0,
+            open_count INTEGER NOT NULL DEFAULT 0,
+            opened_at TEXT,
+            retry_at TEXT,
+            probe_started_at TEXT,
+            outcomes TEXT NOT NULL DEFAULT '[]',
+            updated_at TEXT
+        );
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        failure_threshold: int = 3,
+        error_rate: float = 0.5,
+        cooldown_minutes: float = 30,
+        max_cooldown_minutes: float = 24 * 60,
+        probe_timeout_minutes: float = 15,
+    ):
+        self.path = path or os.getenv('CIRCUIT_BREAKER_PATH', DEFAULT_CIRCUIT_BREAKER_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.cooldown = timedelta(minutes=cooldown_minutes)
+        self.max_cooldown = timedelta(minutes=max_cooldown_minutes)
+        self.probe_timeout = timedelta(minutes=probe_timeout_minutes)
+        self._local = threading.local()
+        self.connection.executescript(self.SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def _row(self, source: str) -> Dict:
+        row = self.connection.execute('SELECT * FROM circuit_breakers WHERE source = ?', (source,)).fetchone()
+        if row is None:
+            return {
+                'source': source, 'state': CLOSED, 'consecutive_failures': 0, 'open_count': 0,
+                'opened_at': None, 'retry_at': None, 'probe_started_at': None, 'outcomes': [],
+            }
+        return {**dict(row), 'outcomes': json.loads(row['outcomes'])}
+
+    def _save(self, row: Dict):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO circuit_breakers '
+            '(source, state, consecutive_failures, open_count, opened_at, retry_at, probe_started_at, outcomes, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                row['source'], row['state'], row['consecutive_failures'], row['open_count'],
+                row['opened_at'], row['retry_at'], row['probe_started_at'],
+                json.dumps(row['outcomes'][-OUTCOME_HISTORY:]), _now().isoformat(),
+            ),
+        )
+
+    def _probe_in_flight(self, row: Dict, now: datetime) -> bool:
+        started = _parse(row['probe_started_at'])
+        return bool(started and now - started < self.probe_timeout)
+
+    def should_skip(self, source: str) -> bool:
+        """
+        Whether a crawl of this source would be refused right now (read-only)
+
+        Used by flows to skip a source before starting a spider process; the
+        spider itself claims the probe with allow().
+        """
+        row = self._row(source)
+        now = _now()
+        if row['state'] == OPEN:
+            return now < _parse(row['retry_at'])
+        if row['state'] == HALF_OPEN:
+            return self._probe_in_flight(row, now)
+        return False
+
+    def allow(self, source: str) -> bool:
+        """
+        Claim permission to crawl a source
+
+        Closed breakers always allow. An open breaker whose cooldown has
+        elapsed turns half-open and lets exactly this crawl through as the
+        probe; concurrent callers are refused until the probe reports back.
+
+        Returns:
+            False when the crawl should be skipped
+        """
+        now = _now()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self._row(source)
+            if row['state'] == CLOSED:
+                return True
+            if row['state'] == OPEN and now < _parse(row['retry_at']):
+                return False
+            if row['state'] == HALF_OPEN and self._probe_in_flight(row, now):
+                return False
+            row['state'] = HALF_OPEN
+            row['probe_started_at'] = now.isoformat()
+            self._save(row)
+            return True
+
+    def is_failure(self, items: int, requests: int, errors: int) -> bool:
+        """A run fails when it yields nothing or mostly errors"""
+        return items <= 0 or (requests > 0 and errors / requests >= self.error_rate)
+
+    def record(self, source: str, items: int, requests: int = 0, errors: int = 0, reason: str = None) -> str:
+        """
+        Record the outcome of a crawl and update the state
+
+        Args:
+            source: Spider name
+            items: Items scraped
+            requests: Requests downloaded
+            errors: Requests that ended in an exception or an HTTP error status
+            reason: Scrapy finish reason
+
+        Returns:
+            New state
+        """
+        now = _now()
+        failed = self.is_failure(items, requests, errors)
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self._row(source)
+            row['outcomes'].append({
+                'finished_at': now.isoformat(),
+                'items': items,
+                'requests': requests,
+                'errors': errors,
+                'reason': reason,
+                'failed': failed,
+            })
+
+            if not failed:
+                row.update(state=CLOSED, consecutive_failures=0, open_count=0,
+                           opened_at=None, retry_at=None, probe_started_at=None)
+            else:
+                row['consecutive_failures'] += 1
+                if row['state'] == HALF_OPEN or row['consecutive_failures'] >= self.failure_threshold:
+                    cooldown = min(self.cooldown * 2 ** row['open_count'], self.max_cooldown)
+                    row.update(state=OPEN, opened_at=now.isoformat(),
+                               retry_at=(now + cooldown).isoformat(), probe_started_at=None)
+                    row['open_count'] += 1
+            self._save(row)
+            return row['state']
+
+    def reset(self, source: str):
+        """Close a breaker by hand (e.g. after fixing a spider's selectors)"""
+        with self.connection:
+            self.connection.execute('DELETE FROM circuit_breakers WHERE source = ?', (source,))
+
+    def status(self) -> List[Dict]:
+        """State of every tracked source"""
+        rows = self.connection.execute('SELECT source FROM circuit_breakers ORDER BY source').fetchall()
+        results = []
+        for row in rows:
+            state = self._row(row['source'])
+            outcomes = state.pop('outcomes')
+            state['recent_runs'] = len(outcomes)
+            state['recent_failures'] = sum(1 for outcome in outcomes if outcome['failed'])
+            state['last_outcome'] = outcomes[-1] if outcomes else None
+            results.append(state)
+        return results
+
+
+_breaker: Optional[CircuitBreaker] = None
+
+
+def get_circuit_breaker(settings=None) -> CircuitBreaker:
+    """
+    Shared breaker configured from Scrapy settings (or the project settings module)
+    """
+    global _breaker
+    if _breaker is None:
+        if settings is None:
+            from scrapy.settings import Settings
+            from pricing_scrapers import settings as settings_module
+            settings = Settings()
+            settings.setmodule(settings_module)
+        _breaker = CircuitBreaker(
+            path=settings.get('CIRCUIT_BREAKER_PATH') or None,
+            failure_threshold=settings.getint('CIRCUIT_FAILURE_THRESHOLD', 3),
+            error_rate=settings.getfloat('CIRCUIT_ERROR_RATE', 0.5),
+            cooldown_minutes=settings.getfloat('CIRCUIT_COOLDOWN_MINUTES', 30),
+            max_cooldown_minutes=settings.getfloat('CIRCUIT_MAX_COOLDOWN_MINUTES', 24 * 60),
+        )
+    return _breaker
+
+
+def crawl_errors(stats: Dict) -> int:
+    """Requests of a crawl that ended in a download exception or an HTTP error status"""
+    errors = stats.get('downloader/exception_count', 0)
+    prefix = 'downloader/response_status_count/'
+    for key, count in stats.items():
+        if key.startswith(prefix) and key[len(prefix):].isdigit() and int(key[len(prefix):]) >= 400:
+            errors += count
+    return errors
+
+
+class CircuitBreakerExtension:
+    """
+    Skip crawls of sources whose breaker is open and record every crawl's outcome
+
+    Enabled with CIRCUIT_BREAKER_ENABLED. A refused crawl has its start
+    requests dropped by CircuitBreakerMiddleware (so no browser is launched),
+    closes with reason 'circuit_open' and is not counted as an outcome.
+    """
+
+    def __init__(self, crawler, breaker: CircuitBreaker):
+        self.crawler = crawler
+        self.breaker = breaker
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CIRCUIT_BREAKER_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler, get_circuit_breaker(crawler.settings))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        if self.breaker.allow(spider.name):
+            return
+        spider.circuit_open = True
+        self.crawler.stats.set_value('circuit_breaker/skipped', True, spider=spider)
+        spider.logger.warning(f'Circuit breaker open for {spider.name}, skipping crawl')
+
+    def spider_idle(self, spider):
+        if getattr(spider, 'circuit_open', False):
+            raise CloseSpider(OPEN_REASON)
+
+    def spider_closed(self, spider, reason):
+        if getattr(spider, 'circuit_open', False):
+            return
+        stats = self.crawler.stats.get_stats(spider)
+        state = self.breaker.record(
+            spider.name,
+            items=stats.get('item_scraped_count', 0),
+            requests=stats.get('downloader/request_count', 0),
+            errors=crawl_errors(stats),
+            reason=reason,
+        )
+        if state != CLOSED:
+            spider.logger.warning(f'Circuit breaker for {spider.name} is {state}')
+
+
+def main():
+    """CLI: python -m pricing_scrapers.circuit_breaker [status|reset SOURCE]"""
+    import sys
+
+    breaker = get_circuit_breaker()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+
+    if command == 'reset' and len(sys.argv) > 2:
+        breaker.reset(sys.argv[2])
+        print(f"Reset circuit breaker for {sys.argv[2]}")
+
+    for state in breaker.status():
+        print(
+            f"{state['source']}: {state['state']} "
+            f"({state['recent_failures']}/{state['recent_runs']} recent runs failed, retry at {state['retry_at']})"
+        )
+
+
+if __name__ == '__main__':
+    main()
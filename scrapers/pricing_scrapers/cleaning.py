@@ -0,0 +1,272 @@
+"""
+Cleaning and validation of scraped items
+clean_item cleans one item at a time as it comes out of a spider (the default
+DataCleaningPipeline). clean_batch does the same to a batch of items as pandas
+columns (Arrow-backed strings, .str ops, no per-row Python) for
+BatchCleaningPipeline; pandas has a fixed cost per batch, so it only keeps up
+with clean_item from about 5000 items per batch (see
+benchmarks/cleaning_benchmark.py). Validation ranges and required fields come
+from the MarketListing model, so the model stays the single definition of
+what a valid listing is, without paying for a pydantic model per item.
+"""
+
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from pricing_scrapers.currency import normalize_currency
+from pricing_scrapers.items import MarketListing
+
+# Currency symbols and separators stripped from scraped prices
+PRICE_NOISE = re.compile(r'[,\s$₹€£]')
+
+# Fields rewritten by cleaning; other fields pass through untouched
+CLEANED_FIELDS = ('price', 'currency', 'rating', 'reviews', 'delivery_time')
+
+NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+DIGITS = re.compile(r'\d+')
+
+# Raw columns of a batch are cast to Arrow strings, whose .str ops run in C++
+STRING_DTYPE = 'string[pyarrow]'
+
+
+@lru_cache(maxsize=None)
+def field_bounds(model: type = MarketListing) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """(ge, le) bounds of every constrained field of a pydantic model"""
+    bounds = {}
+    for name, field in model.model_fields.items():
+        low = high = None
+        for constraint in field.metadata:
+            low = getattr(constraint, 'ge', low)
+            high = getattr(constraint, 'le', high)
+        if low is not None or high is not None:
+            bounds[name] = (low, high)
+    return bounds
+
+
+@lru_cache(maxsize=None)
+def required_fields(model: type = MarketListing) -> Tuple[str, ...]:
+    """Fields a pydantic model requires"""
+    return tuple(name for name, field in model.model_fields.items() if field.is_required())
+
+
+def to_number(text: str) -> Optional[float]:
+    """Parse a numeric string; anything else becomes None"""
+    return float(text) if NUMBER.fullmatch(text) else None
+
+
+def clean_price(text: str) -> Optional[float]:
+    """'$1,200' -> 1200.0; unparseable prices become None"""
+    return to_number(PRICE_NOISE.sub('', text))
+
+
+def clean_rating(text: str) -> Optional[float]:
+    """Ratings above 5 are scraped without their decimal point and divided by 10 ('49' -> 4.9)"""
+    rating = to_number(text)
+    return rating / 10 if rating is not None and rating > 5 else rating
+
+
+def clean_reviews(text: str) -> int:
+    """'1,234' -> 1234, '1.2k' -> 1200; unparseable counts become 0"""
+    number = to_number(re.sub(r'[,k\s]', '', text))
+    if number is None:
+        return 0
+    return int(number * 1000 if text.endswith('k') else number)
+
+
+def clean_delivery_time(text: str) -> Optional[int]:
+    """'3 days' -> 3, '2 weeks' -> 14 (in days)"""
+    days = DIGITS.search(text)
+    if not days:
+        return None
+    return int(days.group()) * (7 if 'week' in text else 1)
+
+
+CLEANERS = {
+    'price': clean_price,
+    'rating': clean_rating,
+    'reviews': clean_reviews,
+    'delivery_time': clean_delivery_time,
+}
+
+
+def validate(fields: Dict, model: type = MarketListing) -> Optional[str]:
+    """
+    Check cleaned fields against the model
+
+    Returns:
+        Reject reason ('; '-joined, e.g. 'price: below 0'), or None if valid
+    """
+    reasons = []
+    for name in required_fields(model):
+        value = fields.get(name)
+        if value is None or value == '':
+            reasons.append(f'{name}: missing or not a number' if name == 'price' else f'{name}: missing')
+
+    for name, (low, high) in field_bounds(model).items():
+        value = fields.get(name)
+        if value is None:
+            continue
+        if low is not None and value < low:
+            reasons.append(f'{name}: below {low}')
+        if high is not None and value > high:
+            reasons.append(f'{name}: above {high}')
+    return '; '.join(reasons) or None
+
+
+def clean_item(item: Dict, model: type = MarketListing) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Clean and validate one item
+
+    Args:
+        item: Raw item dict as yielded by a spider
+        model: Pydantic model defining required fields and value ranges
+
+    Returns:
+        (cleaned fields, None) to update the item with, or (None, reason) for
+        a rejected item
+    """
+    cleaned = {}
+    for field, cleaner in CLEANERS.items():
+        value = item.get(field)
+        if value is not None:
+            cleaned[field] = cleaner(str(value).strip().lower())
+    if 'currency' in item:
+        cleaned['currency'] = normalize_currency(item['currency'], item.get('region') or 'global')
+
+    reason = validate({**item, **cleaned}, model)
+    if reason:
+        return None, reason
+    cleaned['scraped_at'] = datetime.utcnow().isoformat()
+    return cleaned, None
+
+
+def text_column(column: pd.Series) -> pd.Series:
+    """Raw column as stripped, lowercased Arrow strings; missing values stay NA"""
+    return column.astype(STRING_DTYPE).str.strip().str.lower()
+
+
+def to_numbers(text: pd.Series) -> pd.Series:
+    """Column version of to_number: numeric strings as floats, anything else NaN"""
+    numeric = text.str.fullmatch(NUMBER.pattern).to_numpy(bool, na_value=False)
+    return text.where(numeric).astype('float64[pyarrow]').astype('float64')
+
+
+def clean_price_column(text: pd.Series) -> pd.Series:
+    """Column version of clean_price"""
+    return to_numbers(text.str.replace(PRICE_NOISE.pattern, '', regex=True))
+
+
+def clean_rating_column(text: pd.Series) -> pd.Series:
+    """Column version of clean_rating"""
+    rating = to_numbers(text)
+    return rating.where(~(rating > 5), rating / 10)
+
+
+def clean_reviews_column(text: pd.Series) -> pd.Series:
+    """Column version of clean_reviews; missing counts stay missing"""
+    thousands = text.str.endswith('k').to_numpy(bool, na_value=False)
+    number = to_numbers(text.str.replace(r'[,k\s]', '', regex=True))
+    number = number.where(~thousands, number * 1000)
+    number = number.where(text.isna().to_numpy() | number.notna().to_numpy(), 0)
+    return np.trunc(number).astype('Int64')
+
+
+def clean_delivery_time_column(text: pd.Series) -> pd.Series:
+    """Column version of clean_delivery_time"""
+    weeks = text.str.contains('week').to_numpy(bool, na_value=False)
+    days = text.str.extract(r'(\d+)', expand=False).astype('float64[pyarrow]').astype('float64')
+    return days.where(~weeks, days * 7).astype('Int64')
+
+
+COLUMN_CLEANERS = {
+    'price': clean_price_column,
+    'rating': clean_rating_column,
+    'reviews': clean_reviews_column,
+    'delivery_time': clean_delivery_time_column,
+}
+
+
+def normalize_currency_column(currency: pd.Series, region: pd.Series) -> pd.Series:
+    """normalize_currency per row, computed once per distinct (currency, region)"""
+    pairs = pd.MultiIndex.from_arrays([currency.astype(object), region.astype(object)])
+    distinct = pairs.unique()
+    codes = [
+        normalize_currency(value if isinstance(value, str) else None, where if isinstance(where, str) else 'global')
+        for value, where in distinct
+    ]
+    return pd.Series(codes, index=distinct).reindex(pairs).set_axis(currency.index)
+
+
+def validate_frame(frame: pd.DataFrame, model: type = MarketListing) -> pd.Series:
+    """
+    Column version of validate
+
+    Returns:
+        Reject reason per row ('; '-joined, '' for valid rows)
+    """
+    checks = []
+    for name in required_fields(model):
+        if name not in frame:
+            checks.append((np.ones(len(frame), bool), f'{name}: missing'))
+        elif name == 'price':
+            checks.append((frame[name].isna().to_numpy(bool), f'{name}: missing or not a number'))
+        else:
+            column = frame[name]
+            checks.append(((column.isna() | (column == '')).to_numpy(bool), f'{name}: missing'))
+
+    for name, (low, high) in field_bounds(model).items():
+        if name not in frame:
+            continue
+        column = pd.to_numeric(frame[name], errors='coerce')
+        if low is not None:
+            checks.append(((column < low).to_numpy(bool, na_value=False), f'{name}: below {low}'))
+        if high is not None:
+            checks.append(((column > high).to_numpy(bool, na_value=False), f'{name}: above {high}'))
+
+    # Each row's failed checks as a bitmask; reasons are joined once per distinct mask
+    failed = np.zeros(len(frame), np.int64)
+    for bit, (mask, _) in enumerate(checks):
+        failed |= mask.astype(np.int64) << bit
+    reasons = {
+        code: '; '.join(reason for bit, (_, reason) in enumerate(checks) if code >> bit & 1)
+        for code in np.unique(failed).tolist()
+    }
+    return pd.Series(failed, index=frame.index).map(reasons)
+
+
+def clean_batch(items: List[Dict], model: type = MarketListing) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Clean and validate a batch of items column-wise
+
+    Args:
+        items: Raw item dicts as yielded by the spiders
+        model: Pydantic model defining required fields and value ranges
+
+    Returns:
+        (cleaned fields, reject reasons), one row per item in input order:
+        the fields to update each item with (see column_values), and the
+        reason it is rejected ('' for valid items)
+    """
+    if not items:
+        return pd.DataFrame(), pd.Series(dtype=object)
+
+    frame = pd.DataFrame.from_records(items)
+    cleaned = pd.DataFrame(index=frame.index)
+    for field, cleaner in COLUMN_CLEANERS.items():
+        if field in frame:
+            cleaned[field] = cleaner(text_column(frame[field]))
+    if 'currency' in frame:
+        region = frame['region'] if 'region' in frame else pd.Series(None, index=frame.index, dtype=object)
+        cleaned['currency'] = normalize_currency_column(frame['currency'], region)
+
+    reasons = validate_frame(frame.assign(**cleaned), model)
+    cleaned['scraped_at'] = datetime.utcnow().isoformat()
+    return cleaned, reasons
+
+
+def column_values(frame: pd.DataFrame) -> Dict[str, List]:
+    """Columns as lists of plain Python values, None for missing"""
+    return {name: column.astype(object).where(column.notna(), None).tolist() for name, column in frame.items()}
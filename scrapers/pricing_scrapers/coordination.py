@@ -0,0 +1,180 @@
+"""
+Cross-process coordination for multi-worker deployments
+With several uvicorn workers (WEB_CONCURRENCY) or API instances on one host,
+in-memory state is per process. This module keeps what must be shared in a
+SQLite file (COORDINATION_PATH, WAL mode) that every process opens:
+
+- Leases: named ownership with an expiry, renewed while the owner works.
+  A scrape of a category takes the lease 'scrape:<category>'; concurrent
+  requests for it, in any worker, wait for that scrape instead of starting
+  their own. A crashed owner's lease expires and the next caller takes over.
+- Shared cache: short-lived JSON values (cached listing lookups), so a hot
+  query hits the listing store once per TTL rather than once per worker.
+
+    python -m pricing_scrapers.coordination [leases|purge]
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_COORDINATION_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'coordination.db')
+
+# Expired entries are purged every this many cache writes (per process)
+PURGE_EVERY_WRITES = 500
+
+
+class Coordinator:
+    """
+    Leases and a TTL cache shared by all processes using the same file
+
+    Args:
+        path: SQLite file (COORDINATION_PATH)
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS shared_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('COORDINATION_PATH', DEFAULT_COORDINATION_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        self.connection.executescript(self.SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Take a lease if it is free, expired or already ours
+
+        Returns:
+            True if `owner` holds the lease for the next `ttl` seconds
+        """
+        now = time.time()
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO leases (name, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, '
+                'acquired_at = CASE WHEN leases.owner = excluded.owner THEN leases.acquired_at ELSE excluded.acquired_at END, '
+                'expires_at = excluded.expires_at '
+                'WHERE leases.expires_at <= ? OR leases.owner = excluded.owner',
+                (name, owner, now, now + ttl, now),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        """Extend a lease we hold; False if it expired and was taken over"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?',
+                (time.time() + ttl, name, owner),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, name: str, owner: str):
+        with self.connection:
+            self.connection.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def holder(self, name: str) -> Optional[Dict]:
+        """Current (unexpired) holder of a lease, or None"""
+        row = self.connection.execute(
+            'SELECT * FROM leases WHERE name = ? AND expires_at > ?', (name, time.time())
+        ).fetchone()
+        return dict(row) if row else None
+
+    def leases(self, prefix: str = '') -> List[Dict]:
+        """Unexpired leases whose name starts with prefix"""
+        rows = self.connection.execute(
+            'SELECT * FROM leases WHERE name >= ? AND name < ? AND expires_at > ? ORDER BY acquired_at',
+            (prefix, prefix + '\uffff', time.time()),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        """Cached value, or None when missing or expired"""
+        row = self.connection.execute(
+            'SELECT value FROM shared_cache WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row['value']) if row else None
+
+    def cache_set(self, key: str, value: Any, ttl: float):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO shared_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, default=str), time.time() + ttl),
+            )
+        self._writes += 1
+        if self._writes % PURGE_EVERY_WRITES == 0:
+            self.purge()
+
+    def cache_delete(self, prefix: str) -> int:
+        """Drop cached values whose key starts with prefix; returns how many"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM shared_cache WHERE key >= ? AND key < ?', (prefix, prefix + '\uffff')
+            )
+        return cursor.rowcount
+
+    def purge(self) -> int:
+        """Delete expired leases and cache entries; returns how many"""
+        now = time.time()
+        with self.connection:
+            removed = self.connection.execute('DELETE FROM leases WHERE expires_at <= ?', (now,)).rowcount
+            removed += self.connection.execute('DELETE FROM shared_cache WHERE expires_at <= ?', (now,)).rowcount
+        return removed
+
+
+_coordinator: Optional[Coordinator] = None
+
+
+def get_coordinator() -> Coordinator:
+    """Shared coordinator configured from the environment"""
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = Coordinator()
+    return _coordinator
+
+
+def main():
+    """CLI: python -m pricing_scrapers.coordination [leases|purge]"""
+    import sys
+
+    coordinator = get_coordinator()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'leases'
+
+    if command == 'purge':
+        print(f"Removed {coordinator.purge()} expired entries")
+    else:
+        now = time.time()
+        for lease in coordinator.leases():
+            print(f"{lease['name']:60s} {lease['owner']:32s} held {now - lease['acquired_at']:6.1f}s, "
+                  f"expires in {lease['expires_at'] - now:5.1f}s")
+
+
+if __name__ == '__main__':
+    main()
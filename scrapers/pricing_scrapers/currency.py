@@ -0,0 +1,239 @@
+"""
+Currency normalization and FX conversion
+Maps scraped currency symbols to ISO codes and converts prices with a locally
+cached USD rate table. Rates are refreshed after FX_RATES_TTL_HOURS from the
+same free providers the backend uses; when they are unreachable the cached
+table (however old) is used, then built-in approximate rates.
+
+Conversions only ever read the table in memory; refresh() does network I/O
+and is called off the hot path (the cleaning pipeline runs it in a thread
+when the spider opens).
+"""
+
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+import requests
+from pricing_scrapers.regions import REGIONS, normalize_region
+
+DEFAULT_FX_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'fx_rates.json')
+FX_RATES_TTL_HOURS = float(os.getenv('FX_RATES_TTL_HOURS', 12))
+# After a failed refresh, providers are not retried for this long
+FX_RETRY_SECONDS = 300
+
+# Providers tried in order, as in backend/src/services/currencyConverter.ts
+FX_PROVIDERS = [
+    ('frankfurter', 'https://api.frankfurter.app/latest?from=USD'),
+    ('exchangerate-api', 'https://api.exchangerate-api.com/v4/latest/USD'),
+]
+
+# Units per USD, used only when no rates were ever fetched
+FALLBACK_RATES = {
+    'USD': 1, 'EUR': 0.92, 'GBP': 0.79, 'INR': 83.12, 'JPY': 149.50,
+    'CNY': 7.24, 'AUD': 1.52, 'CAD': 1.36, 'SGD': 1.34, 'AED': 3.67,
+    'SAR': 3.75, 'ZAR': 18.50, 'BRL': 4.95, 'MXN': 17.20, 'RUB': 92.50,
+    'KRW': 1320, 'IDR': 15600, 'MYR': 4.72, 'THB': 35.50, 'PHP': 56.20,
+    'VND': 24500, 'PKR': 278, 'BDT': 110, 'LKR': 325, 'NGN': 790,
+    'EGP': 31, 'KES': 155,
+}
+
+# Unambiguous symbols; '$' depends on the region (see normalize_currency)
+CURRENCY_SYMBOLS = {
+    '€': 'EUR',
+    '£': 'GBP',
+    '₹': 'INR',
+    'rs': 'INR',
+    'rs.': 'INR',
+    '¥': 'JPY',
+    'a$': 'AUD',
+    'au$': 'AUD',
+    'c$': 'CAD',
+    'ca$': 'CAD',
+    's$': 'SGD',
+    'r$': 'BRL',
+    'mex$': 'MXN',
+    '₽': 'RUB',
+    '₩': 'KRW',
+    '₱': 'PHP',
+    '₦': 'NGN',
+    '฿': 'THB',
+    '₫': 'VND',
+    '₨': 'PKR',
+    '৳': 'BDT',
+    'rp': 'IDR',
+    'rm': 'MYR',
+}
+
+
+@lru_cache(maxsize=1024)
+def normalize_currency(value: Optional[str], region: str = 'global') -> str:
+    """
+    Map a scraped currency ('$', 'US$', '₹', 'Rs.', 'eur') to an ISO code
+
+    A bare '$' is the region's dollar (CAD in 'ca', AUD in 'au') and USD
+    everywhere else; unknown values default to the region's currency.
+    """
+    region_currency = REGIONS[normalize_region(region)]['currency']
+    text = (value or '').strip().lower()
+    if not text:
+        return region_currency
+    if len(text) == 3 and text.isalpha():
+        return text.upper()
+    if text in CURRENCY_SYMBOLS:
+        return CURRENCY_SYMBOLS[text]
+    if text in ('$', 'us$', 'usd$'):
+        return region_currency if region_currency in ('CAD', 'AUD') and text == '$' else 'USD'
+    return region_currency
+
+
+class FXRates:
+    """
+    USD-based FX rate table cached on disk
+
+    Args:
+        path: JSON cache file shared by spider processes and the API
+        ttl_hours: Age after which rates are refetched
+    """
+
+    def __init__(self, path: str = None, ttl_hours: float = FX_RATES_TTL_HOURS):
+        self.path = path or os.getenv('FX_CACHE_PATH', DEFAULT_FX_CACHE_PATH)
+        self.ttl_seconds = ttl_hours * 3600
+        self.rates: Dict[str, float] = {}
+        self.fetched_at = 0.0
+        self.provider = None
+        self.next_attempt = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf8') as cache:
+                data = json.load(cache)
+            self.rates = data['rates']
+            self.fetched_at = data['fetched_at']
+            self.provider = data.get('provider')
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf8') as cache:
+            json.dump({'base': 'USD', 'rates': self.rates, 'fetched_at': self.fetched_at, 'provider': self.provider}, cache)
+        os.replace(temp_path, self.path)
+
+    def _fetch(self) -> bool:
+        for provider, url in FX_PROVIDERS:
+            try:
+                response = requests.get(url, timeout=5)
+                response.raise_for_status()
+                rates = response.json().get('rates')
+                if rates:
+                    self.rates = {'USD': 1.0, **{code: float(rate) for code, rate in rates.items()}}
+                    self.fetched_at = time.time()
+                    self.provider = provider
+                    return True
+            except (requests.RequestException, ValueError) as e:
+                print(f"FX rates from {provider} failed: {e}")
+        return False
+
+    @property
+    def age_hours(self) -> Optional[float]:
+        return (time.time() - self.fetched_at) / 3600 if self.fetched_at else None
+
+    def refresh(self, force: bool = False) -> Dict[str, float]:
+        """
+        Rates per USD, refetched when older than the TTL
+
+        Falls back to the cached table when providers fail (offline), and to
+        FALLBACK_RATES when there is no cache either.
+        """
+        with self._lock:
+            if force or (self.stale and time.time() >= self.next_attempt):
+                # Another process may have refreshed the shared cache meanwhile
+                self._load()
+                if force or self.stale:
+                    if self._fetch():
+                        self._save()
+                    else:
+                        self.next_attempt = time.time() + FX_RETRY_SECONDS
+            return self.rates or FALLBACK_RATES
+
+    def table(self) -> Dict[str, float]:
+        """Rates per USD as loaded, without refreshing"""
+        return self.rates or FALLBACK_RATES
+
+    @property
+    def stale(self) -> bool:
+        return not self.rates or time.time() - self.fetched_at > self.ttl_seconds
+
+    def status(self) -> Dict:
+        return {
+            'provider': self.provider or 'fallback',
+            'currencies': len(self.rates or FALLBACK_RATES),
+            'age_hours': round(self.age_hours, 2) if self.age_hours is not None else None,
+            'stale': self.stale,
+        }
+
+    def convert_many(
+        self,
+        prices: Sequence[Optional[float]],
+        currencies: Sequence[str],
+        target: str = 'USD',
+    ) -> List[Optional[float]]:
+        """
+        Convert a batch of prices into one currency
+
+        Args:
+            prices: Amounts
+            currencies: ISO code of each amount
+            target: ISO code to convert to
+
+        Returns:
+            Converted amounts rounded to cents; None where a rate is unknown
+        """
+        rates = self.table()
+        target_rate = rates.get(target.upper())
+        converted = []
+        for price, currency in zip(prices, currencies):
+            source_rate = rates.get(currency)
+            if price is None or not source_rate or target_rate is None:
+                converted.append(None)
+            else:
+                converted.append(round(price / source_rate * target_rate, 2))
+        return converted
+
+
+def add_converted_prices(records: List[Dict], fx: FXRates, target: Optional[str] = None):
+    """
+    Set price_usd (and price_target/target_currency) on a batch of records
+
+    Args:
+        records: Cleaned listings with price and ISO currency
+        fx: Rate table
+        target: Optional extra currency to convert to, e.g. 'INR'
+    """
+    if not records:
+        return
+    prices = [record.get('price') for record in records]
+    currencies = [record.get('currency') or 'USD' for record in records]
+    for record, price_usd in zip(records, fx.convert_many(prices, currencies, 'USD')):
+        record['price_usd'] = price_usd
+    if target:
+        for record, price in zip(records, fx.convert_many(prices, currencies, target)):
+            record['price_target'] = price
+            record['target_currency'] = target.upper()
+
+
+_default_rates: Optional[FXRates] = None
+
+
+def get_fx_rates() -> FXRates:
+    """Process-wide FXRates instance"""
+    global _default_rates
+    if _default_rates is None:
+        _default_rates = FXRates()
+    return _default_rates
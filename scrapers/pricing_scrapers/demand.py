@@ -0,0 +1,295 @@
+"""
+Query demand and demand-driven refresh planning
+The API counts how often each category key (business type, offering type,
+query, region) is asked for through /scrape and /cache. Counts decay with a
+half-life, so the score follows current traffic.
+
+The refresh planner turns demand into crawls. Categories share spiders
+(indiamart serves both physical products and services), so work is planned
+per (spider, query, region). A crawl's priority is the demand of every
+category it serves × how stale its last successful run is (from the run
+ledger). Crawls are then taken in priority order until the budget of
+expected crawl seconds (mean duration per spider, from the ledger) or
+crawls is spent.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from pricing_scrapers.query_index import normalize_query
+
+DEFAULT_DEMAND_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'demand.db')
+
+# Assumed duration of a spider with no runs in the ledger
+DEFAULT_CRAWL_SECONDS = 120
+
+# Staleness factor of a crawl that never succeeded (and the cap for old ones)
+MAX_STALENESS = 4.0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DemandTracker:
+    """
+    Exponentially decayed request counts per category key
+
+    Hits are buffered in memory and written at most every flush_interval
+    seconds, so tracking stays off the request path's critical section.
+
+    Args:
+        path: SQLite file (DEMAND_PATH)
+        half_life_hours: A hit counts half as much after this long
+        flush_interval: Seconds between writes of buffered hits
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS query_demand (
+            business_type TEXT NOT NULL,
+            offering_type TEXT NOT NULL,
+            query_key TEXT NOT NULL,
+            region TEXT NOT NULL,
+            query TEXT NOT NULL,
+            score REAL NOT NULL,
+            hits INTEGER NOT NULL,
+            last_seen TEXT NOT NULL,
+            PRIMARY KEY (business_type, offering_type, query_key, region)
+        );
+    """
+
+    def __init__(self, path: str = None, half_life_hours: float = 72, flush_interval: float = 10):
+        self.path = path or os.getenv('DEMAND_PATH', DEFAULT_DEMAND_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.half_life = timedelta(hours=half_life_hours)
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, str, str, str], List] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._local = threading.local()
+        self.connection.executescript(self.SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def _decay(self, score: float, since: datetime, now: datetime) -> float:
+        return score * 0.5 ** ((now - since) / self.half_life)
+
+    def record(self, business_type: str, offering_type: str, query: str, region: str = 'global'):
+        """Count one request for a category"""
+        key = (business_type, offering_type, normalize_query(query), region)
+        if not key[2]:
+            return
+        with self._lock:
+            entry = self._pending.setdefault(key, [query, 0])
+            entry[0] = query
+            entry[1] += 1
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write buffered hits, decaying the stored scores up to now"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        now = _now()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            for (business_type, offering_type, query_key, region), (query, hits) in pending.items():
+                row = self.connection.execute(
+                    'SELECT score, last_seen FROM query_demand '
+                    'WHERE business_type = ? AND offering_type = ? AND query_key = ? AND region = ?',
+                    (business_type, offering_type, query_key, region),
+                ).fetchone()
+                score = hits + (self._decay(row['score'], datetime.fromisoformat(row['last_seen']), now) if row else 0)
+                self.connection.execute(
+                    'INSERT INTO query_demand '
+                    '(business_type, offering_type, query_key, region, query, score, hits, last_seen) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (business_type, offering_type, query_key, region) DO UPDATE SET '
+                    'query = excluded.query, score = excluded.score, '
+                    'hits = query_demand.hits + excluded.hits, last_seen = excluded.last_seen',
+                    (business_type, offering_type, query_key, region, query, score, hits, now.isoformat()),
+                )
+
+    def top(self, limit: int = 500, min_score: float = 0.0) -> List[Dict]:
+        """
+        Categories by current (decayed) demand, highest first
+
+        Returns:
+            Dicts with business_type, offering_type, query_key, query,
+            region, score, hits and last_seen
+        """
+        self.flush()
+        now = _now()
+        rows = []
+        for row in self.connection.execute('SELECT * FROM query_demand'):
+            score = self._decay(row['score'], datetime.fromisoformat(row['last_seen']), now)
+            if score >= min_score:
+                rows.append({**dict(row), 'score': round(score, 4)})
+        rows.sort(key=lambda row: -row['score'])
+        return rows[:limit]
+
+    def prune(self, min_score: float = 0.01) -> int:
+        """Forget categories whose demand has decayed away; returns how many"""
+        now = _now()
+        stale = [
+            (row['business_type'], row['offering_type'], row['query_key'], row['region'])
+            for row in self.connection.execute('SELECT * FROM query_demand')
+            if self._decay(row['score'], datetime.fromisoformat(row['last_seen']), now) < min_score
+        ]
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM query_demand WHERE business_type = ? AND offering_type = ? AND query_key = ? AND region = ?',
+                stale,
+            )
+        return len(stale)
+
+
+_tracker: Optional[DemandTracker] = None
+
+
+def get_demand_tracker() -> DemandTracker:
+    """Shared tracker configured from the environment"""
+    global _tracker
+    if _tracker is None:
+        _tracker = DemandTracker(half_life_hours=float(os.getenv('DEMAND_HALF_LIFE_HOURS', 72)))
+    return _tracker
+
+
+def plan_refresh(
+    demand: List[Dict],
+    spider_mapping: Dict[tuple, List[str]],
+    last_success: Dict[tuple, datetime],
+    expected_seconds: Dict[str, float],
+    refresh_after_hours: float = 20,
+    budget_seconds: float = 3600,
+    max_crawls: int = 50,
+    skip: Callable[[str], bool] = None,
+    now: datetime = None,
+) -> Dict[str, List[Dict]]:
+    """
+    Choose the crawls of one refresh cycle
+
+    Args:
+        demand: Categories with their demand score (DemandTracker.top)
+        spider_mapping: (business_type, offering_type) -> spiders
+        last_success: (spider, query_key, region) -> last successful run
+        expected_seconds: Spider -> expected crawl duration
+        refresh_after_hours: Data younger than this is not refreshed
+        budget_seconds: Total expected crawl time of the cycle
+        max_crawls: Most crawls per cycle
+        skip: Spiders to leave out (e.g. open circuit breaker)
+        now: Current time (default: now)
+
+    Returns:
+        'crawls' to run and 'deferred' ones that were due but over budget,
+        each with spider, query, region, priority, demand, age_hours,
+        expected_seconds and the categories it serves
+    """
+    now = now or _now()
+    crawls: Dict[tuple, Dict] = {}
+    for category in demand:
+        for spider in spider_mapping.get((category['business_type'], category['offering_type']), []):
+            key = (spider, category['query_key'], category['region'])
+            if key not in crawls:
+                last = last_success.get(key)
+                age_hours = (now - last).total_seconds() / 3600 if last else None
+                if age_hours is not None and age_hours < refresh_after_hours:
+                    continue
+                crawls[key] = {
+                    'spider': spider,
+                    'query': category['query'],
+                    'region': category['region'],
+                    'demand': 0.0,
+                    'age_hours': round(age_hours, 1) if age_hours is not None else None,
+                    'staleness': MAX_STALENESS if age_hours is None else min(age_hours / refresh_after_hours, MAX_STALENESS),
+                    'expected_seconds': expected_seconds.get(spider) or DEFAULT_CRAWL_SECONDS,
+                    'categories': [],
+                }
+            crawls[key]['demand'] += category['score']
+            crawls[key]['categories'].append(f"{category['business_type']}/{category['offering_type']}")
+
+    for crawl in crawls.values():
+        crawl['priority'] = round(crawl['demand'] * crawl['staleness'], 4)
+        crawl['demand'] = round(crawl['demand'], 4)
+        crawl['staleness'] = round(crawl['staleness'], 3)
+
+    planned, deferred, spent = [], [], 0.0
+    for crawl in sorted(crawls.values(), key=lambda crawl: -crawl['priority']):
+        if skip and skip(crawl['spider']):
+            continue
+        if len(planned) < max_crawls and spent + crawl['expected_seconds'] <= budget_seconds:
+            planned.append(crawl)
+            spent += crawl['expected_seconds']
+        else:
+            deferred.append(crawl)
+    return {'crawls': planned, 'deferred': deferred}
+
+
+def build_refresh_plan(
+    spider_mapping: Dict[tuple, List[str]],
+    seeds: List[Dict] = None,
+    budget_seconds: float = None,
+    max_crawls: int = None,
+) -> Dict:
+    """
+    Refresh plan from the current demand, run ledger and circuit breakers
+
+    Args:
+        spider_mapping: (business_type, offering_type) -> spiders
+        seeds: Categories (business_type, offering_type, query, region) to
+            refresh while no demand has been recorded yet
+        budget_seconds: Crawl time budget (default REFRESH_BUDGET_MINUTES)
+        max_crawls: Crawl count budget (default REFRESH_MAX_CRAWLS)
+    """
+    from pricing_scrapers.circuit_breaker import get_circuit_breaker
+    from pricing_scrapers.run_ledger import get_run_ledger
+
+    refresh_after_hours = float(os.getenv('REFRESH_AFTER_HOURS', 20))
+    if budget_seconds is None:
+        budget_seconds = float(os.getenv('REFRESH_BUDGET_MINUTES', 60)) * 60
+    if max_crawls is None:
+        max_crawls = int(os.getenv('REFRESH_MAX_CRAWLS', 50))
+
+    demand = get_demand_tracker().top(min_score=float(os.getenv('REFRESH_MIN_DEMAND', 0.5)))
+    if not demand and seeds:
+        demand = [
+            {**seed, 'query_key': normalize_query(seed['query']), 'region': seed.get('region', 'global'), 'score': 1.0}
+            for seed in seeds
+        ]
+
+    ledger = get_run_ledger()
+    horizon = _now() - timedelta(hours=refresh_after_hours * MAX_STALENESS)
+    expected = {
+        entry['spider']: entry['mean_duration_seconds']
+        for entry in ledger.summary(since=_now() - timedelta(days=7))
+    }
+    plan = plan_refresh(
+        demand,
+        spider_mapping,
+        ledger.last_successes(since=horizon, key=normalize_query),
+        expected,
+        refresh_after_hours=refresh_after_hours,
+        budget_seconds=budget_seconds,
+        max_crawls=max_crawls,
+        skip=get_circuit_breaker().should_skip,
+    )
+    plan['budget_seconds'] = budget_seconds
+    plan['planned_seconds'] = math.fsum(crawl['expected_seconds'] for crawl in plan['crawls'])
+    return plan
@@ -0,0 +1,126 @@
+"""
+Adaptive early stop for crawls
+Watches the running price distribution of each query of a crawl and stops
+crawling it once a distribution-free confidence interval for the median is
+tight enough, so well-understood niches stop costing requests and browser
+renders.
+
+For n sorted prices the interval runs between the order statistics at ranks
+n/2 ± z·√n/2 (normal approximation to the binomial), which holds whatever the
+shape of the price distribution.
+"""
+
+import bisect
+import math
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Tuple
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from pricing_scrapers.spiders.base import spider_queries
+
+CONVERGED_REASON = 'price_estimate_converged'
+
+
+def median_interval(sorted_values: Sequence[float], confidence: float = 0.95) -> Optional[Tuple[float, float, float]]:
+    """
+    Order-statistic confidence interval for the median
+
+    Args:
+        sorted_values: Values in ascending order
+        confidence: Coverage, e.g. 0.95
+
+    Returns:
+        (low, median, high), or None for an empty sequence
+    """
+    n = len(sorted_values)
+    if not n:
+        return None
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    half_width = z * math.sqrt(n) / 2
+    low_rank = max(1, math.floor(n / 2 - half_width))
+    high_rank = min(n, math.ceil(n / 2 + half_width) + 1)
+    middle = n // 2
+    median = sorted_values[middle] if n % 2 else (sorted_values[middle - 1] + sorted_values[middle]) / 2
+    return sorted_values[low_rank - 1], median, sorted_values[high_rank - 1]
+
+
+def is_converged(sorted_values: Sequence[float], precision: float, min_samples: int,
+                 confidence: float = 0.95) -> bool:
+    """
+    Whether the median is known to within ±precision (relative) at the given confidence
+
+    Args:
+        sorted_values: Prices in ascending order
+        precision: Target half-width of the interval as a fraction of the median
+        min_samples: Never converged below this many prices
+    """
+    if len(sorted_values) < min_samples:
+        return False
+    low, median, high = median_interval(sorted_values, confidence)
+    return median > 0 and (high - low) / 2 <= precision * median
+
+
+class EarlyStopExtension:
+    """
+    Stop crawling a query once its price estimate has converged
+
+    Enabled with EARLY_STOP_ENABLED. Inlier prices of scraped items are
+    tracked per query (the item's category); once at least
+    EARLY_STOP_MIN_ITEMS are in and the median's EARLY_STOP_CONFIDENCE
+    interval is within ±EARLY_STOP_PRECISION of it, EarlyStopMiddleware
+    drops the query's remaining requests. When every query of the run has
+    converged the spider is closed with reason 'price_estimate_converged'.
+    """
+
+    def __init__(self, crawler, precision: float, min_items: int, confidence: float):
+        self.crawler = crawler
+        self.precision = precision
+        self.min_items = min_items
+        self.confidence = confidence
+        self.prices: Dict[str, List[float]] = {}
+        self.converged = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('EARLY_STOP_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            precision=crawler.settings.getfloat('EARLY_STOP_PRECISION', 0.1),
+            min_items=crawler.settings.getint('EARLY_STOP_MIN_ITEMS', 15),
+            confidence=crawler.settings.getfloat('EARLY_STOP_CONFIDENCE', 0.95),
+        )
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def item_scraped(self, item, response, spider):
+        price = item.get('price')
+        query = item.get('category') or ''
+        converged_queries = getattr(spider, 'converged_queries', None)
+        if converged_queries is None:
+            converged_queries = spider.converged_queries = set()
+        if self.converged or query in converged_queries or item.get('is_outlier') or not price or price <= 0:
+            return
+
+        prices = self.prices.setdefault(query, [])
+        bisect.insort(prices, price)
+        if not is_converged(prices, self.precision, self.min_items, self.confidence):
+            return
+
+        converged_queries.add(query)
+        low, median, high = median_interval(prices, self.confidence)
+        stats = self.crawler.stats
+        stats.inc_value('early_stop/queries_converged', spider=spider)
+        stats.set_value('early_stop/items', len(prices), spider=spider)
+        stats.set_value('early_stop/median', median, spider=spider)
+        stats.set_value('early_stop/interval', [low, high], spider=spider)
+        spider.logger.info(
+            f"Price estimate for '{query}' converged after {len(prices)} items: median {median} ({low}-{high})"
+        )
+
+        if not converged_queries.issuperset(spider_queries(spider) or [query]):
+            return
+        self.converged = True
+        spider.price_estimate_converged = True
+        spider.logger.info('Price estimates of all queries converged, closing spider')
+        self.crawler.engine.close_spider(spider, CONVERGED_REASON)
@@ -0,0 +1,16 @@
+import time
+from scrapy_playwright.handler import ScrapyPlaywrightDownloadHandler
+
+
+class TimedDownloadHandler(ScrapyPlaywrightDownloadHandler):
+    """
+    Playwright download handler that stamps when the transfer really starts
+
+    The downloader calls the handler only once the request has left its
+    download slot (DOWNLOAD_DELAY / AutoThrottle / concurrency), so this is
+    where throttle wait ends and download time begins (see timing.py).
+    """
+
+    def download_request(self, request, spider):
+        request.meta.setdefault('timing', {})['transfer_at'] = time.monotonic()
+        return super().download_request(request, spider)
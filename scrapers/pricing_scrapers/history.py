@@ -0,0 +1,171 @@
+"""
+Price history: trend series, backfill and retention
+Hourly, daily and weekly aggregates are maintained at ingest by
+AggregatesPipeline. This module reads them back as trend series and bounds
+storage: raw listings and fine-grained buckets are dropped once they age out,
+leaving the coarser buckets (which already contain them) as the downsampled
+history.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from pricing_scrapers.aggregates import (
+    AGGREGATE_CURRENCY,
+    RESOLUTIONS,
+    PriceAggregate,
+    bucket_start,
+    in_aggregate_currency,
+    normalized_price,
+    quality_weight,
+)
+from pricing_scrapers.query_index import normalize_query
+from pricing_scrapers.regions import normalize_region
+from pricing_scrapers.storage import ListingStore, to_utc_iso
+
+load_dotenv()
+
+BUCKET_SIZES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+# How long each level is kept (None: forever)
+RETENTION_POLICY = {
+    'raw': int(os.getenv('RAW_RETENTION_DAYS', 90)),
+    'hour': int(os.getenv('HOURLY_RETENTION_DAYS', 14)),
+    'day': int(os.getenv('DAILY_RETENTION_DAYS', 730)),
+    'week': None,
+}
+
+
+def trend_series(rows: List[Dict], group_by: str = 'source', include_outliers: bool = False) -> List[Dict]:
+    """
+    Turn stored aggregate rows into time series
+
+    Prices are in AGGREGATE_CURRENCY and regions are always merged per
+    bucket; group_by='source' keeps one series per source, group_by='all'
+    merges them. Rows still holding local-currency prices are skipped.
+    Outlier prices are only counted with include_outliers.
+
+    Returns:
+        Series with currency, optional source and points ordered by bucket
+    """
+    buckets = defaultdict(dict)
+    for row in rows:
+        if not in_aggregate_currency(row):
+            continue
+        series_key = row['source'] if group_by == 'source' else None
+        aggregate = buckets[series_key].setdefault(row['bucket'], PriceAggregate())
+        aggregate.merge(PriceAggregate.from_dict(row['data']))
+
+    series = []
+    for source, points in sorted(buckets.items(), key=lambda s: s[0] or ''):
+        series.append({
+            **({'source': source} if group_by == 'source' else {}),
+            'currency': AGGREGATE_CURRENCY,
+            'points': [
+                {'bucket': bucket, **aggregate.summary(include_outliers)}
+                for bucket, aggregate in sorted(points.items())
+            ],
+        })
+    return series
+
+
+def rollup_listings(store: ListingStore, since: datetime, until: datetime) -> int:
+    """
+    Rebuild buckets from raw listings (backfill for data scraped before
+    aggregates were maintained at ingest)
+
+    Only buckets lying entirely inside [since, until) are written, and they
+    replace what is stored, so running it twice gives the same result.
+
+    Returns:
+        Number of aggregates written
+    """
+    aggregates: Dict[tuple, PriceAggregate] = {}
+    for batch in store.scan_listings(since, until):
+        for listing in batch:
+            price = normalized_price(listing)
+            if not price or price <= 0:
+                continue
+            weight = quality_weight(listing.get('rating'), listing.get('reviews'))
+            for resolution in RESOLUTIONS:
+                key = (
+                    normalize_query(listing.get('category')),
+                    listing.get('source'),
+                    normalize_region(listing.get('region')),
+                    listing.get('currency') or 'USD',
+                    resolution,
+                    bucket_start(listing.get('scraped_at'), resolution),
+                )
+                aggregates.setdefault(key, PriceAggregate()).add(price, weight, bool(listing.get('is_outlier')))
+
+    since = datetime.fromisoformat(to_utc_iso(since))
+    until = datetime.fromisoformat(to_utc_iso(until))
+    rows = []
+    for (category_key, source, region, currency, resolution, bucket), aggregate in aggregates.items():
+        start = datetime.fromisoformat(bucket)
+        if start < since or start + BUCKET_SIZES[resolution] > until:
+            continue
+        rows.append({
+            'category_key': category_key,
+            'source': source,
+            'region': region,
+            'currency': currency,
+            'resolution': resolution,
+            'bucket': bucket,
+            'data': aggregate.to_dict(),
+            'updated_at': aggregate.updated_at,
+        })
+
+    if rows:
+        store.save_aggregates(rows)
+    return len(rows)
+
+
+def apply_retention(store: ListingStore, policy: Optional[Dict] = None, now: Optional[datetime] = None) -> Dict:
+    """
+    Drop raw listings and buckets older than the retention policy
+
+    Returns:
+        Rows deleted per level
+    """
+    policy = policy or RETENTION_POLICY
+    now = now or datetime.now(timezone.utc)
+    deleted = {}
+
+    if policy.get('raw') is not None:
+        deleted['raw'] = store.delete_listings(now - timedelta(days=policy['raw']))
+
+    for resolution in RESOLUTIONS:
+        if policy.get(resolution) is None:
+            continue
+        cutoff = bucket_start(now - timedelta(days=policy[resolution]), resolution)
+        deleted[resolution] = store.delete_aggregates(resolution, cutoff)
+
+    return deleted
+
+
+def main():
+    """CLI: python -m pricing_scrapers.history [retain | backfill DAYS]"""
+    import sys
+    from pricing_scrapers.storage import get_listing_store
+
+    store = get_listing_store()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'retain'
+
+    if command == 'backfill':
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else RETENTION_POLICY['raw']
+        until = datetime.now(timezone.utc)
+        written = rollup_listings(store, until - timedelta(days=days), until)
+        print(f"Backfilled {written} aggregates from the last {days} days of listings")
+    else:
+        print(f"Retention policy {RETENTION_POLICY}: deleted {apply_retention(store)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,9 @@ class MarketListingItem(scrapy.Item):
     title = scrapy.Field()
     price = scrapy.Field()
     currency = scrapy.Field()
+    price_usd = scrapy.Field()
+    price_target = scrapy.Field()
+    target_currency = scrapy.Field()
     rating = scrapy.Field()
     reviews = scrapy.Field()
     delivery_time = scrapy.Field()
@@ -17,7 +20,9 @@ class MarketListingItem(scrapy.Item):
     seller_level = scrapy.Field()
     description = scrapy.Field()
     category = scrapy.Field()
+    region = scrapy.Field()
     url = scrapy.Field()
+    is_outlier = scrapy.Field()
     scraped_at = scrapy.Field()
 
 
@@ -27,6 +32,9 @@ class MarketListing(BaseModel):
     title: str = Field(..., description="Listing title")
     price: float = Field(..., ge=0, description="Price in local currency")
     currency: str = Field(default="USD", description="Currency code")
+    price_usd: Optional[float] = Field(None, ge=0, description="Price converted to USD")
+    price_target: Optional[float] = Field(None, ge=0, description="Price converted to target_currency")
+    target_currency: Optional[str] = Field(None, description="Currency of price_target")
     rating: Optional[float] = Field(None, ge=0, le=5, description="Rating out of 5")
     reviews: Optional[int] = Field(None, ge=0, description="Number of reviews")
     delivery_time: Optional[int] = Field(None, ge=0, description="Delivery time in days")
@@ -34,7 +42,9 @@ class MarketListing(BaseModel):
     seller_level: Optional[str] = Field(None, description="Seller level/badge")
     description: Optional[str] = Field(None, description="Short description")
     category: Optional[str] = Field(None, description="Category/niche")
+    region: str = Field(default="global", description="Region the listing was scraped for")
     url: Optional[str] = Field(None, description="Listing URL")
+    is_outlier: bool = Field(default=False, description="Price flagged as an outlier for its category/source")
     scraped_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Config:
@@ -0,0 +1,205 @@
+"""
+Prometheus metrics for the scraper service
+Served in text exposition format at GET /metrics. Collectors are plain
+in-process counters, gauges and histograms, cheap enough to stay on in
+production; spider metrics are taken from the stats each crawl leaves in the
+run ledger, since spiders run in their own processes.
+
+With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR so /metrics
+reports the sum over all workers instead of whichever one answered.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Spider runs take seconds to minutes; API calls milliseconds to seconds
+SPIDER_BUCKETS = (5, 10, 30, 60, 120, 180, 300, 600)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'scraper_http_request_duration_seconds',
+    'API request latency',
+    ['method', 'endpoint', 'status'],
+)
+
+CACHE_LOOKUPS = Counter(
+    'scraper_cache_lookups_total',
+    'Cache lookups: result is hit, similar or miss; stale counts hits served past the soft TTL',
+    ['cache', 'result'],
+)
+
+SCRAPES_IN_FLIGHT = Gauge(
+    'scraper_scrapes_in_flight',
+    'Scrape flows currently running',
+    multiprocess_mode='livesum',
+)
+
+SCRAPES_DEDUPLICATED = Counter(
+    'scraper_scrapes_deduplicated_total',
+    'Scrapes not started because the same category was already being scraped (by any worker)',
+)
+
+SPIDERS_RUNNING = Gauge(
+    'scraper_spiders_running',
+    'Spider processes currently running',
+    multiprocess_mode='livesum',
+)
+
+SPIDER_DURATION_SECONDS = Histogram(
+    'scraper_spider_duration_seconds',
+    'Spider run duration',
+    ['spider'],
+    buckets=SPIDER_BUCKETS,
+)
+
+SPIDER_RUNS = Counter(
+    'scraper_spider_runs_total',
+    'Spider runs by outcome (success, failed, timeout, skipped)',
+    ['spider', 'outcome'],
+)
+
+SPIDER_ITEMS = Counter(
+    'scraper_spider_items_total',
+    'Items scraped',
+    ['spider'],
+)
+
+BROWSER_PAGES_MAX = Gauge(
+    'scraper_browser_pages_max_concurrent',
+    'Most Playwright pages open at once during the last run',
+    ['spider'],
+    multiprocess_mode='max',
+)
+
+BROWSER_CONTEXTS_MAX = Gauge(
+    'scraper_browser_contexts_max_concurrent',
+    'Most Playwright contexts open at once during the last run',
+    ['spider'],
+    multiprocess_mode='max',
+)
+
+SCRAPE_SLOTS_IN_USE = Gauge(
+    'scraper_admission_running',
+    'Scrapes holding an admission slot, by priority',
+    ['priority'],
+    multiprocess_mode='livesum',
+)
+
+SCRAPE_QUEUE_DEPTH = Gauge(
+    'scraper_admission_queue_depth',
+    'Scrapes waiting for an admission slot, by priority',
+    ['priority'],
+    multiprocess_mode='livesum',
+)
+
+SCRAPE_QUEUE_WAIT_SECONDS = Histogram(
+    'scraper_admission_wait_seconds',
+    'Time scrapes waited for an admission slot',
+    ['priority'],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300),
+)
+
+SCRAPES_REJECTED = Counter(
+    'scraper_admission_rejected_total',
+    'Scrapes turned away: reason is queue_full or timeout',
+    ['priority', 'reason'],
+)
+
+SPOOL_RECORDS = Gauge(
+    'scraper_spool_records',
+    'Listings in the write spool: pending drain, or dead (quarantined after the store kept rejecting them)',
+    ['state'],
+    multiprocess_mode='mostrecent',
+)
+
+SPOOL_BYTES = Gauge(
+    'scraper_spool_bytes',
+    'Size on disk of the spool segments pending drain',
+    multiprocess_mode='mostrecent',
+)
+
+STORE_CALL_SECONDS = Histogram(
+    'scraper_store_call_duration_seconds',
+    'Listing store call latency',
+    ['store', 'operation'],
+)
+
+STORE_CALL_ERRORS = Counter(
+    'scraper_store_call_errors_total',
+    'Listing store calls that raised',
+    ['store', 'operation'],
+)
+
+
+@contextmanager
+def observe_store_call(store: str, operation: str):
+    """Time a listing store call, counting it as an error if it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STORE_CALL_ERRORS.labels(store, operation).inc()
+        raise
+    finally:
+        STORE_CALL_SECONDS.labels(store, operation).observe(time.perf_counter() - started)
+
+
+def timed_store_call(method):
+    """Decorator for ListingStore methods: observe_store_call labelled with the store's name"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with observe_store_call(self.name, method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def record_spider_run(spider: str, outcome: str, duration: float = None, stats: Dict = None):
+    """
+    Record a finished spider run
+
+    Args:
+        spider: Spider name
+        outcome: 'success', 'failed', 'timeout' or 'skipped'
+        duration: Wall time in seconds
+        stats: The crawl's Scrapy stats (from the run ledger), for item and
+            browser stats
+    """
+    SPIDER_RUNS.labels(spider, outcome).inc()
+    if duration is not None:
+        SPIDER_DURATION_SECONDS.labels(spider).observe(duration)
+
+    stats = stats or {}
+    SPIDER_ITEMS.labels(spider).inc(stats.get('item_scraped_count', 0))
+    if 'playwright/page_count/max_concurrent' in stats:
+        BROWSER_PAGES_MAX.labels(spider).set(stats['playwright/page_count/max_concurrent'])
+    if 'playwright/context_count/max_concurrent' in stats:
+        BROWSER_CONTEXTS_MAX.labels(spider).set(stats['playwright/context_count/max_concurrent'])
+
+
+def record_spool_depth(depth: Dict):
+    """Set the spool gauges from WriteSpool.depth()"""
+    SPOOL_RECORDS.labels('pending').set(depth['records'])
+    SPOOL_RECORDS.labels('dead').set(depth['dead_records'])
+    SPOOL_BYTES.set(depth['bytes'])
+
+
+def render_metrics():
+    """(body, content type) of the text exposition, over all workers in multiprocess mode"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_worker_exited():
+    """Drop this worker's live gauges from the multiprocess metrics"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(os.getpid())
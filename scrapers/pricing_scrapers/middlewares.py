@@ -1,10 +1,21 @@
+import time
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from pricing_scrapers.proxies import ProxyPool, is_ban_page, load_proxies, playwright_proxy
+from pricing_scrapers.timing import RequestTimings, get_request_timings
+from pricing_scrapers.tracing import monotonic_to_ns, record_span
 
 
 class PricingScrapersSpiderMiddleware:
+    """Measures parse time: time spent inside the callback producing its output (see timing.py)"""
+
+    def __init__(self, timings: RequestTimings = None):
+        self.timings = timings
+
     @classmethod
     def from_crawler(cls, crawler):
-        s = cls()
+        s = cls(get_request_timings(crawler))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
@@ -12,8 +23,23 @@ class PricingScrapersSpiderMiddleware:
         return None
 
     def process_spider_output(self, response, result, spider):
-        for i in result:
+        elapsed = 0.0
+        iterator = iter(result)
+        while True:
+            started = time.monotonic()
+            try:
+                i = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.monotonic() - started
             yield i
+        if self.timings is not None:
+            self.timings.record(urlparse_cached(response).hostname or 'local', spider, parse=elapsed)
+        trace_span = getattr(spider, 'trace_span', None)
+        if trace_span:
+            end_ns = time.time_ns()
+            record_span('parse', trace_span, end_ns - int(elapsed * 1e9), end_ns, url=response.url)
 
     def process_spider_exception(self, response, exception, spider):
         pass
@@ -27,21 +53,231 @@ class PricingScrapersSpiderMiddleware:
 
 
 class PricingScrapersDownloaderMiddleware:
+    """
+    Stamps each request on its way through the crawl and records its timing
+    breakdown (see timing.py); exported to TIMING_DIR when the spider closes
+    """
+
+    def __init__(self, timings: RequestTimings = None, timing_dir: str = None):
+        self.timings = timings
+        self.timing_dir = timing_dir
+
     @classmethod
     def from_crawler(cls, crawler):
-        s = cls()
+        s = cls(get_request_timings(crawler), crawler.settings.get('TIMING_DIR'))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(s.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(s.response_downloaded, signal=signals.response_downloaded)
         return s
 
+    def request_scheduled(self, request, spider):
+        # A fresh dict: retried requests are copies sharing the original's meta values
+        request.meta['timing'] = {'scheduled_at': time.monotonic()}
+
+    def request_reached_downloader(self, request, spider):
+        # Sent as the request joins its download slot's queue, before any delay
+        request.meta.setdefault('timing', {})['reached_at'] = time.monotonic()
+
+    def response_downloaded(self, response, request, spider):
+        request.meta.setdefault('timing', {})['downloaded_at'] = time.monotonic()
+
     def process_request(self, request, spider):
+        timing = request.meta.setdefault('timing', {})
+        timing['downloader_at'] = time.monotonic()
+
+        if request.meta.get('playwright'):
+            def page_loaded(page):
+                timing['loaded_at'] = time.monotonic()
+
+            request.meta['playwright_page_event_handlers'] = {
+                **request.meta.get('playwright_page_event_handlers', {}),
+                'load': page_loaded,
+            }
         return None
 
+    @staticmethod
+    def marks(timing: dict) -> tuple:
+        """
+        (reached, transfer, downloaded) monotonic stamps of a request, falling
+        back to the previous mark when a later one is missing (e.g. a scheme
+        not served by TimedDownloadHandler)
+        """
+        reached_at = timing.get('reached_at', timing['downloader_at'])
+        transfer_at = timing.get('transfer_at', reached_at)
+        downloaded_at = timing.get('downloaded_at', time.monotonic())
+        return reached_at, transfer_at, downloaded_at
+
     def process_response(self, request, response, spider):
+        timing = request.meta.get('timing')
+        if self.timings is None or not timing or 'downloader_at' not in timing:
+            return response
+
+        reached_at, transfer_at, downloaded_at = self.marks(timing)
+        loaded_at = timing.get('loaded_at')
+        self.timings.record(
+            urlparse_cached(request).hostname or 'local',
+            spider,
+            queue_wait=reached_at - timing['scheduled_at'] if 'scheduled_at' in timing else None,
+            throttle_wait=transfer_at - reached_at,
+            download=downloaded_at - transfer_at,
+            render=loaded_at - transfer_at if loaded_at else None,
+            selector_wait=downloaded_at - loaded_at if loaded_at else None,
+            response_bytes=len(response.body),
+            retries=request.meta.get('retry_times', 0),
+        )
+        self.record_spans(request, response, spider)
         return response
 
+    def record_spans(self, request, response, spider):
+        """Download (and Playwright render / selector wait) spans under the crawl span"""
+        trace_span = getattr(spider, 'trace_span', None)
+        if not trace_span:
+            return
+        timing = request.meta['timing']
+        _, transfer_at, downloaded_at = self.marks(timing)
+        download = record_span(
+            'download',
+            trace_span,
+            monotonic_to_ns(transfer_at),
+            monotonic_to_ns(downloaded_at),
+            url=request.url,
+            status=response.status,
+            bytes=len(response.body),
+            retries=request.meta.get('retry_times', 0),
+        )
+        loaded_at = timing.get('loaded_at')
+        if download and loaded_at:
+            record_span('render', download, monotonic_to_ns(transfer_at), monotonic_to_ns(loaded_at))
+            record_span('selector_wait', download, monotonic_to_ns(loaded_at), monotonic_to_ns(downloaded_at))
+
     def process_exception(self, request, exception, spider):
         pass
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
 
+    def spider_closed(self, spider):
+        path = self.timings.export(spider.name, self.timing_dir) if self.timings else None
+        if path:
+            spider.logger.info(f'Request timings exported to {path}')
+
+
+class EarlyStopMiddleware:
+    """Drop requests of queries whose price estimate has converged (see early_stop.py)"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_request(self, request, spider):
+        if getattr(spider, 'price_estimate_converged', False) or \
+                request.meta.get('query') in getattr(spider, 'converged_queries', ()):
+            self.stats.inc_value('early_stop/requests_skipped', spider=spider)
+            raise IgnoreRequest('price estimate converged')
+        return None
+
+
+class CircuitBreakerMiddleware:
+    """Drop requests of a spider refused by its circuit breaker (see circuit_breaker.py)"""
+
+    def process_request(self, request, spider):
+        if getattr(spider, 'circuit_open', False):
+            raise IgnoreRequest('circuit breaker open')
+        return None
+
+
+class ProxyManagerMiddleware:
+    """
+    Route requests through the health-scored proxy pool (see proxies.py)
+
+    Enabled with PROXY_ENABLED and a PROXY_LIST / PROXY_LIST_FILE. Playwright
+    requests get one browser context per (context, proxy) with the proxy set
+    on the context; other requests use meta['proxy']. Banned responses are
+    retried on another proxy up to PROXY_BAN_RETRIES times. Requests that
+    already carry their own meta['proxy'] are left alone.
+    """
+
+    def __init__(self, pool: ProxyPool, stats, ban_retries: int = 2):
+        self.pool = pool
+        self.stats = stats
+        self.ban_retries = ban_retries
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROXY_ENABLED'):
+            raise NotConfigured
+        proxies = load_proxies(settings.get('PROXY_LIST'), settings.get('PROXY_LIST_FILE'))
+        if not proxies:
+            raise NotConfigured('PROXY_ENABLED is set but no proxies are configured')
+
+        pool = ProxyPool(
+            proxies,
+            slow_seconds=settings.getfloat('PROXY_SLOW_SECONDS', 15),
+            slow_cooldown=settings.getfloat('PROXY_SLOW_COOLDOWN', 60),
+            ban_cooldown=settings.getfloat('PROXY_BAN_COOLDOWN', 300),
+            max_ban_cooldown=settings.getfloat('PROXY_MAX_BAN_COOLDOWN', 3600),
+        )
+        s = cls(pool, crawler.stats, settings.getint('PROXY_BAN_RETRIES', 2))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if request.url.startswith(('file:', 'data:')):
+            return None
+        if 'proxy' in request.meta and 'proxy_key' not in request.meta:
+            return None
+
+        domain = urlparse_cached(request).hostname
+        proxy = self.pool.choose(domain)
+        request.meta['proxy_key'] = proxy
+        request.meta['proxy_started_at'] = time.monotonic()
+
+        if request.meta.get('playwright'):
+            context = request.meta.setdefault('proxy_base_context', request.meta.get('playwright_context', 'default'))
+            request.meta['playwright_context'] = f'{context}@proxy{self.pool.proxies.index(proxy)}'
+            request.meta['playwright_context_kwargs'] = {
+                **request.meta.get('playwright_context_kwargs', {}),
+                'proxy': playwright_proxy(proxy),
+            }
+        else:
+            request.meta['proxy'] = proxy
+        self.stats.inc_value('proxies/requests', spider=spider)
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = request.meta.get('proxy_key')
+        if not proxy:
+            return response
+
+        domain = urlparse_cached(request).hostname
+        if not is_ban_page(response.status, response.body):
+            self.pool.record_success(proxy, domain, time.monotonic() - request.meta['proxy_started_at'])
+            return response
+
+        self.pool.record_ban(proxy, domain)
+        self.stats.inc_value('proxies/bans', spider=spider)
+        retries = request.meta.get('proxy_ban_retries', 0)
+        if retries >= self.ban_retries:
+            return response
+
+        spider.logger.debug(f'Proxy banned by {domain} (HTTP {response.status}), retrying on another proxy')
+        self.stats.inc_value('proxies/ban_retries', spider=spider)
+        retry = request.replace(dont_filter=True)
+        retry.meta['proxy_ban_retries'] = retries + 1
+        return retry
+
+    def process_exception(self, request, exception, spider):
+        proxy = request.meta.get('proxy_key')
+        if proxy:
+            self.pool.record_failure(proxy, urlparse_cached(request).hostname)
+            self.stats.inc_value('proxies/failures', spider=spider)
+        return None
+
+    def spider_closed(self, spider):
+        spider.logger.info(f'Proxy health: {self.pool.status()}')
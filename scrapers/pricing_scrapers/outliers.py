@@ -0,0 +1,144 @@
+"""
+Streaming outlier detection for listing prices
+Each (category, source, currency) keeps a rolling window of recent prices.
+A price is flagged when its modified z-score (Iglewicz & Hoaglin) against the
+window's median and MAD exceeds a threshold. Flagged listings are kept but
+marked, and are left out of stats unless asked for.
+"""
+
+import bisect
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from pricing_scrapers.aggregates import PriceAggregate, in_aggregate_currency
+
+DEFAULT_WINDOW = 200
+DEFAULT_THRESHOLD = 3.5
+DEFAULT_MIN_SAMPLES = 10
+
+
+class RollingMAD:
+    """
+    Median/MAD over the last `window` values
+
+    Args:
+        window: Number of recent values kept
+        threshold: Modified z-score above which a value is an outlier
+        min_samples: Values needed before anything is flagged
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW, threshold: float = DEFAULT_THRESHOLD,
+                 min_samples: int = DEFAULT_MIN_SAMPLES):
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.values = deque()
+        self.sorted_values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value: float):
+        """Add a value, evicting the oldest once the window is full"""
+        self.values.append(value)
+        bisect.insort(self.sorted_values, value)
+        if len(self.values) > self.window:
+            oldest = self.values.popleft()
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, oldest)]
+
+    @staticmethod
+    def _median(values) -> float:
+        middle = len(values) // 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2
+
+    def score(self, value: float) -> Optional[float]:
+        """
+        Modified z-score of a value against the window
+
+        Returns:
+            0.6745 * (value - median) / MAD, or None while the window is
+            warming up or has no spread
+        """
+        if len(self.sorted_values) < self.min_samples:
+            return None
+        median = self._median(self.sorted_values)
+        deviations = sorted(abs(v - median) for v in self.sorted_values)
+        mad = self._median(deviations)
+        if mad == 0:
+            # More than half the window is one price: use the mean absolute
+            # deviation instead, z = (value - median) / (1.253314 * MeanAD)
+            mean_ad = sum(deviations) / len(deviations)
+            return (value - median) / (1.253314 * mean_ad) if mean_ad else None
+        return 0.6745 * (value - median) / mad
+
+    def is_outlier(self, value: float) -> bool:
+        score = self.score(value)
+        return score is not None and abs(score) > self.threshold
+
+    def seed(self, aggregate: PriceAggregate, samples: int = None):
+        """Warm the window with evenly spaced quantiles of a stored aggregate"""
+        samples = min(samples or self.window // 2, aggregate.count)
+        for i in range(samples):
+            value = aggregate.sketch.quantile((i + 0.5) / samples)
+            if value is not None:
+                self.add(value)
+
+
+class OutlierDetector:
+    """
+    RollingMAD per (category_key, source, currency), optionally seeded from
+    the last weeks of stored aggregates so the first items of a crawl are
+    judged against history instead of an empty window
+    """
+
+    def __init__(self, store=None, window: int = DEFAULT_WINDOW, threshold: float = DEFAULT_THRESHOLD,
+                 min_samples: int = DEFAULT_MIN_SAMPLES, seed_weeks: int = 4):
+        self.store = store
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.seed_weeks = seed_weeks
+        self.windows: Dict[Tuple, RollingMAD] = {}
+        self.flagged = 0
+
+    def _window(self, key: Tuple) -> RollingMAD:
+        if key not in self.windows:
+            rolling = RollingMAD(self.window, self.threshold, self.min_samples)
+            if self.store:
+                rolling.seed(self._history(*key))
+            self.windows[key] = rolling
+        return self.windows[key]
+
+    def _history(self, category_key: str, source: str, currency: str) -> PriceAggregate:
+        since = datetime.now(timezone.utc) - timedelta(weeks=self.seed_weeks)
+        merged = PriceAggregate()
+        try:
+            rows = self.store.fetch_aggregates(
+                category_key,
+                sources=[source],
+                resolution='week',
+                since_bucket=since.isoformat(),
+            )
+        except Exception as e:
+            print(f"Could not seed outlier window for {category_key}/{source}: {e}")
+            return merged
+        for row in rows:
+            if row['currency'] == currency and in_aggregate_currency(row):
+                merged.merge(PriceAggregate.from_dict(row['data']))
+        return merged
+
+    def check(self, category_key: str, source: str, currency: str, price: float) -> bool:
+        """
+        Score a price and add it to its window
+
+        Returns:
+            True if the price is an outlier
+        """
+        rolling = self._window((category_key, source, currency))
+        outlier = rolling.is_outlier(price)
+        rolling.add(price)
+        if outlier:
+            self.flagged += 1
+        return outlier
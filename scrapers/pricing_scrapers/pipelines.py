@@ -1,95 +1,380 @@
+import json
 import os
 from datetime import datetime
-from supabase import create_client, Client
 from dotenv import load_dotenv
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet.threads import deferToThread
+from pricing_scrapers.cleaning import clean_batch, clean_item, column_values
+from pricing_scrapers.currency import add_converted_prices, get_fx_rates
+from pricing_scrapers.storage import ListingStore, get_listing_store
+from pricing_scrapers.spool import WriteSpool, SpoolDrainer, aggregate_drainer, aggregate_spool
+from pricing_scrapers.outliers import OutlierDetector
+from pricing_scrapers.aggregates import (
+    RESOLUTIONS,
+    PriceAggregate,
+    bucket_start,
+    delta_records,
+    normalized_price,
+    quality_weight,
+)
+from pricing_scrapers.query_index import normalize_query
+from pricing_scrapers.regions import normalize_region
+from pricing_scrapers.tracing import span
 
 load_dotenv()
 
+DEFAULT_REJECTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'rejects')
+
 
 class DataCleaningPipeline:
-    """Clean and normalize scraped data"""
+    """
+    Clean, normalize and validate scraped data (see pricing_scrapers.cleaning)
+
+    Items failing validation against the MarketListing model are dropped and
+    written with their reasons to a JSONL file under REJECTS_DIR.
+
+    Currencies are normalized to ISO codes and, with CURRENCY_CONVERSION_ENABLED,
+    each item gets price_usd (plus price_target in PRICE_TARGET_CURRENCY) from
+    the cached FX table. A stale table is refreshed in a thread when the spider
+    opens; the crawl only waits for it when no rates were ever cached.
+    """
+
+    def __init__(self, rejects_dir=None, stats=None, convert_currency=True, target_currency=None):
+        self.rejects_dir = rejects_dir
+        self.stats = stats
+        self.fx = get_fx_rates() if convert_currency else None
+        self.target_currency = target_currency
+        self.rejects_file = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            rejects_dir=crawler.settings.get('REJECTS_DIR'),
+            stats=crawler.stats,
+            convert_currency=crawler.settings.getbool('CURRENCY_CONVERSION_ENABLED', True),
+            target_currency=crawler.settings.get('PRICE_TARGET_CURRENCY') or None,
+        )
+
+    def open_spider(self, spider):
+        if not self.fx or not self.fx.stale:
+            return None
+        refreshing = deferToThread(self.fx.refresh)
+        refreshing.addErrback(lambda failure: spider.logger.warning(f'FX rate refresh failed: {failure.value}'))
+        return refreshing if not self.fx.rates else None
 
     def process_item(self, item, spider):
-        # Clean price
-        if 'price' in item:
-            price_str = str(item['price']).replace(',', '').replace('$', '').replace('₹', '')
-            try:
-                item['price'] = float(price_str)
-            except (ValueError, TypeError):
-                item['price'] = 0.0
-
-        # Clean rating
-        if 'rating' in item and item['rating']:
-            try:
-                item['rating'] = float(item['rating'])
-                if item['rating'] > 5:
-                    item['rating'] = item['rating'] / 10  # Normalize to 5-star scale
-            except (ValueError, TypeError):
-                item['rating'] = None
-
-        # Clean reviews
-        if 'reviews' in item and item['reviews']:
-            try:
-                reviews_str = str(item['reviews']).replace(',', '').replace('k', '000')
-                item['reviews'] = int(float(reviews_str))
-            except (ValueError, TypeError):
-                item['reviews'] = 0
-
-        # Clean delivery time
-        if 'delivery_time' in item and item['delivery_time']:
-            try:
-                delivery_str = str(item['delivery_time']).lower()
-                if 'day' in delivery_str:
-                    item['delivery_time'] = int(''.join(filter(str.isdigit, delivery_str)))
-                elif 'week' in delivery_str:
-                    weeks = int(''.join(filter(str.isdigit, delivery_str)))
-                    item['delivery_time'] = weeks * 7
-            except (ValueError, TypeError):
-                item['delivery_time'] = None
-
-        # Add timestamp
-        item['scraped_at'] = datetime.utcnow().isoformat()
+        cleaned, reason = clean_item(dict(item))
+        if reason:
+            self.reject(item, reason, spider)
+            raise DropItem(f'Invalid listing: {reason}')
 
+        item.update(cleaned)
+        if self.fx:
+            add_converted_prices([item], self.fx, self.target_currency)
         return item
 
+    def reject(self, item, reason, spider):
+        """Record a rejected item in the rejects side channel"""
+        if self.stats:
+            self.stats.inc_value('cleaning/rejected', spider=spider)
+            for field in {part.split(':')[0] for part in reason.split('; ')}:
+                self.stats.inc_value(f'cleaning/rejected/{field}', spider=spider)
+
+        if self.rejects_file is None:
+            directory = self.rejects_dir or DEFAULT_REJECTS_DIR
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{spider.name}-{datetime.utcnow():%Y%m%d}.jsonl')
+            self.rejects_file = open(path, 'a', encoding='utf8')
+
+        record = {'spider': spider.name, 'reason': reason, 'item': dict(item)}
+        self.rejects_file.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+
+    def close_spider(self, spider):
+        if self.rejects_file:
+            self.rejects_file.close()
+            spider.logger.info(f'Rejected items written to {self.rejects_file.name}')
+
+
+class BatchCleaningPipeline(DataCleaningPipeline):
+    """
+    DataCleaningPipeline on columnar batches (cleaning.clean_batch)
+
+    Items are held until BATCH_CLEANING_SIZE have arrived or
+    BATCH_CLEANING_MAX_DELAY seconds have passed, then cleaned and validated
+    together and released downstream. Only worth it for large, fast crawls:
+    batches match per-item cleaning at around 5000 items (see
+    benchmarks/cleaning_benchmark.py), so it replaces DataCleaningPipeline in
+    ITEM_PIPELINES only when enabled.
+    """
+
+    def __init__(self, batch_size=5000, max_delay=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.flush_call = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint('BATCH_CLEANING_SIZE', 5000),
+            max_delay=crawler.settings.getfloat('BATCH_CLEANING_MAX_DELAY', 0.5),
+            rejects_dir=crawler.settings.get('REJECTS_DIR'),
+            stats=crawler.stats,
+            convert_currency=crawler.settings.getbool('CURRENCY_CONVERSION_ENABLED', True),
+            target_currency=crawler.settings.get('PRICE_TARGET_CURRENCY') or None,
+        )
+
+    def process_item(self, item, spider):
+        """Queue the item for the next batch; the returned Deferred fires once it is cleaned"""
+        from twisted.internet import defer, reactor
+
+        deferred = defer.Deferred()
+        self.pending.append((item, deferred))
+        if len(self.pending) >= self.batch_size:
+            self.flush(spider)
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(self.max_delay, self.flush, spider)
+        return deferred
+
+    def flush(self, spider):
+        """Clean all pending items and release them downstream"""
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        cleaned, reasons = clean_batch([dict(item) for item, _ in batch])
+        values = column_values(cleaned)
+        reasons = reasons.tolist()
+        valid = []
+        for index, (item, _) in enumerate(batch):
+            if reasons[index]:
+                self.reject(item, reasons[index], spider)
+                continue
+            item.update({field: column[index] for field, column in values.items()})
+            valid.append(item)
+        if self.fx:
+            add_converted_prices(valid, self.fx, self.target_currency)
+
+        for (item, deferred), reason in zip(batch, reasons):
+            if reason:
+                deferred.errback(DropItem(f'Invalid listing: {reason}'))
+            else:
+                deferred.callback(item)
+        if self.stats:
+            self.stats.inc_value('cleaning/batches', spider=spider)
+
+    def close_spider(self, spider):
+        """Release the last partial batch"""
+        self.flush(spider)
+        super().close_spider(spider)
+
 
 class SupabasePipeline:
-    """Store cleaned data in Supabase"""
+    """
+    Store cleaned data in the configured listing store (Supabase by default)
 
-    def __init__(self):
-        self.supabase: Client = None
+    Items are appended to a local on-disk spool and written to the store in
+    bulk by a background drainer, so the crawl never waits on the database.
+    Whatever cannot be written by the time the spider closes stays spooled
+    and is replayed later by the API server's drainer.
+    """
+
+    def __init__(self, spool_enabled=True, flush_items=20, drain_timeout=30):
+        self.store: ListingStore = None
+        self.spool: WriteSpool = None
+        self.drainer: SpoolDrainer = None
+        self.spool_enabled = spool_enabled
+        self.flush_items = flush_items
+        self.drain_timeout = drain_timeout
+        self.buffer = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            spool_enabled=crawler.settings.getbool('SPOOL_ENABLED', True),
+            flush_items=crawler.settings.getint('SPOOL_FLUSH_ITEMS', 20),
+            drain_timeout=crawler.settings.getfloat('SPOOL_DRAIN_TIMEOUT', 30),
+        )
 
     def open_spider(self, spider):
-        """Initialize Supabase connection"""
-        supabase_url = os.getenv('SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+        """Initialize the listing store (see LISTING_STORE) and the write spool"""
+        try:
+            self.store = get_listing_store()
+        except Exception as e:
+            spider.logger.warning(f'Listing store unavailable, spooling items only: {e}')
 
-        if not supabase_url or not supabase_key:
-            spider.logger.warning('Supabase credentials not found, skipping database storage')
-            return
+        if self.spool_enabled:
+            self.spool = WriteSpool()
+            if self.store:
+                self.drainer = SpoolDrainer(self.spool, self.store, interval=2.0)
+                self.drainer.start()
 
-        self.supabase = create_client(supabase_url, supabase_key)
-        spider.logger.info('Connected to Supabase')
+        if self.store:
+            spider.logger.info(f'Connected to {self.store.name} listing store')
 
     def process_item(self, item, spider):
-        """Store item in Supabase"""
-        if not self.supabase:
+        """Spool item for storage (or store it directly when spooling is disabled)"""
+        data = dict(item)
+
+        if self.spool:
+            self.buffer.append(data)
+            if len(self.buffer) >= self.flush_items:
+                self.flush(spider)
             return item
 
-        try:
-            # Convert Scrapy Item to dict
-            data = dict(item)
+        if not self.store:
+            return item
 
+        try:
             # Insert into market_listings table
-            result = self.supabase.table('market_listings').insert(data).execute()
+            with span('db_write', getattr(spider, 'trace_span', None), store=self.store.name, items=1):
+                self.store.insert_listings([data])
             spider.logger.info(f'Stored listing: {data.get("title", "Unknown")}')
 
         except Exception as e:
-            spider.logger.error(f'Error storing item in Supabase: {e}')
+            spider.logger.error(f'Error storing item in {self.store.name}: {e}')
 
         return item
 
+    def flush(self, spider=None):
+        """Append buffered items to the spool as one sealed segment"""
+        if self.buffer:
+            with span('spool_append', getattr(spider, 'trace_span', None), items=len(self.buffer)):
+                self.spool.append(self.buffer)
+                self.spool.seal()
+            self.buffer = []
+
     def close_spider(self, spider):
-        """Cleanup on spider close"""
-        spider.logger.info('Closing Supabase pipeline')
+        """Flush the spool and give the drainer a bounded chance to finish"""
+        if self.spool:
+            self.flush(spider)
+            if self.drainer:
+                with span('db_write', getattr(spider, 'trace_span', None), store=self.store.name) as write:
+                    self.drainer.stop(timeout=self.drain_timeout)
+                    written = self.drainer.drain_once()
+                    if write:
+                        write.set(items=written, drained_total=self.drainer.stats['drained'])
+                spider.logger.info(f'Spool drainer stats: {self.drainer.stats}')
+            spider.logger.info(f'Spool depth: {self.spool.depth()}')
+
+        spider.logger.info('Closing listing store pipeline')
+
+
+class OutlierPipeline:
+    """
+    Flag outlier prices before storage and aggregation
+
+    Each item's USD price is scored against a rolling median/MAD window for
+    its (category_key, source, currency), seeded from stored weekly
+    aggregates. Outliers (and non-positive prices such as "Free") get
+    is_outlier = True; items without a USD price are not scored and nothing
+    is dropped.
+    """
+
+    def __init__(self, window=200, threshold=3.5, min_samples=10, stats=None):
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.stats = stats
+        self.detector: OutlierDetector = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('OUTLIER_FILTER_ENABLED', True):
+            raise NotConfigured
+        return cls(
+            window=crawler.settings.getint('OUTLIER_WINDOW', 200),
+            threshold=crawler.settings.getfloat('OUTLIER_THRESHOLD', 3.5),
+            min_samples=crawler.settings.getint('OUTLIER_MIN_SAMPLES', 10),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        try:
+            store = get_listing_store()
+        except Exception as e:
+            spider.logger.warning(f'Listing store unavailable, outlier windows start empty: {e}')
+            store = None
+        self.detector = OutlierDetector(store, self.window, self.threshold, self.min_samples)
+
+    def process_item(self, item, spider):
+        price = normalized_price(item)
+        if price is None:
+            return item
+        if price <= 0:
+            item['is_outlier'] = True
+        else:
+            item['is_outlier'] = self.detector.check(
+                normalize_query(item.get('category')),
+                item.get('source'),
+                item.get('currency') or 'USD',
+                price,
+            )
+
+        if item['is_outlier'] and self.stats:
+            self.stats.inc_value('outliers/flagged', spider=spider)
+        return item
 
+    def close_spider(self, spider):
+        spider.logger.info(f'Flagged {self.detector.flagged} outlier prices')
+
+
+class AggregatesPipeline:
+    """
+    Maintain per-category price aggregates at ingest
+
+    Items' USD prices (price_usd) are folded into in-memory deltas per
+    (category_key, source, region, currency) and hourly, daily and weekly
+    bucket. When the spider closes they are spooled (see spool.py) and then
+    merged into the stored aggregates; deltas the store cannot take stay in
+    the spool and are replayed by the next crawl or the API server.
+    Non-positive prices (e.g. "Free") are not price points and are skipped,
+    as are items without a USD price; prices flagged by OutlierPipeline are
+    kept apart from the main sketches.
+    """
+
+    def __init__(self):
+        self.deltas = {}
+
+    def process_item(self, item, spider):
+        price = normalized_price(item)
+        if not price or price <= 0:
+            return item
+
+        weight = quality_weight(item.get('rating'), item.get('reviews'))
+        outlier = bool(item.get('is_outlier'))
+        for resolution in RESOLUTIONS:
+            key = (
+                normalize_query(item.get('category')),
+                item.get('source'),
+                normalize_region(item.get('region')),
+                item.get('currency') or 'USD',
+                resolution,
+                bucket_start(item.get('scraped_at'), resolution),
+            )
+            self.deltas.setdefault(key, PriceAggregate()).add(price, weight, outlier)
+        return item
+
+    def close_spider(self, spider):
+        """Spool the deltas, then merge everything spooled into the stored aggregates"""
+        if not self.deltas:
+            return
+
+        spool = aggregate_spool()
+        spool.append(delta_records(self.deltas))
+        spool.seal()
+        try:
+            with span('aggregates_write', getattr(spider, 'trace_span', None), aggregates=len(self.deltas)):
+                drainer = aggregate_drainer(spool, get_listing_store(), max_batches_per_second=0)
+                written = drainer.drain_once()
+            spider.logger.info(f'Updated {written} price aggregates')
+        except Exception as e:
+            spider.logger.error(f'Error updating price aggregates: {e}')
+        pending = spool.depth()['records']
+        if pending:
+            spider.logger.warning(f'{pending} price aggregate deltas left in {spool.directory} for replay')
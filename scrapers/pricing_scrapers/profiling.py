@@ -0,0 +1,372 @@
+"""
+On-demand profiling of API requests and spider runs
+Profiles are captured in production, under production load, only when asked
+for, and written to PROFILE_DIR (default output/profiles):
+
+- API requests: a cProfile of the handler when the request carries
+  `X-Profile: <PROFILE_TOKEN>` or is drawn by PROFILE_SAMPLE_RATE. The
+  profile id is returned in X-Profile-Id.
+- Spider runs (SPIDER_PROFILE=cpu): `scrapy crawl --profile`, i.e. cProfile
+  of the whole crawl process.
+- Spider runs (SPIDER_PROFILE=memory): tracemalloc allocation stacks plus
+  the resident memory of the crawl and its browser processes over time, for
+  Playwright-heavy spiders.
+
+Every profile is saved as <name>.prof (pstats, e.g. for snakeviz) and/or
+<name>.folded (collapsed stacks for flamegraph.pl or speedscope); spider runs
+also get <name>.stats.json with the crawl's Scrapy stats:
+
+    python -m pricing_scrapers.profiling list
+    python -m pricing_scrapers.profiling top <name>.prof
+    python -m pricing_scrapers.profiling folded <name>.prof [out.folded]
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'profiles')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.0))
+SPIDER_PROFILE_MODES = ('cpu', 'memory')
+
+# Stacks with less than this share of the total time are left out of the
+# folded output (they would not be visible in a flamegraph anyway)
+MIN_FOLDED_FRACTION = 0.0005
+
+# cProfile hooks the thread it runs on, so concurrent requests on the event
+# loop would clobber each other's profiles; one request is profiled at a time
+_cpu_profile_lock = threading.Lock()
+
+
+def profile_dir() -> str:
+    directory = os.path.abspath(os.getenv('PROFILE_DIR') or DEFAULT_PROFILE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def profile_name(*parts: str) -> str:
+    """Timestamped file name (without extension) from the given labels"""
+    labels = [re.sub(r'[^\w-]+', '_', part).strip('_') for part in parts if part]
+    return '-'.join([f'{datetime.utcnow():%Y%m%dT%H%M%S%f}'] + [label for label in labels if label])
+
+
+def should_profile_request(header: Optional[str], sample: bool = True) -> bool:
+    """
+    Whether to profile an API request
+
+    The X-Profile header must carry PROFILE_TOKEN; without a token configured
+    any value is accepted, but only when ENVIRONMENT is development.
+    Otherwise requests are sampled at PROFILE_SAMPLE_RATE.
+
+    Args:
+        header: Value of the X-Profile header
+        sample: Whether the request may be sampled (False for polled endpoints)
+    """
+    if header:
+        if PROFILE_TOKEN:
+            return header == PROFILE_TOKEN
+        return os.getenv('ENVIRONMENT', 'development') == 'development'
+    return sample and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def folded_stacks(stats: pstats.Stats, min_fraction: float = MIN_FOLDED_FRACTION) -> Dict[str, int]:
+    """
+    Collapsed stacks (microseconds of own time per stack) from cProfile stats
+
+    cProfile only keeps caller -> callee edges, so full stacks are rebuilt
+    from the roots down, splitting each function's time between its callees
+    in proportion to the time spent in each; recursive calls are cut at the
+    first repeat.
+
+    Returns:
+        Stack ('root;caller;function') -> microseconds
+    """
+    entries = stats.stats
+    children: Dict[tuple, Dict[tuple, float]] = {}
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, edge_cumulative) in callers.items():
+            children.setdefault(caller, {})[function] = edge_cumulative
+
+    def label(function) -> str:
+        filename, line, name = function
+        if filename == '~':
+            return name
+        return f'{name} ({os.path.basename(filename)}:{line})'
+
+    roots = [function for function, entry in entries.items() if not entry[4]]
+    total = sum(entries[root][3] for root in roots) or 1.0
+    threshold = total * min_fraction
+    folded: Dict[str, int] = {}
+
+    def walk(function, seconds: float, path: List[str], seen: set):
+        _, _, own, cumulative, _ = entries[function]
+        if cumulative <= 0:
+            return
+        stack = path + [label(function)]
+        own_share = seconds * own / cumulative
+        if own_share > 0:
+            key = ';'.join(stack)
+            folded[key] = folded.get(key, 0) + int(own_share * 1e6)
+        for child, edge_cumulative in children.get(function, {}).items():
+            share = seconds * edge_cumulative / cumulative
+            if share >= threshold and child not in seen and child in entries:
+                walk(child, share, stack, seen | {child})
+
+    for root in roots:
+        walk(root, entries[root][3], [], {root})
+    return {stack: micros for stack, micros in folded.items() if micros > 0}
+
+
+def write_folded(folded: Dict[str, int], path: str) -> str:
+    """Write collapsed stacks, heaviest first"""
+    with open(path, 'w', encoding='utf8') as out:
+        for stack, weight in sorted(folded.items(), key=lambda entry: -entry[1]):
+            out.write(f'{stack} {weight}\n')
+    return path
+
+
+def save_cpu_profile(stats: pstats.Stats, base: str) -> Tuple[str, str]:
+    """Write <base>.prof and <base>.folded; returns both paths"""
+    stats.dump_stats(f'{base}.prof')
+    return f'{base}.prof', write_folded(folded_stacks(stats), f'{base}.folded')
+
+
+class CPUProfile:
+    """A cProfile capture in progress; `id` names its files in PROFILE_DIR"""
+
+    def __init__(self, *labels: str):
+        self.id = profile_name(*labels)
+        self.profiler = cProfile.Profile()
+        self.paths: Tuple[str, ...] = ()
+
+    def save(self) -> Tuple[str, ...]:
+        self.paths = save_cpu_profile(pstats.Stats(self.profiler), os.path.join(profile_dir(), self.id))
+        return self.paths
+
+
+@contextmanager
+def cpu_profile(*labels: str):
+    """
+    Profile the enclosed block with cProfile and save it
+
+    Yields the CPUProfile, or None when another profile is already running.
+    On the event loop this covers whatever the loop runs meanwhile, so other
+    requests served concurrently show up in the profile too.
+    """
+    if not _cpu_profile_lock.acquire(blocking=False):
+        yield None
+        return
+    capture = CPUProfile(*labels)
+    try:
+        capture.profiler.enable()
+        try:
+            yield capture
+        finally:
+            capture.profiler.disable()
+        capture.save()
+    finally:
+        _cpu_profile_lock.release()
+
+
+def process_tree_rss(pid: int = None) -> Optional[int]:
+    """
+    Resident memory (bytes) of a process and all its descendants, which for
+    a Playwright crawl includes the driver and browser processes
+
+    Returns:
+        None where /proc is not available
+    """
+    pid = pid or os.getpid()
+    total, pending, seen = 0, [pid], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open(f'/proc/{current}/status', encoding='utf8') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children', encoding='utf8') as listing:
+                    pending.extend(int(child) for child in listing.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+def spider_profile_args(spider_name: str, mode: str) -> Tuple[List[str], str]:
+    """
+    Extra `scrapy crawl` arguments to run a spider under a profiler
+
+    Args:
+        spider_name: Spider being run
+        mode: 'cpu' or 'memory'
+
+    Returns:
+        (arguments, base path of the profile files)
+    """
+    if mode not in SPIDER_PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {SPIDER_PROFILE_MODES}")
+    base = os.path.join(profile_dir(), profile_name(spider_name, mode))
+    if mode == 'cpu':
+        return ['--profile', f'{base}.prof'], base
+    return ['-s', f'MEMORY_PROFILE_PATH={base}'], base
+
+
+def finish_spider_profile(base: str, mode: str, crawl_stats: Dict) -> List[str]:
+    """
+    Complete a profiled spider run's files: the folded stacks of a CPU
+    profile and <base>.stats.json with the crawl's stats
+
+    Returns:
+        Paths of the profile files that exist
+    """
+    if mode == 'cpu' and os.path.exists(f'{base}.prof'):
+        write_folded(folded_stacks(pstats.Stats(f'{base}.prof')), f'{base}.folded')
+    with open(f'{base}.stats.json', 'w', encoding='utf8') as out:
+        json.dump(crawl_stats, out, indent=2, sort_keys=True)
+    suffixes = ('.prof', '.folded', '.memory.txt', '.memory.jsonl', '.stats.json')
+    return [base + suffix for suffix in suffixes if os.path.exists(base + suffix)]
+
+
+class MemoryProfilerExtension:
+    """
+    Track memory of a crawl with tracemalloc
+
+    Enabled by the MEMORY_PROFILE_PATH setting (a base path, set by
+    run_spider in memory mode). Every MEMORY_PROFILE_INTERVAL seconds the
+    Python heap and the resident memory of the process tree are appended to
+    <base>.memory.jsonl together with the Playwright pages opened; when the
+    crawl closes the largest allocation sites go to <base>.memory.txt and
+    the allocation stacks, weighted by bytes, to <base>.folded.
+    """
+
+    def __init__(self, base: str, interval: float, frames: int, top: int, stats):
+        self.base = base
+        self.interval = interval
+        self.frames = frames
+        self.top = top
+        self.stats = stats
+        self.samples = None
+        self.task = None
+        self.peak_rss = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        base = crawler.settings.get('MEMORY_PROFILE_PATH')
+        if not base:
+            raise NotConfigured
+        ext = cls(
+            base,
+            crawler.settings.getfloat('MEMORY_PROFILE_INTERVAL', 5),
+            crawler.settings.getint('MEMORY_PROFILE_FRAMES', 25),
+            crawler.settings.getint('MEMORY_PROFILE_TOP', 50),
+            crawler.stats,
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        from twisted.internet import task
+
+        tracemalloc.start(self.frames)
+        self.samples = open(f'{self.base}.memory.jsonl', 'w', encoding='utf8')
+        self.task = task.LoopingCall(self.sample, spider)
+        self.task.start(self.interval, now=True)
+        spider.logger.info(f'Memory profiling to {self.base}.*')
+
+    def sample(self, spider):
+        heap, heap_peak = tracemalloc.get_traced_memory()
+        rss = process_tree_rss()
+        self.peak_rss = max(self.peak_rss, rss or 0)
+        record = {
+            'at': round(time.time(), 3),
+            'heap_bytes': heap,
+            'heap_peak_bytes': heap_peak,
+            'rss_bytes': rss,
+            'pages_opened': self.stats.get_value('playwright/page_count', 0, spider=spider),
+            'contexts_opened': self.stats.get_value('playwright/context_count', 0, spider=spider),
+            'items': self.stats.get_value('item_scraped_count', 0, spider=spider),
+        }
+        self.samples.write(json.dumps(record) + '\n')
+        self.samples.flush()
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.sample(spider)
+        self.samples.close()
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        _, heap_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stats.set_value('memprofile/heap_peak_bytes', heap_peak, spider=spider)
+        if self.peak_rss:
+            self.stats.set_value('memprofile/rss_peak_bytes', self.peak_rss, spider=spider)
+
+        with open(f'{self.base}.memory.txt', 'w', encoding='utf8') as report:
+            report.write(f'Python heap peak: {heap_peak / 2**20:.1f} MiB, '
+                         f'process tree RSS peak: {self.peak_rss / 2**20:.1f} MiB\n\n')
+            for statistic in snapshot.statistics('lineno')[:self.top]:
+                report.write(f'{statistic}\n')
+
+        folded: Dict[str, int] = {}
+        for statistic in snapshot.statistics('traceback'):
+            stack = ';'.join(f'{os.path.basename(frame.filename)}:{frame.lineno}' for frame in statistic.traceback)
+            folded[stack] = folded.get(stack, 0) + statistic.size
+        write_folded(folded, f'{self.base}.folded')
+
+
+def list_profiles(directory: str = None, limit: int = 20) -> List[Dict]:
+    """Most recent profiles: name, files and size"""
+    directory = directory or profile_dir()
+    profiles: Dict[str, Dict] = {}
+    for filename in os.listdir(directory):
+        name, _, suffix = filename.partition('.')
+        entry = profiles.setdefault(name, {'name': name, 'files': [], 'bytes': 0})
+        entry['files'].append(suffix)
+        entry['bytes'] += os.path.getsize(os.path.join(directory, filename))
+    return sorted(profiles.values(), key=lambda entry: entry['name'], reverse=True)[:limit]
+
+
+def main():
+    """CLI: python -m pricing_scrapers.profiling [list|top PROF [N]|folded PROF [OUT]]"""
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+
+    if command == 'top' and len(sys.argv) > 2:
+        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+        pstats.Stats(sys.argv[2]).sort_stats('cumulative').print_stats(limit)
+    elif command == 'folded' and len(sys.argv) > 2:
+        out = sys.argv[3] if len(sys.argv) > 3 else os.path.splitext(sys.argv[2])[0] + '.folded'
+        print(f"Wrote {write_folded(folded_stacks(pstats.Stats(sys.argv[2])), out)}")
+    else:
+        for entry in list_profiles():
+            print(f"{entry['name']}  {entry['bytes'] / 1024:8.1f} KiB  {', '.join(sorted(entry['files']))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Similarity index over cached category keys
+Lets the API serve a closely related, fresh cached query instead of scraping
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+NGRAM_SIZE = 3
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query into the key used for caching and matching"""
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', (query or '').lower())).strip()
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Counter:
+    """Character n-grams of each word, padded so prefixes/suffixes count"""
+    grams = Counter()
+    for word in text.split():
+        padded = f' {word} '
+        if len(padded) <= n:
+            grams[padded] += 1
+            continue
+        for i in range(len(padded) - n + 1):
+            grams[padded[i:i + n]] += 1
+    return grams
+
+
+class QueryIndex:
+    """
+    Incremental TF-IDF index of character n-grams over category keys
+
+    Keys are added as new cached data is seen; document frequencies are kept
+    up to date on insert, so no full rebuild is ever needed.
+    """
+
+    def __init__(self):
+        self.grams: Dict[str, Counter] = {}
+        self.last_seen: Dict[str, datetime] = {}
+        self.doc_freq: Counter = Counter()
+        self.postings: Dict[str, set] = defaultdict(set)
+
+    def __len__(self):
+        return len(self.grams)
+
+    def update(self, key: str, scraped_at: datetime):
+        """
+        Add a key, or refresh the timestamp of its newest cached data
+
+        Args:
+            key: Normalized category key
+            scraped_at: Timestamp of a cached listing for this key
+        """
+        if not key:
+            return
+
+        if key not in self.grams:
+            grams = char_ngrams(key)
+            self.grams[key] = grams
+            for gram in grams:
+                self.doc_freq[gram] += 1
+                self.postings[gram].add(key)
+
+        if key not in self.last_seen or scraped_at > self.last_seen[key]:
+            self.last_seen[key] = scraped_at
+
+    def _idf(self, gram: str) -> float:
+        return math.log((1 + len(self.grams)) / (1 + self.doc_freq[gram])) + 1
+
+    def _vector(self, grams: Counter) -> Dict[str, float]:
+        vector = {gram: count * self._idf(gram) for gram, count in grams.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {gram: v / norm for gram, v in vector.items()}
+
+    def best_match(
+        self,
+        query: str,
+        min_score: float,
+        fresh_since: Optional[datetime] = None,
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Find the most similar indexed key
+
+        Args:
+            query: Raw or normalized query
+            min_score: Minimum cosine similarity (0-1) to accept
+            fresh_since: Ignore keys with no data newer than this
+
+        Returns:
+            (key, score) of the best match, or None
+        """
+        key = normalize_query(query)
+        query_grams = char_ngrams(key)
+        if not query_grams:
+            return None
+
+        candidates = set()
+        for gram in query_grams:
+            candidates |= self.postings.get(gram, set())
+        candidates.discard(key)
+
+        query_vector = self._vector(query_grams)
+        best = None
+        for candidate in candidates:
+            if fresh_since and self.last_seen[candidate] < fresh_since:
+                continue
+            candidate_vector = self._vector(self.grams[candidate])
+            score = sum(
+                weight * candidate_vector.get(gram, 0.0)
+                for gram, weight in query_vector.items()
+            )
+            if score >= min_score and (best is None or score > best[1]):
+                best = (candidate, round(score, 4))
+
+        return best
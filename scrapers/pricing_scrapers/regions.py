@@ -0,0 +1,71 @@
+"""
+Region definitions shared by the API, flows and spiders
+Regions are part of the cache key, so every entry point normalizes them here
+"""
+
+DEFAULT_REGION = 'global'
+
+REGIONS = {
+    'global': {'locale': 'en-US', 'country': 'US', 'currency': 'USD'},
+    'us': {'locale': 'en-US', 'country': 'US', 'currency': 'USD'},
+    'uk': {'locale': 'en-GB', 'country': 'GB', 'currency': 'GBP'},
+    'eu': {'locale': 'en-IE', 'country': 'DE', 'currency': 'EUR'},
+    'in': {'locale': 'en-IN', 'country': 'IN', 'currency': 'INR'},
+    'ca': {'locale': 'en-CA', 'country': 'CA', 'currency': 'CAD'},
+    'au': {'locale': 'en-AU', 'country': 'AU', 'currency': 'AUD'},
+}
+
+REGION_ALIASES = {
+    'worldwide': 'global',
+    'international': 'global',
+    'usa': 'us',
+    'united states': 'us',
+    'america': 'us',
+    'gb': 'uk',
+    'united kingdom': 'uk',
+    'england': 'uk',
+    'europe': 'eu',
+    'germany': 'eu',
+    'france': 'eu',
+    'india': 'in',
+    'canada': 'ca',
+    'australia': 'au',
+}
+
+
+def normalize_region(region: str) -> str:
+    """
+    Map free-form region input ('India', 'Mumbai, India', 'US') to a region key
+
+    Unknown regions fall back to 'global'.
+    """
+    value = (region or DEFAULT_REGION).strip().lower()
+    if value in REGIONS:
+        return value
+    if value in REGION_ALIASES:
+        return REGION_ALIASES[value]
+
+    # Free-form locations such as "Bangalore, India"
+    for part in reversed([p.strip() for p in value.split(',')]):
+        if part in REGIONS:
+            return part
+        if part in REGION_ALIASES:
+            return REGION_ALIASES[part]
+
+    return DEFAULT_REGION
+
+
+def region_locale(region: str) -> str:
+    """Browser locale for a region (e.g. 'en-IN')"""
+    return REGIONS[normalize_region(region)]['locale']
+
+
+def accept_language(region: str) -> str:
+    """Accept-Language header value for a region"""
+    locale = region_locale(region)
+    return f"{locale},{locale.split('-')[0]};q=0.9"
+
+
+def region_country(region: str) -> str:
+    """ISO country code used for region-specific search parameters"""
+    return REGIONS[normalize_region(region)]['country']
@@ -0,0 +1,425 @@
+"""
+Crawl run ledger
+Every crawl leaves one structured record: spider, query and region, items
+scraped and dropped, requests, bytes, duration, errors by class, the finish
+reason and exit status, the full Scrapy stats dump and where its log went.
+The crawl process writes the record from its own stats when it closes;
+run_spider opens it before launching the process and completes it with the
+exit status, so runs that were killed or crashed are recorded too.
+
+Records live in a small SQLite file (RUN_LEDGER_PATH) shared by the API,
+Prefect flows and spider processes, and are queried with GET /runs or:
+
+    python -m pricing_scrapers.run_ledger list [SPIDER]
+    python -m pricing_scrapers.run_ledger show RUN_ID
+    python -m pricing_scrapers.run_ledger summary [HOURS]
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, List, Optional
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from pricing_scrapers.circuit_breaker import crawl_errors
+from pricing_scrapers.spiders.base import QUERY_SEPARATOR, query_label
+
+DEFAULT_RUN_LEDGER_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'run_ledger.db')
+DEFAULT_RUN_LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'logs')
+
+RUNNING, FINISHED, FAILED, TIMEOUT = 'running', 'finished', 'failed', 'timeout'
+
+# Columns filled from the crawl's stats
+STAT_COLUMNS = {
+    'items_scraped': 'item_scraped_count',
+    'items_dropped': 'item_dropped_count',
+    'requests': 'downloader/request_count',
+    'responses': 'downloader/response_count',
+    'bytes': 'downloader/response_bytes',
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+def error_classes(stats: Dict) -> Dict[str, int]:
+    """
+    Errors of a crawl by class: download exceptions and spider exceptions by
+    exception type, HTTP errors as 'http_<status>'
+    """
+    classes: Dict[str, int] = {}
+    for key, count in stats.items():
+        if key.startswith('downloader/exception_type_count/'):
+            name = key.rsplit('/', 1)[1].rsplit('.', 1)[-1]
+        elif key.startswith('spider_exceptions/') and key.count('/') == 1:
+            name = key.split('/', 1)[1]
+        elif key.startswith('downloader/response_status_count/'):
+            status = key.rsplit('/', 1)[1]
+            if not status.isdigit() or int(status) < 400:
+                continue
+            name = f'http_{status}'
+        else:
+            continue
+        classes[name] = classes.get(name, 0) + count
+    return classes
+
+
+class RunLedger:
+    """
+    Structured record of every crawl
+
+    Args:
+        path: SQLite file (RUN_LEDGER_PATH)
+        retention_days: Records older than this are pruned as new runs start
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS crawl_runs (
+            run_id TEXT PRIMARY KEY,
+            spider TEXT NOT NULL,
+            query TEXT,
+            region TEXT,
+            status TEXT NOT NULL,
+            reason TEXT,
+            exit_code INTEGER,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            duration_seconds REAL,
+            items_scraped INTEGER,
+            items_dropped INTEGER,
+            requests INTEGER,
+            responses INTEGER,
+            bytes INTEGER,
+            errors INTEGER,
+            error_classes TEXT,
+            stats TEXT,
+            log_path TEXT,
+            trace_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS crawl_runs_spider_started ON crawl_runs (spider, started_at);
+        CREATE INDEX IF NOT EXISTS crawl_runs_started ON crawl_runs (started_at);
+    """
+
+    def __init__(self, path: str = None, retention_days: float = 90):
+        self.path = path or os.getenv('RUN_LEDGER_PATH', DEFAULT_RUN_LEDGER_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.retention = timedelta(days=retention_days)
+        self._local = threading.local()
+        self.connection.executescript(self.SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def start(self, run_id: str, spider: str, query: str = None, region: str = None,
+              log_path: str = None, trace_id: str = None):
+        """Open the record of a run (a no-op if it already exists)"""
+        now = _now()
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO crawl_runs (run_id, spider, query, region, status, started_at, log_path, trace_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, spider, query, region, RUNNING, now.isoformat(), log_path, trace_id),
+            )
+            self.connection.execute(
+                'DELETE FROM crawl_runs WHERE started_at < ?', ((now - self.retention).isoformat(),)
+            )
+
+    def finish(self, run_id: str, stats: Dict, reason: str):
+        """
+        Record a crawl's outcome from its Scrapy stats (called by the crawl
+        process as it closes)
+        """
+        values = {column: int(stats.get(key, 0)) for column, key in STAT_COLUMNS.items()}
+        elapsed = stats.get('elapsed_time_seconds')
+        with self.connection:
+            self.connection.execute(
+                'UPDATE crawl_runs SET status = ?, reason = ?, finished_at = ?, duration_seconds = ?, '
+                'items_scraped = ?, items_dropped = ?, requests = ?, responses = ?, bytes = ?, '
+                'errors = ?, error_classes = ?, stats = ? WHERE run_id = ?',
+                (
+                    FINISHED, reason, _now().isoformat(), elapsed,
+                    values['items_scraped'], values['items_dropped'], values['requests'],
+                    values['responses'], values['bytes'],
+                    crawl_errors(stats), json.dumps(error_classes(stats)),
+                    json.dumps(stats, default=str, sort_keys=True), run_id,
+                ),
+            )
+
+    def complete(self, run_id: str, exit_code: Optional[int], status: str = None,
+                 duration_seconds: float = None) -> Optional[Dict]:
+        """
+        Close a run from the launching side once its process has exited
+
+        Args:
+            run_id: Run to close
+            exit_code: Process exit code (None when it was killed)
+            status: TIMEOUT for a killed run; otherwise FINISHED, or FAILED
+                for a non-zero exit or a crawl that never recorded its stats
+            duration_seconds: Wall time, used when the crawl recorded none
+
+        Returns:
+            The completed record
+        """
+        record = self.get(run_id)
+        if record is None:
+            return None
+        if status is None:
+            status = FINISHED if exit_code == 0 and record['finished_at'] else FAILED
+        with self.connection:
+            self.connection.execute(
+                'UPDATE crawl_runs SET status = ?, exit_code = ?, finished_at = COALESCE(finished_at, ?), '
+                'duration_seconds = COALESCE(duration_seconds, ?), reason = COALESCE(reason, ?) WHERE run_id = ?',
+                (status, exit_code, _now().isoformat(), duration_seconds, status, run_id),
+            )
+        return self.get(run_id)
+
+    def get(self, run_id: str) -> Optional[Dict]:
+        """One run, with its error classes and stats decoded"""
+        row = self.connection.execute('SELECT * FROM crawl_runs WHERE run_id = ?', (run_id,)).fetchone()
+        return self._decode(row, with_stats=True) if row else None
+
+    def _decode(self, row: sqlite3.Row, with_stats: bool = False) -> Dict:
+        record = dict(row)
+        record['error_classes'] = json.loads(record['error_classes'] or '{}')
+        stats = record.pop('stats')
+        if with_stats:
+            record['stats'] = json.loads(stats or '{}')
+        return record
+
+    def query(
+        self,
+        spider: str = None,
+        query: str = None,
+        status: str = None,
+        since: datetime = None,
+        limit: int = 50,
+    ) -> List[Dict]:
+        """
+        Most recent runs, newest first (without the full stats)
+
+        Args:
+            spider: Only this spider
+            query: Only this search query
+            status: running, finished, failed or timeout
+            since: Only runs started at or after this time
+            limit: Maximum number of runs
+        """
+        conditions, params = [], []
+        for column, value in (('spider', spider), ('query', query), ('status', status)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since:
+            conditions.append('started_at >= ?')
+            params.append(since.isoformat())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self.connection.execute(
+            f'SELECT * FROM crawl_runs {where} ORDER BY started_at DESC LIMIT ?', (*params, limit)
+        ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def last_successes(self, since: datetime = None, key: Callable[[str], str] = None) -> Dict[tuple, datetime]:
+        """
+        Latest finished run that scraped items per (spider, query, region);
+        a batch run counts for each of its queries
+
+        Args:
+            since: Only runs started at or after this time
+            key: Normalizes queries (e.g. normalize_query), so variants of
+                one query share their freshness
+        """
+        rows = self.connection.execute(
+            'SELECT spider, query, region, MAX(finished_at) AS finished_at FROM crawl_runs '
+            "WHERE status = 'finished' AND items_scraped > 0 AND started_at >= ? "
+            'GROUP BY spider, query, region',
+            ((since or datetime.min.replace(tzinfo=timezone.utc)).isoformat(),),
+        ).fetchall()
+        latest: Dict[tuple, datetime] = {}
+        for row in rows:
+            finished_at = datetime.fromisoformat(row['finished_at'])
+            # Batch runs cover every query of their '|'-joined list
+            for query in (row['query'] or '').split(QUERY_SEPARATOR):
+                entry = (row['spider'], key(query) if key else query, row['region'])
+                if entry not in latest or finished_at > latest[entry]:
+                    latest[entry] = finished_at
+        return latest
+
+    def summary(self, since: datetime = None) -> List[Dict]:
+        """
+        Per spider: runs, failures and timeouts, total items and errors,
+        mean duration and mean items per run
+
+        Args:
+            since: Only runs started at or after this time (default: all)
+        """
+        rows = self.connection.execute(
+            'SELECT spider, COUNT(*) AS runs, '
+            "SUM(status = 'failed') AS failed, SUM(status = 'timeout') AS timeouts, "
+            "SUM(status = 'running') AS running, "
+            'SUM(items_scraped) AS items_scraped, SUM(items_dropped) AS items_dropped, '
+            'SUM(errors) AS errors, SUM(requests) AS requests, '
+            'AVG(duration_seconds) AS mean_duration_seconds, AVG(items_scraped) AS mean_items, '
+            'MAX(started_at) AS last_started_at '
+            'FROM crawl_runs WHERE started_at >= ? GROUP BY spider ORDER BY spider',
+            ((since or datetime.min.replace(tzinfo=timezone.utc)).isoformat(),),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+_ledger: Optional[RunLedger] = None
+
+
+def get_run_ledger(settings=None) -> RunLedger:
+    """
+    Shared ledger configured from Scrapy settings (or the project settings module)
+    """
+    global _ledger
+    if _ledger is None:
+        if settings is None:
+            from scrapy.settings import Settings
+            from pricing_scrapers import settings as settings_module
+            settings = Settings()
+            settings.setmodule(settings_module)
+        _ledger = RunLedger(
+            path=settings.get('RUN_LEDGER_PATH') or None,
+            retention_days=settings.getfloat('RUN_LEDGER_RETENTION_DAYS', 90),
+        )
+    return _ledger
+
+
+_log_handlers: Dict[str, RotatingFileHandler] = {}
+_log_handlers_lock = threading.Lock()
+
+
+def crawl_log_path(spider: str) -> str:
+    """The spider's crawl log, <RUN_LOG_DIR>/<spider>.log"""
+    return os.path.abspath(os.path.join(os.getenv('RUN_LOG_DIR', DEFAULT_RUN_LOG_DIR), f'{spider}.log'))
+
+
+def crawl_logger(spider: str, max_bytes: int = None, backup_count: int = None) -> logging.Logger:
+    """
+    Logger writing a spider's crawl output to its crawl log, rotated at
+    RUN_LOG_MAX_BYTES with RUN_LOG_BACKUPS old files kept
+    """
+    logger = logging.getLogger(f'crawl.{spider}')
+    with _log_handlers_lock:
+        if spider not in _log_handlers:
+            path = crawl_log_path(spider)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=max_bytes or int(os.getenv('RUN_LOG_MAX_BYTES', 10 * 2**20)),
+                backupCount=backup_count or int(os.getenv('RUN_LOG_BACKUPS', 5)),
+                encoding='utf8',
+            )
+            handler.setFormatter(logging.Formatter('%(run_id)s %(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            _log_handlers[spider] = handler
+    return logger
+
+
+def stream_output(lines, spider: str, run_id: str, tail: int = 50) -> List[str]:
+    """
+    Write a crawl's output lines to the spider's rotating log, tagged with the
+    run id, keeping only the last `tail` lines in memory
+
+    Returns:
+        The last lines, for error reporting
+    """
+    logger = crawl_logger(spider)
+    last = deque(maxlen=tail)
+    tag = {'run_id': run_id[:12]}
+    for line in lines:
+        line = line.rstrip('\n')
+        logger.info(line, extra=tag)
+        last.append(line)
+    return list(last)
+
+
+class RunLedgerExtension:
+    """
+    Write the crawl's record to the run ledger when it closes
+
+    The run id comes from the RUN_ID setting (set by run_spider); crawls
+    started by hand get a fresh one. Enabled with RUN_LEDGER_ENABLED.
+    """
+
+    def __init__(self, crawler, ledger: RunLedger):
+        self.crawler = crawler
+        self.ledger = ledger
+        self.run_id = crawler.settings.get('RUN_ID') or new_run_id()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('RUN_LEDGER_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler, get_run_ledger(crawler.settings))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        trace_span = getattr(spider, 'trace_span', None)
+        self.ledger.start(
+            self.run_id,
+            spider.name,
+            query=query_label(spider),
+            region=getattr(spider, 'region', None),
+            trace_id=trace_span.trace_id if trace_span else None,
+        )
+        self.crawler.stats.set_value('run_id', self.run_id, spider=spider)
+
+    def spider_closed(self, spider, reason):
+        self.ledger.finish(self.run_id, self.crawler.stats.get_stats(spider), reason)
+
+
+def main():
+    """CLI: python -m pricing_scrapers.run_ledger [list [SPIDER]|show RUN_ID|summary [HOURS]]"""
+    import sys
+
+    ledger = get_run_ledger()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+
+    if command == 'show' and len(sys.argv) > 2:
+        print(json.dumps(ledger.get(sys.argv[2]), indent=2))
+    elif command == 'summary':
+        hours = float(sys.argv[2]) if len(sys.argv) > 2 else 24
+        for entry in ledger.summary(since=_now() - timedelta(hours=hours)):
+            print(
+                f"{entry['spider']}: {entry['runs']} runs ({entry['failed']} failed, {entry['timeouts']} timed out), "
+                f"{entry['items_scraped'] or 0} items, {entry['errors'] or 0} errors, "
+                f"mean {entry['mean_duration_seconds'] or 0:.1f}s"
+            )
+    else:
+        spider = sys.argv[2] if len(sys.argv) > 2 else None
+        for run in ledger.query(spider=spider):
+            print(
+                f"{run['run_id']}  {run['started_at'][:19]}  {run['spider']:12s} {run['status']:9s} "
+                f"{run['reason'] or '':24s} {run['items_scraped'] or 0:5d} items  {run['errors'] or 0:4d} errors  "
+                f"{run['query']}"
+            )
+
+
+if __name__ == '__main__':
+    main()
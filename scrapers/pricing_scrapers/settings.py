@@ -1,5 +1,7 @@
 # Scrapy settings for pricing_scrapers project
 
+import os
+
 BOT_NAME = 'pricing_scrapers'
 
 SPIDER_MODULES = ['pricing_scrapers.spiders']
@@ -33,21 +35,37 @@ DEFAULT_REQUEST_HEADERS = {
 }
 
 # Enable or disable spider middlewares
+# The project spider middleware times callbacks, so it sits closest to the spider
 SPIDER_MIDDLEWARES = {
-    'pricing_scrapers.middlewares.PricingScrapersSpiderMiddleware': 543,
+    'pricing_scrapers.middlewares.PricingScrapersSpiderMiddleware': 950,
 }
 
 # Enable or disable downloader middlewares
 DOWNLOADER_MIDDLEWARES = {
     'pricing_scrapers.middlewares.PricingScrapersDownloaderMiddleware': 543,
+    'pricing_scrapers.middlewares.CircuitBreakerMiddleware': 40,
+    'pricing_scrapers.middlewares.EarlyStopMiddleware': 50,
+    'pricing_scrapers.middlewares.ProxyManagerMiddleware': 610,
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy_user_agents.middlewares.RandomUserAgentMiddleware': 400,
 }
 
-# Enable Playwright for JavaScript rendering
+# Health-scored proxy rotation (pricing_scrapers.proxies): PROXY_LIST is
+# comma separated, PROXY_LIST_FILE has one proxy URL per line
+PROXY_ENABLED = os.getenv('PROXY_ENABLED', 'false').lower() == 'true'
+PROXY_LIST = os.getenv('PROXY_LIST', '')
+PROXY_LIST_FILE = os.getenv('PROXY_LIST_FILE')
+PROXY_BAN_RETRIES = 2
+PROXY_SLOW_SECONDS = 15
+PROXY_SLOW_COOLDOWN = 60
+PROXY_BAN_COOLDOWN = 300
+PROXY_MAX_BAN_COOLDOWN = 3600
+
+# Enable Playwright for JavaScript rendering (the handler also stamps the
+# start of each transfer for the request timings)
 DOWNLOAD_HANDLERS = {
-    "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
-    "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
+    "http": "pricing_scrapers.handlers.TimedDownloadHandler",
+    "https": "pricing_scrapers.handlers.TimedDownloadHandler",
 }
 
 PLAYWRIGHT_BROWSER_TYPE = "chromium"
@@ -58,9 +76,48 @@ PLAYWRIGHT_LAUNCH_OPTIONS = {
 # Configure item pipelines
 ITEM_PIPELINES = {
     'pricing_scrapers.pipelines.DataCleaningPipeline': 300,
+    'pricing_scrapers.pipelines.OutlierPipeline': 350,
     'pricing_scrapers.pipelines.SupabasePipeline': 400,
+    'pricing_scrapers.pipelines.AggregatesPipeline': 500,
 }
 
+# Items failing validation against the MarketListing model go to REJECTS_DIR
+REJECTS_DIR = 'output/rejects'
+
+# Batch cleaning: swap pricing_scrapers.pipelines.BatchCleaningPipeline in for
+# DataCleaningPipeline to clean items in columnar batches (large crawls only)
+BATCH_CLEANING_SIZE = 5000
+BATCH_CLEANING_MAX_DELAY = 0.5
+
+# Per-request timing breakdown (pricing_scrapers.timing), exported per spider/domain
+TIMING_DIR = 'output/timing'
+
+# Memory profiling (pricing_scrapers.profiling), enabled per run by
+# MEMORY_PROFILE_PATH, which run_spider sets when SPIDER_PROFILE=memory
+MEMORY_PROFILE_INTERVAL = 5
+MEMORY_PROFILE_FRAMES = 25
+MEMORY_PROFILE_TOP = 50
+
+# Run ledger (pricing_scrapers.run_ledger): one structured record per crawl,
+# stored at RUN_LEDGER_PATH (env) and kept for RUN_LEDGER_RETENTION_DAYS
+RUN_LEDGER_ENABLED = True
+RUN_LEDGER_RETENTION_DAYS = 90
+
+# Currency normalization: price_usd (and optionally a target currency) from cached FX rates
+CURRENCY_CONVERSION_ENABLED = True
+PRICE_TARGET_CURRENCY = None
+
+# Outlier flagging: robust z-score against a rolling median/MAD per category/source
+OUTLIER_FILTER_ENABLED = True
+OUTLIER_WINDOW = 200
+OUTLIER_THRESHOLD = 3.5
+OUTLIER_MIN_SAMPLES = 10
+
+# Write spool: items are spooled to disk and drained to the listing store in bulk
+SPOOL_ENABLED = True
+SPOOL_FLUSH_ITEMS = 20
+SPOOL_DRAIN_TIMEOUT = 30
+
 # Enable and configure HTTP caching
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 3600
@@ -71,15 +128,37 @@ HTTPCACHE_IGNORE_HTTP_CODES = [500, 502, 503, 504, 400, 403, 404]
 REQUEST_FINGERPRINTER_IMPLEMENTATION = '2.7'
 TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
 
-# Feed export settings
-FEEDS = {
-    'output/%(name)s_%(time)s.json': {
-        'format': 'json',
-        'encoding': 'utf8',
-        'store_empty': False,
-        'indent': 2,
-    }
+# Raw output archive: zstd Parquet partitioned by date/source/category
+# (read with pricing_scrapers.archive.scan)
+EXTENSIONS = {
+    'pricing_scrapers.tracing.CrawlTracingExtension': 10,
+    'pricing_scrapers.circuit_breaker.CircuitBreakerExtension': 50,
+    'pricing_scrapers.early_stop.EarlyStopExtension': 100,
+    'pricing_scrapers.archive.ArchiveFeedExporter': 500,
+    'pricing_scrapers.profiling.MemoryProfilerExtension': 900,
+    'pricing_scrapers.run_ledger.RunLedgerExtension': 950,
 }
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = 'output/archive'
+ARCHIVE_ROWS_PER_FILE = 5000
+
+# Adaptive early stop: close the spider once the 95% interval of the median
+# price is within ±EARLY_STOP_PRECISION of it (inlier prices only). Spiders
+# take at most 20 listings per results page, so the minimum must be reachable
+# from one page after rejects and outliers
+EARLY_STOP_ENABLED = True
+EARLY_STOP_MIN_ITEMS = 15
+EARLY_STOP_PRECISION = 0.1
+EARLY_STOP_CONFIDENCE = 0.95
+
+# Circuit breaker per spider, persisted across runs: open after
+# CIRCUIT_FAILURE_THRESHOLD failed crawls in a row (no items, or at least
+# CIRCUIT_ERROR_RATE of requests errored), probe again after the cooldown
+CIRCUIT_BREAKER_ENABLED = True
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_COOLDOWN_MINUTES = 30
+CIRCUIT_MAX_COOLDOWN_MINUTES = 24 * 60
 
 # AutoThrottle extension
 AUTOTHROTTLE_ENABLED = True
@@ -0,0 +1,141 @@
+"""
+Mergeable streaming quantile sketch (KLL)
+Karnin, Lang & Liberty, "Optimal Quantile Approximation in Streams" (2016)
+
+A KLL sketch keeps a stack of compactors; compactor h holds items that each
+stand for 2^h inputs. When the sketch is full, a compactor sorts its items and
+promotes every other one (random offset) to the level above. Sketches built on
+different sources, regions or days merge by concatenating levels and
+compacting again, with the same error guarantee as a single sketch.
+"""
+
+import math
+import random
+from typing import Dict, List, Optional
+
+DEFAULT_K = 200
+
+
+def normalized_rank_error(k: int = DEFAULT_K) -> float:
+    """
+    Approximate normalized rank error at 99% confidence for a given k
+
+    Empirical fit published with Apache DataSketches' KLL sketch: about 1.3%
+    at k=200, i.e. the p90 returned lies between the true p88.7 and p91.3.
+    """
+    return 2.296 / k ** 0.9723
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch with integer-weighted updates
+
+    Args:
+        k: Accuracy parameter; memory grows linearly and error shrinks as ~1/k
+    """
+
+    C = 2.0 / 3.0
+
+    def __init__(self, k: int = DEFAULT_K):
+        self.k = k
+        self.levels: List[List[float]] = [[]]
+        self.n = 0
+        self._random = random.Random()
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * self.C ** depth)))
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _size(self) -> int:
+        return sum(len(level) for level in self.levels)
+
+    def update(self, value: float, weight: int = 1):
+        """
+        Add a value
+
+        Args:
+            value: Observed value
+            weight: Whole number of times the value is counted; it is added
+                at the levels of its binary representation
+        """
+        weight = int(weight)
+        if weight <= 0:
+            return
+        self.n += weight
+        level = 0
+        while weight:
+            if weight & 1:
+                while level >= len(self.levels):
+                    self.levels.append([])
+                self.levels[level].append(value)
+            weight >>= 1
+            level += 1
+        if self._size() >= self._max_size():
+            self._compress()
+
+    def _compress(self):
+        for level in range(len(self.levels)):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 >= len(self.levels):
+                    self.levels.append([])
+                items = sorted(self.levels[level])
+                leftover = [items.pop()] if len(items) % 2 else []
+                offset = self._random.randint(0, 1)
+                self.levels[level + 1].extend(items[offset::2])
+                self.levels[level] = leftover
+                if self._size() < self._max_size():
+                    break
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """Fold another sketch into this one"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        while self._size() >= self._max_size():
+            before = self._size()
+            self._compress()
+            if self._size() >= before:
+                break
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate value at quantile q (0-1)"""
+        weighted = sorted(
+            (value, 1 << level)
+            for level, items in enumerate(self.levels)
+            for value in items
+        )
+        if not weighted:
+            return None
+        total = sum(weight for _, weight in weighted)
+        threshold = q * total
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= threshold:
+                return value
+        return weighted[-1][0]
+
+    def rank_error(self) -> float:
+        """Normalized rank error bound for this sketch's k"""
+        return normalized_rank_error(self.k)
+
+    def to_dict(self) -> Dict:
+        # Prices are money; cents are plenty and keep the payload small
+        return {'k': self.k, 'n': self.n, 'levels': [[round(v, 2) for v in level] for level in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> 'KLLSketch':
+        sketch = cls(k=(data or {}).get('k', DEFAULT_K))
+        if data:
+            sketch.n = data.get('n', 0)
+            sketch.levels = [list(level) for level in data.get('levels', [[]])] or [[]]
+        return sketch
@@ -1,9 +1,11 @@
 import scrapy
 from scrapy_playwright.page import PageMethod
 from pricing_scrapers.items import MarketListingItem
+from pricing_scrapers.regions import accept_language, region_locale
+from pricing_scrapers.spiders.base import MarketSpider
 
 
-class AppSumoSpider(scrapy.Spider):
+class AppSumoSpider(MarketSpider):
     """
     Spider for scraping AppSumo product listings
     Used for: digital products (SaaS, tools, software)
@@ -16,19 +18,27 @@ class AppSumoSpider(scrapy.Spider):
         'DOWNLOAD_DELAY': 4,
     }
 
-    def __init__(self, category='productivity', *args, **kwargs):
+    default_query = 'productivity'
+
+    def __init__(self, category=None, *args, **kwargs):
+        # Queries are AppSumo categories; `category` is the older name for `query`
+        kwargs['query'] = kwargs.get('query') or category
         super(AppSumoSpider, self).__init__(*args, **kwargs)
-        self.category = category
-        self.start_urls = [
-            f'https://appsumo.com/browse/{category}/'
-        ]
+
+    def search_url(self, query):
+        slug = '-'.join(query.lower().split())
+        return f'https://appsumo.com/browse/{slug}/'
 
     def start_requests(self):
-        for url in self.start_urls:
+        for query, url in zip(self.queries, self.start_urls):
             yield scrapy.Request(
                 url,
+                headers={'Accept-Language': accept_language(self.region)},
                 meta={
+                    'query': query,
                     'playwright': True,
+                    'playwright_context': self.region,
+                    'playwright_context_kwargs': {'locale': region_locale(self.region)},
                     'playwright_page_methods': [
                         PageMethod('wait_for_selector', 'div.product-card', timeout=10000),
                     ],
@@ -70,7 +80,8 @@ class AppSumoSpider(scrapy.Spider):
             # Description
             item['description'] = product.css('p.description::text, div.excerpt::text').get('').strip()[:200]
 
-            item['category'] = self.category
+            item['category'] = self.query_for(response)
+            item['region'] = self.region
             item['url'] = response.urljoin(product.css('a::attr(href)').get(''))
 
             if item['title'] and item['price'] > 0:
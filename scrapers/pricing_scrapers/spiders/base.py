@@ -0,0 +1,87 @@
+"""
+Base spider for search-driven marketplaces
+One run can cover a batch of queries, so pre-warm and scheduled jobs pay for
+process and browser startup once instead of once per niche:
+
+    scrapy crawl fiverr -a query="logo design"
+    scrapy crawl fiverr -a queries="logo design|ui design|web development"
+    scrapy crawl fiverr -a queries_file=queries.txt   # one query per line
+
+Start requests fan out over all queries; every request carries its query in
+meta['query'] and items are tagged with it in `category`.
+"""
+
+from typing import List, Optional
+import scrapy
+from pricing_scrapers.regions import normalize_region
+
+QUERY_SEPARATOR = '|'
+
+
+def parse_queries(query: str = None, queries: str = None, queries_file: str = None) -> List[str]:
+    """
+    Queries of a run from the spider arguments, in order and without duplicates
+
+    Args:
+        query: A single query
+        queries: Queries separated by '|'
+        queries_file: File with one query per line ('#' comments)
+    """
+    found = [query] if query else []
+    if queries:
+        found.extend(queries.split(QUERY_SEPARATOR))
+    if queries_file:
+        with open(queries_file, encoding='utf8') as lines:
+            found.extend(line.split('#', 1)[0] for line in lines)
+    found = [entry.strip() for entry in found]
+    return list(dict.fromkeys(entry for entry in found if entry))
+
+
+def spider_queries(spider) -> List[str]:
+    """
+    Queries of a spider run as a list
+
+    MarketSpider parses them once in __init__; a spider that is not one keeps
+    a `queries` argument as the raw '|'-separated string, which is parsed
+    here rather than iterated character by character.
+    """
+    queries = getattr(spider, 'queries', None)
+    if isinstance(queries, str):
+        return parse_queries(queries=queries)
+    if queries:
+        return list(queries)
+    query = getattr(spider, 'query', None)
+    return [query] if query else []
+
+
+def query_label(spider) -> Optional[str]:
+    """All queries of a spider run joined with '|' (for ledgers and traces)"""
+    return QUERY_SEPARATOR.join(spider_queries(spider)) or None
+
+
+class MarketSpider(scrapy.Spider):
+    """
+    Spider searching a marketplace for one or more queries
+
+    Subclasses set `default_query` and implement search_url(); their
+    start_requests() iterate over zip(self.queries, self.start_urls) and put
+    the query in the request meta, and their callbacks tag items with
+    query_for(response).
+    """
+
+    default_query = None
+
+    def __init__(self, query=None, region='global', queries=None, queries_file=None, *args, **kwargs):
+        super(MarketSpider, self).__init__(*args, **kwargs)
+        self.queries = parse_queries(query, queries, queries_file) or [self.default_query]
+        self.query = self.queries[0]
+        self.region = normalize_region(region)
+        self.start_urls = [self.search_url(query) for query in self.queries]
+
+    def search_url(self, query: str) -> str:
+        """Search results URL for a query"""
+        raise NotImplementedError
+
+    def query_for(self, response) -> str:
+        """Query a response was requested for"""
+        return response.meta.get('query', self.query)
@@ -1,9 +1,11 @@
 import scrapy
 from scrapy_playwright.page import PageMethod
 from pricing_scrapers.items import MarketListingItem
+from pricing_scrapers.regions import accept_language, region_locale, region_country
+from pricing_scrapers.spiders.base import MarketSpider
 
 
-class EtsySpider(scrapy.Spider):
+class EtsySpider(MarketSpider):
     """
     Spider for scraping Etsy product listings
     Used for: digital products (templates, graphics, printables)
@@ -16,19 +18,21 @@ class EtsySpider(scrapy.Spider):
         'DOWNLOAD_DELAY': 3,
     }
 
-    def __init__(self, query='digital planner', *args, **kwargs):
-        super(EtsySpider, self).__init__(*args, **kwargs)
-        self.query = query
-        self.start_urls = [
-            f'https://www.etsy.com/search?q={query.replace(" ", "+")}'
-        ]
+    default_query = 'digital planner'
+
+    def search_url(self, query):
+        return f'https://www.etsy.com/search?q={query.replace(" ", "+")}&ship_to={region_country(self.region)}'
 
     def start_requests(self):
-        for url in self.start_urls:
+        for query, url in zip(self.queries, self.start_urls):
             yield scrapy.Request(
                 url,
+                headers={'Accept-Language': accept_language(self.region)},
                 meta={
+                    'query': query,
                     'playwright': True,
+                    'playwright_context': self.region,
+                    'playwright_context_kwargs': {'locale': region_locale(self.region)},
                     'playwright_page_methods': [
                         PageMethod('wait_for_selector', 'div.listing-link', timeout=10000),
                     ],
@@ -70,7 +74,8 @@ class EtsySpider(scrapy.Spider):
             # Seller info
             item['seller_name'] = listing.css('span.shop-name::text, a.shop-link::text').get('').strip()
 
-            item['category'] = self.query
+            item['category'] = self.query_for(response)
+            item['region'] = self.region
             item['url'] = response.urljoin(listing.css('a::attr(href)').get(''))
 
             if item['title'] and item['price'] > 0:
@@ -1,9 +1,11 @@
 import scrapy
 from scrapy_playwright.page import PageMethod
 from pricing_scrapers.items import MarketListingItem
+from pricing_scrapers.regions import accept_language, region_locale
+from pricing_scrapers.spiders.base import MarketSpider
 
 
-class FiverrSpider(scrapy.Spider):
+class FiverrSpider(MarketSpider):
     """
     Spider for scraping Fiverr gig listings
     Used for: digital services (design, development, writing, etc.)
@@ -16,19 +18,21 @@ class FiverrSpider(scrapy.Spider):
         'DOWNLOAD_DELAY': 3,
     }
 
-    def __init__(self, query='ui design', *args, **kwargs):
-        super(FiverrSpider, self).__init__(*args, **kwargs)
-        self.query = query
-        self.start_urls = [
-            f'https://www.fiverr.com/search/gigs?query={query.replace(" ", "%20")}&source=top-bar&search_in=everywhere'
-        ]
+    default_query = 'ui design'
+
+    def search_url(self, query):
+        return f'https://www.fiverr.com/search/gigs?query={query.replace(" ", "%20")}&source=top-bar&search_in=everywhere'
 
     def start_requests(self):
-        for url in self.start_urls:
+        for query, url in zip(self.queries, self.start_urls):
             yield scrapy.Request(
                 url,
+                headers={'Accept-Language': accept_language(self.region)},
                 meta={
+                    'query': query,
                     'playwright': True,
+                    'playwright_context': self.region,
+                    'playwright_context_kwargs': {'locale': region_locale(self.region)},
                     'playwright_page_methods': [
                         PageMethod('wait_for_selector', 'div[data-gig-card]', timeout=10000),
                     ],
@@ -76,7 +80,8 @@ class FiverrSpider(scrapy.Spider):
             delivery_text = gig.css('span.delivery::text, div.delivery-time::text').get('')
             item['delivery_time'] = self.clean_delivery(delivery_text)
 
-            item['category'] = self.query
+            item['category'] = self.query_for(response)
+            item['region'] = self.region
             item['url'] = response.urljoin(gig.css('a::attr(href)').get(''))
 
             if item['title'] and item['price'] > 0:
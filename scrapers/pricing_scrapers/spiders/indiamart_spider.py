@@ -1,8 +1,10 @@
 import scrapy
 from pricing_scrapers.items import MarketListingItem
+from pricing_scrapers.regions import accept_language
+from pricing_scrapers.spiders.base import MarketSpider
 
 
-class IndiaMartSpider(scrapy.Spider):
+class IndiaMartSpider(MarketSpider):
     """
     Spider for scraping IndiaMART product listings
     Used for: physical products and services in India
@@ -15,12 +17,19 @@ class IndiaMartSpider(scrapy.Spider):
         'DOWNLOAD_DELAY': 2,
     }
 
-    def __init__(self, query='office furniture', *args, **kwargs):
-        super(IndiaMartSpider, self).__init__(*args, **kwargs)
-        self.query = query
-        self.start_urls = [
-            f'https://dir.indiamart.com/search.mp?ss={query.replace(" ", "+")}'
-        ]
+    default_query = 'office furniture'
+
+    def search_url(self, query):
+        return f'https://dir.indiamart.com/search.mp?ss={query.replace(" ", "+")}'
+
+    def start_requests(self):
+        for query, url in zip(self.queries, self.start_urls):
+            yield scrapy.Request(
+                url,
+                headers={'Accept-Language': accept_language(self.region)},
+                meta={'query': query},
+                callback=self.parse,
+            )
 
     def parse(self, response):
         """Parse IndiaMART search results"""
@@ -49,7 +58,8 @@ class IndiaMartSpider(scrapy.Spider):
             rating_text = product.css('span.rating::text, div.rating::text').get('')
             item['rating'] = self.extract_rating(rating_text)
 
-            item['category'] = self.query
+            item['category'] = self.query_for(response)
+            item['region'] = self.region
             item['url'] = response.urljoin(product.css('a::attr(href)').get(''))
 
             if item['title'] and item['price'] > 0:
@@ -58,7 +68,12 @@ class IndiaMartSpider(scrapy.Spider):
         # Follow pagination
         next_page = response.css('a.next::attr(href), a.pagination-next::attr(href)').get()
         if next_page:
-            yield response.follow(next_page, callback=self.parse)
+            yield response.follow(
+                next_page,
+                headers={'Accept-Language': accept_language(self.region)},
+                meta={'query': self.query_for(response)},
+                callback=self.parse,
+            )
 
     def extract_price(self, text):
         """Extract price from text like '₹ 5,000 / Piece'"""
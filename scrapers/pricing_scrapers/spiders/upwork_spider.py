@@ -1,9 +1,11 @@
 import scrapy
 from scrapy_playwright.page import PageMethod
 from pricing_scrapers.items import MarketListingItem
+from pricing_scrapers.regions import accept_language, region_locale
+from pricing_scrapers.spiders.base import MarketSpider
 
 
-class UpworkSpider(scrapy.Spider):
+class UpworkSpider(MarketSpider):
     """
     Spider for scraping Upwork freelancer listings
     Used for: digital services (development, design, writing, etc.)
@@ -16,19 +18,21 @@ class UpworkSpider(scrapy.Spider):
         'DOWNLOAD_DELAY': 4,
     }
 
-    def __init__(self, query='web development', *args, **kwargs):
-        super(UpworkSpider, self).__init__(*args, **kwargs)
-        self.query = query
-        self.start_urls = [
-            f'https://www.upwork.com/search/profiles/?q={query.replace(" ", "%20")}'
-        ]
+    default_query = 'web development'
+
+    def search_url(self, query):
+        return f'https://www.upwork.com/search/profiles/?q={query.replace(" ", "%20")}'
 
     def start_requests(self):
-        for url in self.start_urls:
+        for query, url in zip(self.queries, self.start_urls):
             yield scrapy.Request(
                 url,
+                headers={'Accept-Language': accept_language(self.region)},
                 meta={
+                    'query': query,
                     'playwright': True,
+                    'playwright_context': self.region,
+                    'playwright_context_kwargs': {'locale': region_locale(self.region)},
                     'playwright_page_methods': [
                         PageMethod('wait_for_selector', 'article.profile-item', timeout=10000),
                     ],
@@ -74,7 +78,8 @@ class UpworkSpider(scrapy.Spider):
             # Description
             item['description'] = profile.css('p.description::text, div.overview::text').get('').strip()[:200]
 
-            item['category'] = self.query
+            item['category'] = self.query_for(response)
+            item['region'] = self.region
             item['url'] = response.urljoin(profile.css('a::attr(href)').get(''))
 
             if item['title'] and item['price'] > 0:
@@ -0,0 +1,490 @@
+"""
+Durable on-disk spool for listing writes
+Pipelines append items locally at full speed; a drainer replays them into the
+listing store in bulk, so a slow or unavailable database never stalls a crawl
+or loses scraped items
+
+Segments are append-only JSONL files where each line is "<crc32> <json>".
+A segment moves through <name>.open (being written) -> <name>.spool (sealed)
+-> <name>.draining (claimed by one drainer) and is deleted only after every
+record in it has been written. Segments left .open or .draining by a crashed
+process are picked up again once they have been untouched for a while.
+
+Records the store keeps rejecting on their own (constraint or schema errors)
+are moved to a <name>.dead segment so they cannot block the spool; requeue
+them with `python -m pricing_scrapers.spool requeue` once the cause is fixed.
+
+Besides listings (SPOOL_DIR), two kinds of records are spooled the same way
+in subdirectories: aggregate deltas (aggregates/, merged into the stored
+aggregates by AggregatesPipeline and the API server) and listings a cached
+store could not write to Supabase (remote/, see CachedStore).
+
+Spool depth (segments, records and bytes pending, dead-letter records) is
+kept in counters in <SPOOL_DIR>/depth.db, shared by every process using the
+spool: appends add to them, drained segments subtract, so /health and
+/metrics read it without scanning a backed-up spool. Counters are rebuilt
+from the segment files whenever abandoned segments are reclaimed, since a
+crash may have left them off.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+from pricing_scrapers.aggregates import merge_delta_records
+from pricing_scrapers.storage import ListingStore, prepare_listing
+
+DEFAULT_SPOOL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'spool')
+SEGMENT_MAX_RECORDS = 500
+# Open/draining segments untouched this long belong to a process that died
+ABANDONED_SEGMENT_SECONDS = 600
+SEGMENT_SUFFIXES = ('.open', '.spool', '.draining')
+DEAD_SUFFIX = '.dead'
+DEPTH_FILE = 'depth.db'
+# Subdirectories of SPOOL_DIR for records other than listings
+AGGREGATE_SPOOL = 'aggregates'
+REMOTE_BACKLOG_SPOOL = 'remote'
+# Passes a record may fail on its own, with no other write succeeding, before
+# it is quarantined (until then the failure may be a store outage)
+MAX_RECORD_FAILURES = 5
+
+
+class StoreUnavailable(Exception):
+    """A drain pass could not tell a rejected record from a store outage"""
+
+
+def spool_directory(name: str = None) -> str:
+    """SPOOL_DIR, or its subdirectory for one kind of record (AGGREGATE_SPOOL, REMOTE_BACKLOG_SPOOL)"""
+    directory = os.getenv('SPOOL_DIR', DEFAULT_SPOOL_DIR)
+    return os.path.join(directory, name) if name else directory
+
+
+class WriteSpool:
+    """
+    Append-only segmented spool of records waiting to be stored
+
+    Args:
+        directory: Segment directory (default SPOOL_DIR)
+        segment_max_records: Records per segment
+        prepare: Applied to each record before it is written; must give it
+            an 'id' (default prepare_listing, for listings)
+    """
+
+    DEPTH_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS spool_depth (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            segments INTEGER NOT NULL DEFAULT 0,
+            records INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            dead_records INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, directory: str = None, segment_max_records: int = SEGMENT_MAX_RECORDS,
+                 prepare: Callable[[Dict], Dict] = prepare_listing):
+        self.directory = directory or spool_directory()
+        self.segment_max_records = segment_max_records
+        self.prepare = prepare
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._segment = None
+        self._segment_path = None
+        self._segment_records = 0
+        self.connection.executescript(self.DEPTH_SCHEMA)
+        with self.connection:
+            created = self.connection.execute('INSERT OR IGNORE INTO spool_depth (id) VALUES (0)').rowcount
+        if created:
+            # First use of the counters, possibly on an existing spool
+            self.recount()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread to the depth counters"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(os.path.join(self.directory, DEPTH_FILE), timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def _count(self, segments: int = 0, records: int = 0, size: int = 0, dead_records: int = 0):
+        """Add to the depth counters (an atomic increment, safe across processes)"""
+        with self.connection:
+            self.connection.execute(
+                'UPDATE spool_depth SET segments = MAX(segments + ?, 0), records = MAX(records + ?, 0), '
+                'bytes = MAX(bytes + ?, 0), dead_records = MAX(dead_records + ?, 0) WHERE id = 0',
+                (segments, records, size, dead_records),
+            )
+
+    def _segments(self, suffixes: Tuple[str, ...] = SEGMENT_SUFFIXES) -> List[str]:
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(suffixes)
+        )
+
+    @staticmethod
+    def _write_records(segment, records: List[Dict]) -> int:
+        """Write records as checksummed lines; returns the bytes written"""
+        size = 0
+        for record in records:
+            payload = json.dumps(record, default=str, ensure_ascii=False)
+            checksum = zlib.crc32(payload.encode('utf8'))
+            line = f'{checksum:08x} {payload}\n'
+            segment.write(line)
+            size += len(line.encode('utf8'))
+        return size
+
+    def _open_segment(self):
+        # pid + time keeps segments from concurrent spider processes apart
+        name = f'{time.time_ns():020d}-{os.getpid()}.open'
+        self._segment_path = os.path.join(self.directory, name)
+        self._segment = open(self._segment_path, 'a', encoding='utf8')
+        self._segment_records = 0
+
+    def append(self, records: List[Dict]):
+        """
+        Durably append records
+
+        Args:
+            records: Listing dicts; ids and timestamps are assigned here (by
+                prepare) so a replayed record is recognisable as a duplicate
+        """
+        segments = size = 0
+        with self._lock:
+            for record in records:
+                if self._segment is None or self._segment_records >= self.segment_max_records:
+                    self._seal()
+                    self._open_segment()
+                    segments += 1
+                size += self._write_records(self._segment, [self.prepare(record)])
+                self._segment_records += 1
+            if self._segment:
+                self._segment.flush()
+                os.fsync(self._segment.fileno())
+        if records:
+            self._count(segments=segments, records=len(records), size=size)
+
+    def _seal(self):
+        if self._segment:
+            self._segment.close()
+            os.rename(self._segment_path, self._segment_path[:-len('.open')] + '.spool')
+            self._segment = None
+            self._segment_path = None
+
+    def seal(self):
+        """Close the current segment so a drainer may consume it"""
+        with self._lock:
+            self._seal()
+
+    def claim_segments(self) -> List[str]:
+        """
+        Claim sealed (or abandoned) segments for draining
+
+        Claiming is an atomic rename, so concurrent drainers in the API and
+        spider processes never replay the same segment at once.
+
+        Returns:
+            Paths of the claimed .draining segments, oldest first
+        """
+        abandoned_before = time.time() - ABANDONED_SEGMENT_SECONDS
+        claimed = []
+        abandoned = False
+        for path in self._segments():
+            if path == self._segment_path:
+                continue
+            if not path.endswith('.spool'):
+                try:
+                    if os.path.getmtime(path) >= abandoned_before:
+                        continue
+                except FileNotFoundError:
+                    continue
+
+            draining_path = os.path.splitext(path)[0] + '.draining'
+            try:
+                os.rename(path, draining_path)
+            except FileNotFoundError:
+                continue  # claimed by another drainer
+            claimed.append(draining_path)
+            abandoned = abandoned or not path.endswith('.spool')
+        if abandoned:
+            # The process that left them may have died between a write and its count
+            self.recount()
+        return claimed
+
+    @staticmethod
+    def release_segment(path: str):
+        """Return a claimed segment to the spool after a failed drain"""
+        os.rename(path, os.path.splitext(path)[0] + '.spool')
+
+    def remove_segment(self, path: str, lines: int):
+        """Delete a drained segment of `lines` lines and take it off the depth counters"""
+        size = os.path.getsize(path)
+        os.remove(path)
+        self._count(segments=-1, records=-lines, size=-size)
+
+    def quarantine(self, path: str, records: List[Dict]):
+        """Append records of a claimed segment to its dead-letter segment"""
+        dead_path = os.path.splitext(path)[0] + DEAD_SUFFIX
+        with open(dead_path, 'a', encoding='utf8') as segment:
+            self._write_records(segment, records)
+            segment.flush()
+            os.fsync(segment.fileno())
+        self._count(dead_records=len(records))
+
+    def requeue_dead(self) -> int:
+        """
+        Return dead-letter segments to the spool for another drain
+
+        Returns:
+            Number of segments requeued
+        """
+        dead = self._segments((DEAD_SUFFIX,))
+        for path in dead:
+            lines, size = self._count_lines(path), os.path.getsize(path)
+            # A fresh name: the origin segment may still be spooled
+            os.rename(path, os.path.join(self.directory, f'{time.time_ns():020d}-{os.getpid()}-requeued.spool'))
+            self._count(segments=1, records=lines, size=size, dead_records=-lines)
+        return len(dead)
+
+    @staticmethod
+    def read_segment(path: str) -> Tuple[List[Dict], int]:
+        """
+        Read the valid records of a segment
+
+        Returns:
+            (records, corrupt line count); torn or corrupted lines are skipped
+        """
+        records, corrupt = [], 0
+        with open(path, encoding='utf8') as segment:
+            for line in segment:
+                checksum, _, payload = line.rstrip('\n').partition(' ')
+                try:
+                    if int(checksum, 16) != zlib.crc32(payload.encode('utf8')):
+                        raise ValueError('checksum mismatch')
+                    records.append(json.loads(payload))
+                except ValueError:
+                    corrupt += 1
+        return records, corrupt
+
+    def depth(self) -> Dict:
+        """Spool depth from the counters: segment count, record count and size on disk, plus dead-letter records"""
+        row = self.connection.execute(
+            'SELECT segments, records, bytes, dead_records FROM spool_depth WHERE id = 0'
+        ).fetchone()
+        return dict(row)
+
+    def recount(self) -> Dict:
+        """Rebuild the depth counters by reading every segment (O(backlog)); returns the new depth"""
+        segments = self._segments()
+        depth = {
+            'segments': len(segments),
+            'records': sum(self._count_lines(path) for path in segments),
+            'bytes': sum(self._size(path) for path in segments),
+            'dead_records': sum(self._count_lines(path) for path in self._segments((DEAD_SUFFIX,))),
+        }
+        with self.connection:
+            self.connection.execute(
+                'UPDATE spool_depth SET segments = ?, records = ?, bytes = ?, dead_records = ? WHERE id = 0',
+                (depth['segments'], depth['records'], depth['bytes'], depth['dead_records']),
+            )
+        return depth
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _count_lines(path: str) -> int:
+        try:
+            with open(path, 'rb') as segment:
+                return sum(1 for _ in segment)
+        except FileNotFoundError:
+            return 0
+
+
+class SpoolDrainer:
+    """
+    Replays sealed spool segments into a listing store (or, with `write`,
+    any store write that takes a batch of records and raises on failure)
+
+    Records are deduplicated by id before writing (a crash between the write
+    and the segment delete replays the segment). Writes are issued in batches
+    of batch_size, at most max_batches_per_second. A failing batch is split in
+    halves until the records the store rejects are isolated; a record failing
+    on its own is quarantined when the store accepted other writes in the same
+    pass, or after max_record_failures passes. Otherwise the failure is taken
+    for an outage and the pass stops, leaving the segment spooled.
+    """
+
+    def __init__(
+        self,
+        spool: WriteSpool,
+        store: ListingStore,
+        batch_size: int = 200,
+        max_batches_per_second: float = 2.0,
+        interval: float = 10.0,
+        max_record_failures: int = MAX_RECORD_FAILURES,
+        write: Callable[[List[Dict]], int] = None,
+    ):
+        self.spool = spool
+        self.store = store
+        self.write = write or store.insert_listings
+        self.batch_size = batch_size
+        self.min_batch_interval = 1.0 / max_batches_per_second if max_batches_per_second else 0
+        self.interval = interval
+        self.max_record_failures = max_record_failures
+        self.seen_ids = set()
+        self.max_seen_ids = 100000
+        self.record_failures: Dict[str, int] = {}
+        self.stats = {
+            'drained': 0, 'duplicates': 0, 'corrupt': 0, 'quarantined': 0, 'errors': 0, 'last_error': None,
+        }
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_batch_at = 0.0
+        self._store_up = False
+
+    def _throttle(self):
+        wait = self.min_batch_interval - (time.monotonic() - self._last_batch_at)
+        if wait > 0:
+            time.sleep(wait)
+        self._last_batch_at = time.monotonic()
+
+    def _mark_seen(self, records: List[Dict]):
+        if len(self.seen_ids) > self.max_seen_ids:
+            self.seen_ids.clear()
+        self.seen_ids.update(record['id'] for record in records)
+
+    def _write(self, path: str, batch: List[Dict]) -> int:
+        """
+        Write a batch, splitting it around records the store rejects
+
+        Returns:
+            Number of records written
+
+        Raises:
+            StoreUnavailable: a lone record failed and nothing shows the store is up
+        """
+        self._throttle()
+        try:
+            self.write(batch)
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.stats['last_error'] = str(e)
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                return self._write(path, batch[:middle]) + self._write(path, batch[middle:])
+
+            record_id = batch[0]['id']
+            failures = self.record_failures[record_id] = self.record_failures.get(record_id, 0) + 1
+            if not self._store_up and failures < self.max_record_failures:
+                raise StoreUnavailable(str(e)) from e
+            self.spool.quarantine(path, batch)
+            self.record_failures.pop(record_id, None)
+            self.stats['quarantined'] += 1
+            self._mark_seen(batch)
+            return 0
+
+        self._store_up = True
+        self._mark_seen(batch)
+        for record in batch:
+            self.record_failures.pop(record['id'], None)
+        return len(batch)
+
+    def drain_once(self) -> int:
+        """
+        Replay all sealed segments
+
+        Returns:
+            Number of records written; stops when the store seems to be down
+        """
+        written = 0
+        self._store_up = False
+        claimed = self.spool.claim_segments()
+        for index, path in enumerate(claimed):
+            records, corrupt = self.spool.read_segment(path)
+            self.stats['corrupt'] += corrupt
+
+            pending = []
+            for record in records:
+                if record['id'] in self.seen_ids:
+                    self.stats['duplicates'] += 1
+                    continue
+                pending.append(record)
+
+            try:
+                for start in range(0, len(pending), self.batch_size):
+                    written += self._write(path, pending[start:start + self.batch_size])
+            except StoreUnavailable:
+                for unfinished in claimed[index:]:
+                    self.spool.release_segment(unfinished)
+                break
+
+            self.spool.remove_segment(path, len(records) + corrupt)
+
+        self.stats['drained'] += written
+        return written
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.drain_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Drain in a background thread every `interval` seconds"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop the background thread"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+def aggregate_spool() -> WriteSpool:
+    """Spool of aggregate delta records (see aggregates.delta_records), which carry their ids"""
+    return WriteSpool(spool_directory(AGGREGATE_SPOOL), prepare=dict)
+
+
+def aggregate_drainer(spool: WriteSpool, store: ListingStore, **kwargs) -> SpoolDrainer:
+    """Drainer merging spooled aggregate deltas into the store's aggregates"""
+    return SpoolDrainer(spool, store, write=partial(merge_delta_records, store), **kwargs)
+
+
+def main():
+    """CLI: python -m pricing_scrapers.spool [depth|drain|requeue|recount] [listings|aggregates]"""
+    import sys
+    from pricing_scrapers.storage import get_listing_store
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'depth'
+    aggregates = len(sys.argv) > 2 and sys.argv[2] == 'aggregates'
+    spool = aggregate_spool() if aggregates else WriteSpool()
+
+    if command == 'drain':
+        store = get_listing_store()
+        drainer = aggregate_drainer(spool, store) if aggregates else SpoolDrainer(spool, store)
+        print(f"Drained {drainer.drain_once()} records: {drainer.stats}")
+    elif command == 'requeue':
+        print(f"Requeued {spool.requeue_dead()} dead-letter segments")
+    elif command == 'recount':
+        spool.recount()
+
+    print(f"Spool depth: {spool.depth()}")
+
+
+if __name__ == '__main__':
+    main()
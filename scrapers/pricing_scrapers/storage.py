@@ -0,0 +1,768 @@
+"""
+Pluggable storage for market listings
+Supabase is the shared store; SQLite is a local single-file store that works
+standalone (dev, benchmarks, offline) or as a read/write-through cache in front
+of Supabase
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from pricing_scrapers.aggregates import AGGREGATE_KEY_FIELDS
+from pricing_scrapers.metrics import CACHE_LOOKUPS, observe_store_call, timed_store_call
+from pricing_scrapers.query_index import normalize_query
+from pricing_scrapers.regions import normalize_region
+
+load_dotenv()
+
+LISTING_COLUMNS = [
+    'id', 'source', 'title', 'price', 'currency', 'price_usd', 'price_target',
+    'target_currency', 'rating', 'reviews', 'delivery_time', 'seller_name',
+    'seller_level', 'description', 'category', 'region', 'url', 'is_outlier',
+    'scraped_at',
+]
+
+DEFAULT_LOCAL_STORE_PATH = os.path.join(
+    os.path.dirname(__file__), '..', 'data', 'listings.db'
+)
+
+
+def to_utc_iso(value) -> str:
+    """Normalize a timestamp (datetime or ISO string) to an aware UTC ISO string"""
+    if value is None:
+        value = datetime.now(timezone.utc)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+def prepare_listing(listing: Dict) -> Dict:
+    """Give a listing an id, a region and a normalized UTC scraped_at"""
+    row = {key: listing.get(key) for key in LISTING_COLUMNS if key in listing}
+    row['id'] = row.get('id') or str(uuid.uuid4())
+    row['region'] = normalize_region(row.get('region'))
+    row['scraped_at'] = to_utc_iso(row.get('scraped_at'))
+    return row
+
+
+class ListingStore:
+    """Interface shared by all listing stores"""
+
+    name = 'base'
+
+    def insert_listings(self, listings: List[Dict]) -> int:
+        """
+        Store listings
+
+        Args:
+            listings: Listing dicts (see MarketListingItem)
+
+        Returns:
+            Number of listings written
+        """
+        raise NotImplementedError
+
+    def fetch_listings(
+        self,
+        query: str,
+        region: str = 'global',
+        since: Optional[datetime] = None,
+        limit: int = 50,
+        exact: bool = False,
+        include_outliers: bool = False,
+    ) -> List[Dict]:
+        """
+        Newest-first listings for a category
+
+        Args:
+            query: Category/query to match
+            region: Region key
+            since: Only listings scraped at or after this time
+            limit: Maximum rows
+            exact: Match the category exactly (case-insensitive) instead of
+                loosely (by prefix or substring, see each store)
+            include_outliers: Also return listings flagged is_outlier
+
+        Returns:
+            List of listing dicts
+        """
+        raise NotImplementedError
+
+    def fetch_categories(self, since: datetime, limit: int = 1000) -> List[Dict]:
+        """
+        Recently scraped (category, region, scraped_at) rows, newest first
+
+        Args:
+            since: Only rows scraped after this time
+            limit: Maximum rows
+        """
+        raise NotImplementedError
+
+    def fetch_aggregates(
+        self,
+        category_key: str,
+        regions: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None,
+        resolution: str = 'day',
+        since_bucket: Optional[str] = None,
+        until_bucket: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        Stored price aggregates for a category key
+
+        Args:
+            category_key: Normalized category
+            regions: Only these regions (default: all)
+            sources: Only these sources (default: all)
+            resolution: Bucket size, 'hour', 'day' or 'week'
+            since_bucket: First bucket start, ISO timestamp (inclusive)
+            until_bucket: Last bucket start, ISO timestamp (inclusive)
+
+        Returns:
+            Rows with category_key, source, region, currency, resolution,
+            bucket, data, updated_at, version
+        """
+        raise NotImplementedError
+
+    def fetch_aggregate(self, key: Dict) -> Optional[Dict]:
+        """
+        One stored aggregate, read from the authoritative store (never a
+        cache), for a read-modify-write with swap_aggregate
+
+        Args:
+            key: Values of AGGREGATE_KEY_FIELDS
+
+        Returns:
+            The row, or None if there is none
+        """
+        raise NotImplementedError
+
+    def swap_aggregate(self, row: Dict, version: Optional[int]) -> bool:
+        """
+        Write an aggregate only if nobody changed it since it was read
+        (optimistic concurrency: the write bumps the row's version)
+
+        Args:
+            row: Key fields, data and updated_at
+            version: Version of the row read, or None if there was no row
+
+        Returns:
+            False if another writer got there first; re-read and retry
+        """
+        raise NotImplementedError
+
+    def delete_aggregates(self, resolution: str, before_bucket: str) -> int:
+        """
+        Drop aggregates of one resolution older than a bucket start
+
+        Returns:
+            Number of rows deleted
+        """
+        raise NotImplementedError
+
+    def delete_listings(self, before: datetime) -> int:
+        """
+        Drop raw listings scraped before a time
+
+        Returns:
+            Number of rows deleted
+        """
+        raise NotImplementedError
+
+    def scan_listings(self, since: datetime, until: datetime, batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """
+        Raw listings scraped in [since, until), in batches ordered by scraped_at
+        """
+        raise NotImplementedError
+
+    def save_aggregates(self, rows: List[Dict]):
+        """
+        Insert or replace price aggregates
+
+        Args:
+            rows: Rows as returned by fetch_aggregates
+        """
+        raise NotImplementedError
+
+
+class SupabaseStore(ListingStore):
+    """market_listings table in Supabase"""
+
+    name = 'supabase'
+
+    def __init__(self, supabase_url: str = None, supabase_key: str = None):
+        from supabase import create_client
+
+        self.supabase = create_client(
+            supabase_url or os.getenv('SUPABASE_URL'),
+            supabase_key or os.getenv('SUPABASE_SERVICE_ROLE_KEY'),
+        )
+
+    @timed_store_call
+    def insert_listings(self, listings: List[Dict]) -> int:
+        rows = [prepare_listing(listing) for listing in listings]
+        if rows:
+            # Ignore ids that already exist so replayed writes are idempotent
+            self.supabase.table('market_listings')\
+                .upsert(rows, on_conflict='id', ignore_duplicates=True)\
+                .execute()
+        return len(rows)
+
+    @timed_store_call
+    def fetch_listings(self, query, region='global', since=None, limit=50, exact=False, include_outliers=False):
+        request = self.supabase.table('market_listings')\
+            .select('*')\
+            .ilike('category', query if exact else f'%{query}%')\
+            .eq('region', normalize_region(region))
+
+        if not include_outliers:
+            request = request.or_('is_outlier.is.null,is_outlier.eq.false')
+
+        if since:
+            request = request.gte('scraped_at', to_utc_iso(since))
+
+        result = request.order('scraped_at', desc=True).limit(limit).execute()
+        return result.data or []
+
+    @timed_store_call
+    def fetch_categories(self, since, limit=1000):
+        result = self.supabase.table('market_listings')\
+            .select('category, region, scraped_at')\
+            .gt('scraped_at', to_utc_iso(since))\
+            .order('scraped_at', desc=True)\
+            .limit(limit)\
+            .execute()
+        return result.data or []
+
+    @timed_store_call
+    def fetch_aggregates(self, category_key, regions=None, sources=None, resolution='day', since_bucket=None, until_bucket=None):
+        request = self.supabase.table('market_price_stats')\
+            .select('*')\
+            .eq('category_key', category_key)\
+            .eq('resolution', resolution)
+        if regions:
+            request = request.in_('region', [normalize_region(region) for region in regions])
+        if sources:
+            request = request.in_('source', list(sources))
+        if since_bucket:
+            request = request.gte('bucket', since_bucket)
+        if until_bucket:
+            request = request.lte('bucket', until_bucket)
+        return request.execute().data or []
+
+    @timed_store_call
+    def fetch_aggregate(self, key):
+        request = self.supabase.table('market_price_stats').select('*')
+        for field in AGGREGATE_KEY_FIELDS:
+            request = request.eq(field, key[field])
+        rows = request.limit(1).execute().data
+        return rows[0] if rows else None
+
+    @timed_store_call
+    def swap_aggregate(self, row, version):
+        table = self.supabase.table('market_price_stats')
+        if version is None:
+            # Inserted unless a concurrent writer created the row first
+            result = table.upsert(
+                {**{field: row[field] for field in AGGREGATE_KEY_FIELDS},
+                 'data': row['data'], 'updated_at': row.get('updated_at'), 'version': 0},
+                on_conflict=','.join(AGGREGATE_KEY_FIELDS),
+                ignore_duplicates=True,
+            ).execute()
+        else:
+            request = table.update({'data': row['data'], 'updated_at': row.get('updated_at'), 'version': version + 1})
+            for field in AGGREGATE_KEY_FIELDS:
+                request = request.eq(field, row[field])
+            result = request.eq('version', version).execute()
+        return bool(result.data)
+
+    @timed_store_call
+    def save_aggregates(self, rows):
+        if rows:
+            self.supabase.table('market_price_stats')\
+                .upsert(rows, on_conflict='category_key,source,region,currency,resolution,bucket')\
+                .execute()
+
+    @timed_store_call
+    def delete_aggregates(self, resolution, before_bucket):
+        result = self.supabase.table('market_price_stats')\
+            .delete()\
+            .eq('resolution', resolution)\
+            .lt('bucket', before_bucket)\
+            .execute()
+        return len(result.data or [])
+
+    @timed_store_call
+    def delete_listings(self, before):
+        result = self.supabase.table('market_listings')\
+            .delete()\
+            .lt('scraped_at', to_utc_iso(before))\
+            .execute()
+        return len(result.data or [])
+
+    def scan_listings(self, since, until, batch_size=1000):
+        offset = 0
+        while True:
+            with observe_store_call(self.name, 'scan_listings'):
+                result = self.supabase.table('market_listings')\
+                    .select('*')\
+                    .gte('scraped_at', to_utc_iso(since))\
+                    .lt('scraped_at', to_utc_iso(until))\
+                    .order('scraped_at')\
+                    .range(offset, offset + batch_size - 1)\
+                    .execute()
+            if not result.data:
+                return
+            yield result.data
+            offset += batch_size
+
+
+class SQLiteStore(ListingStore):
+    """
+    Single-file local store
+
+    Rows carry a normalized query_key so lookups hit the
+    (query_key, region, scraped_at) index instead of scanning categories:
+    exact lookups match the key, loose ones the keys starting with it. Only a
+    loose lookup that finds nothing falls back to a substring scan.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS market_listings (
+            id TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            title TEXT NOT NULL,
+            price REAL NOT NULL,
+            currency TEXT DEFAULT 'USD',
+            price_usd REAL,
+            price_target REAL,
+            target_currency TEXT,
+            rating REAL,
+            reviews INTEGER,
+            delivery_time INTEGER,
+            seller_name TEXT,
+            seller_level TEXT,
+            description TEXT,
+            category TEXT,
+            query_key TEXT,
+            region TEXT DEFAULT 'global',
+            url TEXT,
+            is_outlier INTEGER DEFAULT 0,
+            scraped_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_listings_query ON market_listings(query_key, region, scraped_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_listings_source ON market_listings(source, scraped_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_listings_scraped_at ON market_listings(scraped_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_listings_price_usd ON market_listings(query_key, price_usd);
+        CREATE TABLE IF NOT EXISTS market_price_stats (
+            category_key TEXT NOT NULL,
+            source TEXT NOT NULL,
+            region TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            resolution TEXT NOT NULL DEFAULT 'day',
+            bucket TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at TEXT,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category_key, region, source, currency, resolution, bucket)
+        );
+        CREATE INDEX IF NOT EXISTS idx_price_stats_bucket ON market_price_stats(resolution, bucket);
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('LOCAL_STORE_PATH', DEFAULT_LOCAL_STORE_PATH)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._migrate_price_stats()
+        self._migrate_listings()
+        self.connection.executescript(self.SCHEMA)
+
+    def _migrate_listings(self):
+        # Columns added after the table was first created
+        columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(market_listings)')]
+        if not columns:
+            return
+        with self.connection:
+            for column, column_type in (
+                ('price_usd', 'REAL'),
+                ('price_target', 'REAL'),
+                ('target_currency', 'TEXT'),
+                ('is_outlier', 'INTEGER DEFAULT 0'),
+            ):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE market_listings ADD COLUMN {column} {column_type}')
+
+    def _migrate_price_stats(self):
+        # Older stats were one row per key (later one per day); keep them as
+        # daily rows bucketed by their day, or by their last update
+        columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(market_price_stats)')]
+        if columns and 'resolution' not in columns:
+            day = 'bucket' if 'bucket' in columns else "COALESCE(substr(updated_at, 1, 10), date('now'))"
+            with self.connection:
+                self.connection.execute('ALTER TABLE market_price_stats RENAME TO market_price_stats_old')
+                self.connection.executescript(self.SCHEMA)
+                self.connection.execute(
+                    'INSERT INTO market_price_stats '
+                    '(category_key, source, region, currency, resolution, bucket, data, updated_at) '
+                    f"SELECT category_key, source, region, currency, 'day', substr({day}, 1, 10) || 'T00:00:00+00:00', "
+                    'data, updated_at FROM market_price_stats_old'
+                )
+                self.connection.execute('DROP TABLE market_price_stats_old')
+        elif columns and 'version' not in columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE market_price_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread (the API runs flows and reads in worker threads)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def insert_listings(self, listings: List[Dict]) -> int:
+        rows = []
+        for listing in listings:
+            row = prepare_listing(listing)
+            row['query_key'] = normalize_query(row.get('category'))
+            rows.append(row)
+        if not rows:
+            return 0
+
+        columns = LISTING_COLUMNS + ['query_key']
+        placeholders = ', '.join('?' for _ in columns)
+        with self.connection:
+            cursor = self.connection.executemany(
+                f"INSERT OR IGNORE INTO market_listings ({', '.join(columns)}) VALUES ({placeholders})",
+                [tuple(row.get(column) for column in columns) for row in rows],
+            )
+        return cursor.rowcount
+
+    def fetch_listings(self, query, region='global', since=None, limit=50, exact=False, include_outliers=False):
+        key = normalize_query(query)
+        if exact:
+            rows = self._select_listings('query_key = ?', [key], region, since, limit, include_outliers)
+        else:
+            # A key range rather than LIKE 'key%', which SQLite can't serve from
+            # the index (LIKE is case-insensitive, the index is not)
+            rows = self._select_listings(
+                'query_key >= ? AND query_key < ?', [key, key + '\uffff'], region, since, limit, include_outliers
+            )
+            if not rows:
+                escaped = key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                rows = self._select_listings(
+                    "query_key LIKE ? ESCAPE '\\'", [f'%{escaped}%'], region, since, limit, include_outliers
+                )
+        for row in rows:
+            row['is_outlier'] = bool(row['is_outlier'])
+        return rows
+
+    def _select_listings(self, match, match_params, region, since, limit, include_outliers) -> List[Dict]:
+        sql = f"SELECT {', '.join(LISTING_COLUMNS)} FROM market_listings WHERE {match} AND region = ?"
+        params = [*match_params, normalize_region(region)]
+
+        if not include_outliers:
+            sql += ' AND NOT COALESCE(is_outlier, 0)'
+
+        if since:
+            sql += ' AND scraped_at >= ?'
+            params.append(to_utc_iso(since))
+
+        sql += ' ORDER BY scraped_at DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def fetch_categories(self, since, limit=1000):
+        rows = self.connection.execute(
+            'SELECT category, region, scraped_at FROM market_listings '
+            'WHERE scraped_at > ? ORDER BY scraped_at DESC LIMIT ?',
+            (to_utc_iso(since), limit),
+        )
+        return [dict(row) for row in rows]
+
+    def fetch_aggregates(self, category_key, regions=None, sources=None, resolution='day', since_bucket=None, until_bucket=None):
+        sql = 'SELECT * FROM market_price_stats WHERE category_key = ? AND resolution = ?'
+        params = [category_key, resolution]
+        if regions:
+            sql += f" AND region IN ({', '.join('?' for _ in regions)})"
+            params.extend(normalize_region(region) for region in regions)
+        if sources:
+            sql += f" AND source IN ({', '.join('?' for _ in sources)})"
+            params.extend(sources)
+        if since_bucket:
+            sql += ' AND bucket >= ?'
+            params.append(since_bucket)
+        if until_bucket:
+            sql += ' AND bucket <= ?'
+            params.append(until_bucket)
+        return [
+            {**dict(row), 'data': json.loads(row['data'])}
+            for row in self.connection.execute(sql, params)
+        ]
+
+    def fetch_aggregate(self, key):
+        row = self.connection.execute(
+            f"SELECT * FROM market_price_stats WHERE {' AND '.join(f'{field} = ?' for field in AGGREGATE_KEY_FIELDS)}",
+            [key[field] for field in AGGREGATE_KEY_FIELDS],
+        ).fetchone()
+        return {**dict(row), 'data': json.loads(row['data'])} if row else None
+
+    def swap_aggregate(self, row, version):
+        keys = [row[field] for field in AGGREGATE_KEY_FIELDS]
+        with self.connection:
+            if version is None:
+                cursor = self.connection.execute(
+                    f"INSERT OR IGNORE INTO market_price_stats ({', '.join(AGGREGATE_KEY_FIELDS)}, data, updated_at, version) "
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)',
+                    [*keys, json.dumps(row['data']), row.get('updated_at')],
+                )
+            else:
+                cursor = self.connection.execute(
+                    'UPDATE market_price_stats SET data = ?, updated_at = ?, version = version + 1 '
+                    f"WHERE {' AND '.join(f'{field} = ?' for field in AGGREGATE_KEY_FIELDS)} AND version = ?",
+                    [json.dumps(row['data']), row.get('updated_at'), *keys, version],
+                )
+        return cursor.rowcount == 1
+
+    def save_aggregates(self, rows):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO market_price_stats '
+                '(category_key, source, region, currency, resolution, bucket, data, updated_at, version) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (row['category_key'], row['source'], row['region'], row['currency'],
+                     row.get('resolution', 'day'), row['bucket'], json.dumps(row['data']), row.get('updated_at'),
+                     row.get('version') or 0)
+                    for row in rows
+                ],
+            )
+
+    def delete_aggregates(self, resolution, before_bucket):
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM market_price_stats WHERE resolution = ? AND bucket < ?',
+                (resolution, before_bucket),
+            )
+        return cursor.rowcount
+
+    def delete_listings(self, before):
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM market_listings WHERE scraped_at < ?', (to_utc_iso(before),)
+            )
+        return cursor.rowcount
+
+    def scan_listings(self, since, until, batch_size=1000):
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(LISTING_COLUMNS)} FROM market_listings "
+            'WHERE scraped_at >= ? AND scraped_at < ? ORDER BY scraped_at',
+            (to_utc_iso(since), to_utc_iso(until)),
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [dict(row) for row in rows]
+
+
+class CachedStore(ListingStore):
+    """
+    SQLite in front of Supabase
+
+    Reads are served locally when the local store has enough rows and fall
+    through to Supabase otherwise (populating the local store). Listings and
+    aggregates written by other nodes only reach Supabase, so a local hit is
+    checked against Supabase for newer rows at most every recheck_seconds per
+    query. Aggregate merges read and swap in Supabase, the only copy every
+    node writes to, and then update the local copy.
+    Listing writes go to both; a local write succeeds even if the Supabase
+    write raises, and the rows are kept in a backlog spool (SPOOL_DIR/remote)
+    that is replayed to Supabase, at most every backlog_retry_seconds, once a
+    later write gets through (or by a drainer on `backlog`, see server.py).
+    """
+
+    name = 'cached'
+
+    def __init__(self, local: SQLiteStore, remote: ListingStore, min_local_results: int = 10,
+                 recheck_seconds: float = 60, backlog=None, backlog_retry_seconds: float = 30):
+        # spool.py builds on this module
+        from pricing_scrapers.spool import REMOTE_BACKLOG_SPOOL, SpoolDrainer, WriteSpool, spool_directory
+
+        self.local = local
+        self.remote = remote
+        self.min_local_results = min_local_results
+        self.recheck_seconds = recheck_seconds
+        self.checked_at: Dict[tuple, float] = {}
+        self.backlog = backlog or WriteSpool(spool_directory(REMOTE_BACKLOG_SPOOL))
+        self.backlog_drainer = SpoolDrainer(self.backlog, remote, max_batches_per_second=0)
+        self.backlog_retry_seconds = backlog_retry_seconds
+        self.backlog_tried_at = float('-inf')
+
+    def insert_listings(self, listings: List[Dict]) -> int:
+        rows = [prepare_listing(listing) for listing in listings]
+        self.local.insert_listings(rows)
+        try:
+            self.remote.insert_listings(rows)
+        except Exception as e:
+            print(f"Remote listing write failed, {len(rows)} listings kept in {self.backlog.directory}: {e}")
+            self.backlog.append(rows)
+            self.backlog.seal()
+            return len(rows)
+        self.replay_backlog()
+        return len(rows)
+
+    def replay_backlog(self) -> int:
+        """
+        Write backlogged listings to the remote store, at most every
+        backlog_retry_seconds
+
+        Returns:
+            Number of listings written
+        """
+        now = time.monotonic()
+        if now - self.backlog_tried_at < self.backlog_retry_seconds:
+            return 0
+        self.backlog_tried_at = now
+        if not self.backlog.depth()['records']:
+            return 0
+        return self.backlog_drainer.drain_once()
+
+    def fetch_listings(self, query, region='global', since=None, limit=50, exact=False, include_outliers=False):
+        rows = self.local.fetch_listings(query, region, since, limit, exact, include_outliers)
+        if len(rows) >= min(limit, self.min_local_results):
+            CACHE_LOOKUPS.labels('local_store', 'hit').inc()
+            if self.pull_newer(rows[0]['scraped_at'], query, region, limit, exact, include_outliers):
+                return self.local.fetch_listings(query, region, since, limit, exact, include_outliers)
+            return rows
+
+        CACHE_LOOKUPS.labels('local_store', 'miss').inc()
+
+        remote_rows = self.remote.fetch_listings(query, region, since, limit, exact, include_outliers)
+        self.local.insert_listings(remote_rows)
+        return remote_rows or rows
+
+    def pull_newer(self, newest: str, query, region, limit, exact, include_outliers) -> bool:
+        """
+        Copy remote listings newer than the newest local one, if the query is
+        due for a recheck
+
+        Returns:
+            True if any were copied
+        """
+        key = (normalize_query(query), normalize_region(region), exact, include_outliers)
+        now = time.monotonic()
+        if now - self.checked_at.get(key, float('-inf')) < self.recheck_seconds:
+            return False
+        self.checked_at[key] = now
+
+        try:
+            newer = [
+                row for row in self.remote.fetch_listings(query, region, newest, limit, exact, include_outliers)
+                if to_utc_iso(row['scraped_at']) > newest
+            ]
+        except Exception as e:
+            print(f"Remote freshness check failed, using local store: {e}")
+            return False
+        if newer:
+            CACHE_LOOKUPS.labels('local_store', 'stale').inc()
+            self.local.insert_listings(newer)
+        return bool(newer)
+
+    def fetch_categories(self, since, limit=1000):
+        try:
+            return self.remote.fetch_categories(since, limit)
+        except Exception as e:
+            print(f"Remote category sync failed, using local store: {e}")
+            return self.local.fetch_categories(since, limit)
+
+    def fetch_aggregates(self, category_key, regions=None, sources=None, resolution='day', since_bucket=None, until_bucket=None):
+        rows = self.local.fetch_aggregates(category_key, regions, sources, resolution, since_bucket, until_bucket)
+        key = ('aggregates', category_key, tuple(regions or ()), tuple(sources or ()), resolution, since_bucket, until_bucket)
+        now = time.monotonic()
+        if rows:
+            CACHE_LOOKUPS.labels('local_store', 'hit').inc()
+            if now - self.checked_at.get(key, float('-inf')) < self.recheck_seconds:
+                return rows
+        else:
+            CACHE_LOOKUPS.labels('local_store', 'miss').inc()
+
+        # Other nodes merge into the remote aggregates; recheck a local hit
+        # at most every recheck_seconds
+        try:
+            remote_rows = self.remote.fetch_aggregates(category_key, regions, sources, resolution, since_bucket, until_bucket)
+        except Exception as e:
+            if not rows:
+                raise
+            print(f"Remote aggregate check failed, using local store: {e}")
+            return rows
+        self.checked_at[key] = now
+        versions = {tuple(row[field] for field in AGGREGATE_KEY_FIELDS): row.get('version') for row in rows}
+        if rows and any(
+            versions.get(tuple(row[field] for field in AGGREGATE_KEY_FIELDS)) != row.get('version')
+            for row in remote_rows
+        ):
+            CACHE_LOOKUPS.labels('local_store', 'stale').inc()
+        self.local.save_aggregates(remote_rows)
+        return remote_rows
+
+    def fetch_aggregate(self, key):
+        return self.remote.fetch_aggregate(key)
+
+    def swap_aggregate(self, row, version):
+        if not self.remote.swap_aggregate(row, version):
+            return False
+        self.local.save_aggregates([{**row, 'version': 0 if version is None else version + 1}])
+        return True
+
+    def save_aggregates(self, rows):
+        self.local.save_aggregates(rows)
+        self.remote.save_aggregates(rows)
+
+    def delete_aggregates(self, resolution, before_bucket):
+        self.local.delete_aggregates(resolution, before_bucket)
+        return self.remote.delete_aggregates(resolution, before_bucket)
+
+    def delete_listings(self, before):
+        self.local.delete_listings(before)
+        return self.remote.delete_listings(before)
+
+    def scan_listings(self, since, until, batch_size=1000):
+        return self.remote.scan_listings(since, until, batch_size)
+
+
+def get_listing_store() -> ListingStore:
+    """
+    Build the listing store selected by LISTING_STORE
+
+    'supabase' (default when credentials are set), 'sqlite' (default
+    otherwise) or 'cached' (SQLite read/write-through cache over Supabase).
+    """
+    has_supabase = bool(os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_SERVICE_ROLE_KEY'))
+    backend = os.getenv('LISTING_STORE', 'supabase' if has_supabase else 'sqlite').lower()
+
+    if backend == 'sqlite':
+        return SQLiteStore()
+    if not has_supabase:
+        print(f"LISTING_STORE={backend} needs Supabase credentials, using local SQLite store")
+        return SQLiteStore()
+    if backend == 'cached':
+        return CachedStore(
+            SQLiteStore(), SupabaseStore(), recheck_seconds=float(os.getenv('LOCAL_STORE_RECHECK_SECONDS', 60))
+        )
+    return SupabaseStore()
@@ -0,0 +1,126 @@
+"""
+Per-request timing breakdown
+The project middlewares and download handler stamp each request as it moves
+through the crawl:
+
+    scheduled -> joins its download slot's queue (queue_wait: scheduler and
+                 downloader middlewares)
+              -> handed to the download handler (throttle_wait: waiting in the
+                 slot for DOWNLOAD_DELAY / AutoThrottle and free concurrency)
+              -> response downloaded (download; for Playwright split into
+                 render, up to the page's load event, and selector_wait, the
+                 page methods such as wait_for_selector plus reading the content)
+              -> callback done (parse)
+
+together with response bytes and retries. Totals feed the Scrapy stats under
+timing/*; percentiles per spider and domain are exported as JSON lines when
+the crawl finishes, so a slow crawl can be pinned on the network, rendering,
+throttling or parsing.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Dict, Optional
+from pricing_scrapers.sketches import KLLSketch
+
+DEFAULT_TIMING_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'timing')
+
+# Seconds, except response_bytes and retries
+METRICS = (
+    'queue_wait',
+    'throttle_wait',
+    'download',
+    'render',
+    'selector_wait',
+    'parse',
+    'response_bytes',
+    'retries',
+)
+
+
+class RequestTimings:
+    """
+    Timing distributions per domain for one crawl
+
+    Args:
+        stats: Scrapy stats collector fed with totals (optional)
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.domains: Dict[str, Dict[str, KLLSketch]] = {}
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, domain: str, spider=None, **values):
+        """
+        Record measurements of one request
+
+        Args:
+            domain: Request host
+            values: Metric name -> value (None values are skipped)
+        """
+        sketches = self.domains.setdefault(domain, {})
+        totals = self.totals.setdefault(domain, {})
+        for metric, value in values.items():
+            if value is None:
+                continue
+            sketches.setdefault(metric, KLLSketch()).update(value)
+            totals[metric] = totals.get(metric, 0) + value
+            if self.stats:
+                suffix = '' if metric in ('response_bytes', 'retries') else '_seconds'
+                self.stats.inc_value(f'timing/{metric}{suffix}', value, spider=spider)
+                self.stats.inc_value(f'timing/{metric}/count', spider=spider)
+
+    def summary(self) -> Dict[str, Dict[str, Dict]]:
+        """count/total/mean/p50/p95/max per domain and metric"""
+        result = {}
+        for domain, sketches in sorted(self.domains.items()):
+            result[domain] = {}
+            for metric in METRICS:
+                sketch = sketches.get(metric)
+                if not sketch or not sketch.n:
+                    continue
+                total = self.totals[domain][metric]
+                result[domain][metric] = {
+                    'count': sketch.n,
+                    'total': round(total, 4),
+                    'mean': round(total / sketch.n, 4),
+                    'p50': round(sketch.quantile(0.5), 4),
+                    'p95': round(sketch.quantile(0.95), 4),
+                    'max': round(max(max(level) for level in sketch.levels if level), 4),
+                }
+        return result
+
+    def export(self, spider_name: str, directory: Optional[str] = None) -> Optional[str]:
+        """
+        Append one JSON line per domain, labelled with spider and domain
+
+        Returns:
+            Path written, or None when nothing was recorded
+        """
+        summary = self.summary()
+        if not summary:
+            return None
+        directory = directory or DEFAULT_TIMING_DIR
+        os.makedirs(directory, exist_ok=True)
+        finished_at = datetime.utcnow()
+        path = os.path.join(directory, f'{spider_name}-{finished_at:%Y%m%d}.jsonl')
+        with open(path, 'a', encoding='utf8') as export:
+            for domain, metrics in summary.items():
+                record = {
+                    'spider': spider_name,
+                    'domain': domain,
+                    'finished_at': finished_at.isoformat() + 'Z',
+                    'metrics': metrics,
+                }
+                export.write(json.dumps(record) + '\n')
+        return path
+
+
+def get_request_timings(crawler) -> RequestTimings:
+    """The crawl's RequestTimings, shared by the spider and downloader middlewares"""
+    timings = getattr(crawler, 'request_timings', None)
+    if timings is None:
+        timings = crawler.request_timings = RequestTimings(crawler.stats)
+    return timings
@@ -0,0 +1,387 @@
+"""
+Lightweight request tracing
+A trace is started when an API request comes in and follows it through
+ScraperAPI, the Prefect flow and into every `scrapy crawl` subprocess, whose
+spans (crawl, download, render, parse, cleaning, DB writes) join the same
+trace. Context is a W3C traceparent ('00-<trace id>-<span id>-01'): a header
+on the API, a contextvar inside the API process, and the TRACEPARENT
+environment variable (or `-a traceparent=...`) for spider processes.
+
+Every process appends its finished spans as JSON lines to
+<TRACE_DIR>/<trace id>.jsonl; the CLI lists and draws traces offline and
+converts them to OTLP JSON for tools such as Jaeger:
+
+    python -m pricing_scrapers.tracing list
+    python -m pricing_scrapers.tracing show <trace id>
+    python -m pricing_scrapers.tracing otlp <trace id> [out.json]
+"""
+
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from pricing_scrapers.spiders.base import query_label
+
+DEFAULT_TRACE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'traces')
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+
+_current: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+def _new_id(hex_digits: int) -> str:
+    return f'{random.getrandbits(hex_digits * 4):0{hex_digits}x}'
+
+
+class Span:
+    """
+    One timed operation within a trace
+
+    Args:
+        name: Operation name, e.g. 'cache_lookup'
+        trace_id: 32 hex digits
+        parent_id: Span id of the parent (None for the root)
+        start_ns: Wall-clock start (default: now)
+        attributes: Extra key/values (query, spider, url, counts, ...)
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 start_ns: Optional[int] = None, attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(16)
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent naming this span as the parent"""
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, end_ns: Optional[int] = None):
+        """Finish the span and write it out"""
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            export_span(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'attributes': self.attributes,
+            'error': self.error,
+            'pid': os.getpid(),
+        }
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent span id) from a traceparent, or None if malformed"""
+    parts = (value or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2]
+
+
+def monotonic_to_ns(monotonic: float) -> int:
+    """Wall-clock ns of a time.monotonic() reading taken earlier in this process"""
+    return time.time_ns() - int((time.monotonic() - monotonic) * 1e9)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent of the active span, to hand to a subprocess"""
+    active = _current.get()
+    return active.traceparent if active else None
+
+
+def start_span(name: str, parent=None, start_ns: Optional[int] = None, **attributes) -> Optional[Span]:
+    """
+    Start a span without activating it (for callback-driven code such as Scrapy)
+
+    Args:
+        name: Operation name
+        parent: Parent Span or traceparent string (default: the active span)
+        start_ns: Wall-clock start, for spans recorded after the fact
+
+    Returns:
+        The span, or None when there is no trace to attach it to
+    """
+    if not TRACING_ENABLED:
+        return None
+    parent = parent if parent is not None else _current.get()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, start_ns, attributes)
+    context = parse_traceparent(parent)
+    if context:
+        return Span(name, context[0], context[1], start_ns, attributes)
+    return None
+
+
+def record_span(name: str, parent, start_ns: int, end_ns: int, **attributes) -> Optional[Span]:
+    """Record an already finished operation (e.g. a download timed by the middlewares)"""
+    finished = start_span(name, parent, start_ns, **attributes)
+    if finished:
+        finished.end(end_ns)
+    return finished
+
+
+@contextmanager
+def trace(name: str, traceparent: Optional[str] = None, **attributes):
+    """
+    Root span of a trace, continuing an incoming traceparent when given
+
+    Sampled at TRACE_SAMPLE_RATE; unsampled requests yield None and their
+    child spans are no-ops.
+    """
+    context = parse_traceparent(traceparent)
+    if not TRACING_ENABLED or (not context and random.random() >= TRACE_SAMPLE_RATE):
+        yield None
+        return
+
+    trace_id, parent_id = context or (_new_id(32), None)
+    root = Span(name, trace_id, parent_id, attributes=attributes)
+    with _activate(root):
+        yield root
+
+
+@contextmanager
+def span(name: str, parent=None, **attributes):
+    """
+    Child span of `parent` (default: the active span), active while the
+    block runs; a no-op outside a trace
+    """
+    child = start_span(name, parent, **attributes)
+    if child is None:
+        yield None
+        return
+    with _activate(child):
+        yield child
+
+
+def traced(name: str):
+    """Decorator running a function inside a span named `name`"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _activate(active: Span):
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        _current.reset(token)
+        active.end()
+
+
+def trace_dir() -> str:
+    return os.getenv('TRACE_DIR', DEFAULT_TRACE_DIR)
+
+
+def export_span(finished: Span):
+    """Append a finished span to its trace file (one short write per line)"""
+    directory = trace_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        line = json.dumps(finished.to_dict(), default=str) + '\n'
+        with open(os.path.join(directory, f'{finished.trace_id}.jsonl'), 'a', encoding='utf8') as spans:
+            spans.write(line)
+    except OSError as e:
+        print(f"Failed to export span {finished.name}: {e}")
+
+
+def load_trace(trace_id: str, directory: str = None) -> List[Dict]:
+    """Spans of a trace ordered by start time"""
+    path = os.path.join(directory or trace_dir(), f'{trace_id}.jsonl')
+    with open(path, encoding='utf8') as spans:
+        return sorted((json.loads(line) for line in spans if line.strip()), key=lambda s: s['start_ns'])
+
+
+def list_traces(directory: str = None, limit: int = 20) -> List[Dict]:
+    """Most recent traces with their root span name and duration"""
+    directory = directory or trace_dir()
+    if not os.path.isdir(directory):
+        return []
+    paths = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.jsonl')),
+        key=os.path.getmtime,
+        reverse=True,
+    )[:limit]
+
+    traces = []
+    for path in paths:
+        spans = load_trace(os.path.basename(path)[:-len('.jsonl')], directory)
+        if not spans:
+            continue
+        ids = {s['span_id'] for s in spans}
+        root = next((s for s in spans if s['parent_id'] not in ids), spans[0])
+        traces.append({
+            'trace_id': root['trace_id'],
+            'name': root['name'],
+            'spans': len(spans),
+            'duration_ms': (max(s['end_ns'] for s in spans) - min(s['start_ns'] for s in spans)) / 1e6,
+            'errors': sum(1 for s in spans if s.get('error')),
+        })
+    return traces
+
+
+def render_trace(spans: List[Dict], width: int = 40) -> str:
+    """Indented waterfall of a trace"""
+    if not spans:
+        return ''
+    ids = {s['span_id'] for s in spans}
+    children: Dict[Optional[str], List[Dict]] = {}
+    for s in spans:
+        children.setdefault(s['parent_id'] if s['parent_id'] in ids else None, []).append(s)
+
+    start = min(s['start_ns'] for s in spans)
+    total = max(max(s['end_ns'] for s in spans) - start, 1)
+    lines = []
+
+    def walk(parent_id, depth):
+        for s in children.get(parent_id, []):
+            offset = int((s['start_ns'] - start) / total * width)
+            length = max(1, int((s['end_ns'] - s['start_ns']) / total * width))
+            bar = ' ' * offset + '█' * min(length, width - offset)
+            duration = (s['end_ns'] - s['start_ns']) / 1e6
+            attributes = ' '.join(f'{k}={v}' for k, v in s['attributes'].items())
+            error = f" ERROR {s['error']}" if s.get('error') else ''
+            lines.append(f"{bar:<{width}} {duration:9.1f}ms {'  ' * depth}{s['name']} {attributes}{error}".rstrip())
+            walk(s['span_id'], depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines)
+
+
+def to_otlp(spans: List[Dict]) -> Dict:
+    """OTLP/JSON (ExportTraceServiceRequest) for a trace's spans"""
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [attribute('service.name', 'pricing-scrapers')]},
+        'scopeSpans': [{
+            'scope': {'name': 'pricing_scrapers.tracing'},
+            'spans': [
+                {
+                    'traceId': s['trace_id'],
+                    'spanId': s['span_id'],
+                    **({'parentSpanId': s['parent_id']} if s['parent_id'] else {}),
+                    'name': s['name'],
+                    'kind': 1,
+                    'startTimeUnixNano': str(s['start_ns']),
+                    'endTimeUnixNano': str(s['end_ns']),
+                    'attributes': [attribute(k, v) for k, v in {**s['attributes'], 'process.pid': s.get('pid')}.items()],
+                    'status': {'code': 2, 'message': s['error']} if s.get('error') else {},
+                }
+                for s in spans
+            ],
+        }],
+    }]}
+
+
+class CrawlTracingExtension:
+    """
+    Join a spider process to the trace that started it
+
+    The traceparent comes from the spider argument `traceparent` or the
+    TRACEPARENT environment variable; without one the crawl is not traced.
+    The crawl span is kept on spider.trace_span, the parent of the download,
+    parse and pipeline spans.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not TRACING_ENABLED:
+            raise NotConfigured
+        ext = cls()
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        ext.stats = crawler.stats
+        return ext
+
+    def spider_opened(self, spider):
+        parent = getattr(spider, 'traceparent', None) or os.getenv('TRACEPARENT')
+        spider.trace_span = start_span(
+            f'crawl {spider.name}',
+            parent or '',
+            spider=spider.name,
+            query=query_label(spider),
+            region=getattr(spider, 'region', None),
+        )
+        if spider.trace_span:
+            spider.logger.info(f'Tracing crawl as part of trace {spider.trace_span.trace_id}')
+
+    def spider_closed(self, spider, reason):
+        if getattr(spider, 'trace_span', None):
+            spider.trace_span.set(
+                reason=reason,
+                items=self.stats.get_value('item_scraped_count', 0, spider=spider),
+                requests=self.stats.get_value('downloader/request_count', 0, spider=spider),
+            )
+            spider.trace_span.end()
+
+
+def main():
+    """CLI: python -m pricing_scrapers.tracing [list|show TRACE_ID|otlp TRACE_ID [OUT]]"""
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+
+    if command == 'show' and len(sys.argv) > 2:
+        print(render_trace(load_trace(sys.argv[2])))
+    elif command == 'otlp' and len(sys.argv) > 2:
+        payload = json.dumps(to_otlp(load_trace(sys.argv[2])), indent=2)
+        if len(sys.argv) > 3:
+            with open(sys.argv[3], 'w', encoding='utf8') as out:
+                out.write(payload)
+            print(f"Wrote {sys.argv[3]}")
+        else:
+            print(payload)
+    else:
+        for entry in list_traces():
+            print(
+                f"{entry['trace_id']}  {entry['duration_ms']:10.1f}ms  "
+                f"{entry['spans']:4d} spans  {entry['errors']} errors  {entry['name']}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""
+Durable crawl job queue
+With WORK_QUEUE_ENABLED the API and flows no longer start spider processes
+themselves: every spider run becomes a job in this queue and independent
+worker processes (worker.py, any number, on the host that holds the queue
+file) lease and run them. Capacity is added by starting workers, without
+scaling the API tier.
+
+Workers lease a job for a visibility timeout and extend the lease with
+heartbeats while the crawl runs. A worker that crashes stops heartbeating,
+its lease expires and another worker picks the job up again. Failed runs are
+retried with exponential backoff up to max_attempts, then parked as dead.
+Results (the run summary from the run ledger) are written back to the job.
+
+    queued --lease--> leased --complete--> done
+                        |  \\--fail (attempts left)--> queued (after backoff)
+                        |  \\--fail (no attempts left)--> dead
+                        \\--lease expired--> leased by another worker
+
+The queue is a SQLite file (WORK_QUEUE_PATH) in WAL mode; leases are taken
+in BEGIN IMMEDIATE transactions, so concurrent workers never share a job.
+WAL keeps its index in shared memory, so every process using the queue must
+run on one host with the file on local disk; a network file system (NFS,
+SMB) can corrupt it. Spreading workers over several hosts needs a networked
+queue instead (e.g. a Postgres table leased with FOR UPDATE SKIP LOCKED).
+
+    python -m pricing_scrapers.work_queue stats
+    python -m pricing_scrapers.work_queue list [STATUS]
+    python -m pricing_scrapers.work_queue retry JOB_ID
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+DEFAULT_WORK_QUEUE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'work_queue.db')
+WORK_QUEUE_ENABLED = os.getenv('WORK_QUEUE_ENABLED', 'false').lower() == 'true'
+
+QUEUED, LEASED, DONE, DEAD = 'queued', 'leased', 'done', 'dead'
+ACTIVE_STATUSES = (QUEUED, LEASED)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def dedupe_key(spider: str, queries: List[str], region: str) -> str:
+    """Identity of a crawl job: the same spider, queries and region"""
+    return f"{spider}:{region}:{'|'.join(sorted(queries))}"
+
+
+class WorkQueue:
+    """
+    SQLite-backed crawl job queue with leases
+
+    Args:
+        path: SQLite file (WORK_QUEUE_PATH)
+        visibility_timeout: Seconds a lease lasts without a heartbeat
+        max_attempts: Runs of a job before it is parked as dead
+        retry_backoff: Seconds before the first retry; doubles per attempt
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
+            job_id TEXT PRIMARY KEY,
+            spider TEXT NOT NULL,
+            queries TEXT NOT NULL,
+            region TEXT NOT NULL,
+            priority REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            enqueued_at TEXT NOT NULL,
+            available_at TEXT NOT NULL,
+            leased_by TEXT,
+            lease_expires_at TEXT,
+            heartbeat_at TEXT,
+            finished_at TEXT,
+            result TEXT,
+            error TEXT,
+            traceparent TEXT
+        );
+        CREATE INDEX IF NOT EXISTS crawl_jobs_ready ON crawl_jobs (status, available_at);
+        CREATE INDEX IF NOT EXISTS crawl_jobs_dedupe ON crawl_jobs (dedupe_key, status);
+    """
+
+    def __init__(self, path: str = None, visibility_timeout: float = 120, max_attempts: int = 3,
+                 retry_backoff: float = 60):
+        self.path = path or os.getenv('WORK_QUEUE_PATH', DEFAULT_WORK_QUEUE_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._local = threading.local()
+        self.connection.executescript(self.SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def _decode(self, row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['queries'] = json.loads(job['queries'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def enqueue(self, spider: str, queries: List[str], region: str = 'global', priority: float = 0,
+                max_attempts: int = None, traceparent: str = None) -> str:
+        """
+        Add a crawl job, unless the same crawl is already queued or running
+
+        Args:
+            spider: Spider to run
+            queries: Queries of the run
+            region: Region key
+            priority: Higher runs first
+            max_attempts: Runs before the job is parked as dead
+            traceparent: Trace the worker's run continues
+
+        Returns:
+            Id of the new job, or of the identical active one
+        """
+        key = dedupe_key(spider, queries, region)
+        now = _now().isoformat()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            existing = self.connection.execute(
+                'SELECT job_id FROM crawl_jobs WHERE dedupe_key = ? AND status IN (?, ?)',
+                (key, *ACTIVE_STATUSES),
+            ).fetchone()
+            if existing:
+                self.connection.execute(
+                    'UPDATE crawl_jobs SET priority = MAX(priority, ?) WHERE job_id = ?',
+                    (priority, existing['job_id']),
+                )
+                return existing['job_id']
+            job_id = uuid.uuid4().hex
+            self.connection.execute(
+                'INSERT INTO crawl_jobs (job_id, spider, queries, region, priority, status, max_attempts, '
+                'dedupe_key, enqueued_at, available_at, traceparent) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, spider, json.dumps(queries), region, priority, QUEUED,
+                 max_attempts or self.max_attempts, key, now, now, traceparent),
+            )
+            return job_id
+
+    def lease(self, worker_id: str, visibility_timeout: float = None) -> Optional[Dict]:
+        """
+        Take the next job: the highest priority queued job that is due, or a
+        leased job whose lease expired (its worker is presumed dead)
+
+        Returns:
+            The leased job, or None when there is nothing to do
+        """
+        now = _now()
+        expires = now + timedelta(seconds=visibility_timeout or self.visibility_timeout)
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            while True:
+                row = self.connection.execute(
+                    'SELECT * FROM crawl_jobs WHERE (status = ? AND available_at <= ?) '
+                    'OR (status = ? AND lease_expires_at <= ?) '
+                    'ORDER BY priority DESC, enqueued_at LIMIT 1',
+                    (QUEUED, now.isoformat(), LEASED, now.isoformat()),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row['status'] == LEASED and row['attempts'] >= row['max_attempts']:
+                    # Crashed out on its last attempt
+                    self.connection.execute(
+                        'UPDATE crawl_jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ?',
+                        (DEAD, now.isoformat(), f"lease expired (worker {row['leased_by']})", row['job_id']),
+                    )
+                    continue
+                self.connection.execute(
+                    'UPDATE crawl_jobs SET status = ?, attempts = attempts + 1, leased_by = ?, '
+                    'lease_expires_at = ?, heartbeat_at = ? WHERE job_id = ?',
+                    (LEASED, worker_id, expires.isoformat(), now.isoformat(), row['job_id']),
+                )
+                return self._decode(self.connection.execute(
+                    'SELECT * FROM crawl_jobs WHERE job_id = ?', (row['job_id'],)
+                ).fetchone())
+
+    def heartbeat(self, job_id: str, worker_id: str, visibility_timeout: float = None) -> bool:
+        """
+        Extend a lease
+
+        Returns:
+            False when the worker no longer holds the lease (it expired and
+            the job was taken over)
+        """
+        now = _now()
+        expires = now + timedelta(seconds=visibility_timeout or self.visibility_timeout)
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE crawl_jobs SET lease_expires_at = ?, heartbeat_at = ? '
+                'WHERE job_id = ? AND status = ? AND leased_by = ?',
+                (expires.isoformat(), now.isoformat(), job_id, LEASED, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict) -> bool:
+        """Record a job's result; False when the lease had been lost"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE crawl_jobs SET status = ?, finished_at = ?, result = ?, error = NULL, '
+                'lease_expires_at = NULL WHERE job_id = ? AND status = ? AND leased_by = ?',
+                (DONE, _now().isoformat(), json.dumps(result, default=str), job_id, LEASED, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str, result: Dict = None) -> Optional[str]:
+        """
+        Record a failed attempt: back to the queue after a backoff, or dead
+        when no attempts are left
+
+        Returns:
+            The job's new status, or None when the lease had been lost
+        """
+        now = _now()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute(
+                'SELECT attempts, max_attempts FROM crawl_jobs WHERE job_id = ? AND status = ? AND leased_by = ?',
+                (job_id, LEASED, worker_id),
+            ).fetchone()
+            if row is None:
+                return None
+            encoded = json.dumps(result, default=str) if result else None
+            if row['attempts'] >= row['max_attempts']:
+                self.connection.execute(
+                    'UPDATE crawl_jobs SET status = ?, finished_at = ?, error = ?, result = ?, '
+                    'lease_expires_at = NULL WHERE job_id = ?',
+                    (DEAD, now.isoformat(), error, encoded, job_id),
+                )
+                return DEAD
+            retry_at = now + timedelta(seconds=self.retry_backoff * 2 ** (row['attempts'] - 1))
+            self.connection.execute(
+                'UPDATE crawl_jobs SET status = ?, available_at = ?, error = ?, result = ?, '
+                'leased_by = NULL, lease_expires_at = NULL WHERE job_id = ?',
+                (QUEUED, retry_at.isoformat(), error, encoded, job_id),
+            )
+            return QUEUED
+
+    def release(self, job_id: str, worker_id: str):
+        """Hand a leased job back untouched, without using up an attempt (a worker exiting mid-crawl)"""
+        with self.connection:
+            self.connection.execute(
+                'UPDATE crawl_jobs SET status = ?, attempts = MAX(attempts - 1, 0), leased_by = NULL, '
+                'lease_expires_at = NULL WHERE job_id = ? AND status = ? AND leased_by = ?',
+                (QUEUED, job_id, LEASED, worker_id),
+            )
+
+    def retry(self, job_id: str) -> bool:
+        """Requeue a dead job with a fresh set of attempts"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE crawl_jobs SET status = ?, attempts = 0, available_at = ?, finished_at = NULL '
+                'WHERE job_id = ? AND status = ?',
+                (QUEUED, _now().isoformat(), job_id, DEAD),
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self._decode(self.connection.execute('SELECT * FROM crawl_jobs WHERE job_id = ?', (job_id,)).fetchone())
+
+    def jobs(self, status: str = None, limit: int = 50) -> List[Dict]:
+        """Most recently enqueued jobs, optionally of one status"""
+        if status:
+            rows = self.connection.execute(
+                'SELECT * FROM crawl_jobs WHERE status = ? ORDER BY enqueued_at DESC LIMIT ?', (status, limit)
+            ).fetchall()
+        else:
+            rows = self.connection.execute(
+                'SELECT * FROM crawl_jobs ORDER BY enqueued_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def stats(self) -> Dict:
+        """Jobs per status, workers holding leases and the oldest queued job's wait"""
+        counts = {status: 0 for status in (QUEUED, LEASED, DONE, DEAD)}
+        for row in self.connection.execute('SELECT status, COUNT(*) AS jobs FROM crawl_jobs GROUP BY status'):
+            counts[row['status']] = row['jobs']
+        oldest = self.connection.execute(
+            'SELECT MIN(enqueued_at) AS oldest FROM crawl_jobs WHERE status = ?', (QUEUED,)
+        ).fetchone()['oldest']
+        workers = self.connection.execute(
+            'SELECT COUNT(DISTINCT leased_by) AS workers FROM crawl_jobs WHERE status = ?', (LEASED,)
+        ).fetchone()['workers']
+        return {
+            **counts,
+            'busy_workers': workers,
+            'oldest_queued_seconds': round((_now() - datetime.fromisoformat(oldest)).total_seconds(), 1) if oldest else None,
+        }
+
+    def purge(self, older_than_days: float = 7) -> int:
+        """Delete finished (done and dead) jobs older than this; returns how many"""
+        cutoff = (_now() - timedelta(days=older_than_days)).isoformat()
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM crawl_jobs WHERE status IN (?, ?) AND finished_at < ?', (DONE, DEAD, cutoff)
+            )
+        return cursor.rowcount
+
+    def wait(self, job_id: str, timeout: float, poll_interval: float = 1.0) -> Optional[Dict]:
+        """
+        Block until a job is done or dead
+
+        Returns:
+            The finished job, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in (DONE, DEAD):
+                return job
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+
+_queue: Optional[WorkQueue] = None
+
+
+def get_work_queue() -> WorkQueue:
+    """Shared queue configured from the environment"""
+    global _queue
+    if _queue is None:
+        _queue = WorkQueue(
+            visibility_timeout=float(os.getenv('WORK_QUEUE_VISIBILITY_TIMEOUT', 120)),
+            max_attempts=int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', 3)),
+            retry_backoff=float(os.getenv('WORK_QUEUE_RETRY_BACKOFF', 60)),
+        )
+    return _queue
+
+
+class QueuedRun:
+    """
+    A spider run submitted through the work queue; result() waits for a
+    worker to finish it, like the Prefect future of a local run
+    """
+
+    def __init__(self, job_id: str, spider: str, query: str, region: str, timeout: float = None):
+        self.job_id = job_id
+        self.spider = spider
+        self.query = query
+        self.region = region
+        self.timeout = timeout or float(os.getenv('WORK_QUEUE_WAIT_TIMEOUT', 900))
+
+    def result(self) -> Dict:
+        job = get_work_queue().wait(self.job_id, self.timeout)
+        if job and job['status'] == DONE and job['result']:
+            return {**job['result'], 'job_id': self.job_id}
+        return {
+            **((job or {}).get('result') or {}),
+            'spider': self.spider,
+            'query': self.query,
+            'region': self.region,
+            'success': False,
+            'job_id': self.job_id,
+            'error': job['error'] if job else f'no result within {self.timeout:.0f}s (job still pending)',
+        }
+
+
+def main():
+    """CLI: python -m pricing_scrapers.work_queue [stats|list [STATUS]|retry JOB_ID]"""
+    import sys
+
+    queue = get_work_queue()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+
+    if command == 'retry' and len(sys.argv) > 2:
+        print(f"Requeued {sys.argv[2]}" if queue.retry(sys.argv[2]) else f"{sys.argv[2]} is not dead")
+    elif command == 'list':
+        for job in queue.jobs(status=sys.argv[2] if len(sys.argv) > 2 else None):
+            print(
+                f"{job['job_id']}  {job['enqueued_at'][:19]}  {job['spider']:12s} {job['status']:7s} "
+                f"attempt {job['attempts']}/{job['max_attempts']}  {job['leased_by'] or '':24s} "
+                f"{'|'.join(job['queries'])} ({job['region']})"
+            )
+    else:
+        print(json.dumps(queue.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,31 @@ FastAPI Server for Scraper Service
 Provides REST API endpoints for backend to trigger scraping
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import os
 from dotenv import load_dotenv
 from api_connector import ScraperAPI
+from pricing_scrapers.spool import WriteSpool, SpoolDrainer, aggregate_drainer, aggregate_spool
+from pricing_scrapers.storage import CachedStore
+from pricing_scrapers.admission import BACKGROUND, Overloaded
+from pricing_scrapers.currency import get_fx_rates
+from pricing_scrapers.demand import build_refresh_plan, get_demand_tracker
+from pricing_scrapers.circuit_breaker import get_circuit_breaker
+from pricing_scrapers.metrics import HTTP_REQUEST_SECONDS, mark_worker_exited, record_spool_depth, render_metrics
+from pricing_scrapers.profiling import PROFILE_HEADER, cpu_profile, should_profile_request
+from pricing_scrapers.regions import normalize_region
+from pricing_scrapers.run_ledger import FAILED, FINISHED, RUNNING, TIMEOUT, get_run_ledger
+from pricing_scrapers.tracing import trace
+from pricing_scrapers.work_queue import DEAD, DONE, LEASED, QUEUED, WORK_QUEUE_ENABLED, get_work_queue
+from workflows.scraping_flow import SEED_CATEGORIES, SPIDER_MAPPING, enqueue_crawls
 import asyncio
+import json
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 
 load_dotenv()
 
@@ -38,9 +55,106 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Most queries accepted by POST /scrape/batch
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', 200))
+
+# Endpoints that are polled rather than worth tracing
+UNTRACED_PATHS = ('/', '/health', '/metrics')
+
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """
+    Request latency histogram, labelled by route template (not the raw path),
+    and the root span of the request's trace (continuing an incoming
+    traceparent header); the trace id is returned in X-Trace-Id. Requests
+    with an X-Profile header (or sampled) are profiled, see
+    pricing_scrapers.profiling; the profile id is returned in X-Profile-Id
+    """
+    started = time.perf_counter()
+    status = 500
+    polled = request.url.path in UNTRACED_PATHS
+    tracing = nullcontext() if polled else \
+        trace(f'{request.method} {request.url.path}', request.headers.get('traceparent'))
+    profiling = cpu_profile(request.method, request.url.path) \
+        if should_profile_request(request.headers.get(PROFILE_HEADER), sample=not polled) else nullcontext()
+    with tracing as root, profiling as profile:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            if root:
+                response.headers['X-Trace-Id'] = root.trace_id
+            if profile:
+                response.headers['X-Profile-Id'] = profile.id
+                if root:
+                    root.set(profile=profile.id)
+            return response
+        finally:
+            route = getattr(request.scope.get('route'), 'path', 'unmatched')
+            HTTP_REQUEST_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - started)
+            if root:
+                root.name = f'{request.method} {route}'
+                root.set(status=status, path=request.url.path)
+
+
 # Initialize scraper API
 scraper_api = ScraperAPI()
 
+# Replays listings spooled by spiders that couldn't reach the listing store
+write_spool = WriteSpool()
+spool_drainer = SpoolDrainer(
+    write_spool,
+    scraper_api.store,
+    batch_size=int(os.getenv('SPOOL_DRAIN_BATCH_SIZE', 200)),
+    max_batches_per_second=float(os.getenv('SPOOL_DRAIN_RATE', 2.0)),
+    interval=float(os.getenv('SPOOL_DRAIN_INTERVAL', 10)),
+)
+# ...and aggregate deltas, and listings the cached store couldn't write to Supabase
+delta_spool = aggregate_spool()
+delta_drainer = aggregate_drainer(delta_spool, scraper_api.store, interval=float(os.getenv('SPOOL_DRAIN_INTERVAL', 10)))
+backlog_drainer = SpoolDrainer(
+    scraper_api.store.backlog,
+    scraper_api.store.remote,
+    batch_size=int(os.getenv('SPOOL_DRAIN_BATCH_SIZE', 200)),
+    max_batches_per_second=float(os.getenv('SPOOL_DRAIN_RATE', 2.0)),
+    interval=float(os.getenv('SPOOL_DRAIN_INTERVAL', 10)),
+) if isinstance(scraper_api.store, CachedStore) else None
+drainers = [drainer for drainer in (spool_drainer, delta_drainer, backlog_drainer) if drainer]
+
+# Query popularity, which drives the scheduled refresh
+demand_tracker = get_demand_tracker()
+
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    """429/503 with Retry-After for a scrape that was not admitted"""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=f"Scraper is busy: {e}",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+async def background_scrape(scrape, *args, **kwargs):
+    """Run a scrape from BackgroundTasks, where a rejection has no caller to go to"""
+    try:
+        await scrape(*args, **kwargs)
+    except Overloaded as e:
+        print(f"Background scrape not admitted: {e}")
+
+
+@app.on_event("startup")
+async def start_spool_drainer():
+    for drainer in drainers:
+        drainer.start()
+
+
+@app.on_event("shutdown")
+async def stop_spool_drainer():
+    for drainer in drainers:
+        drainer.stop(timeout=5)
+    demand_tracker.flush()
+    mark_worker_exited()
+
 
 class ScrapeRequest(BaseModel):
     """Request model for scraping"""
@@ -50,6 +164,17 @@ class ScrapeRequest(BaseModel):
     region: Optional[str] = 'global'
     use_cache: Optional[bool] = True
     max_age_hours: Optional[int] = 24
+    stale_while_revalidate: Optional[bool] = False
+    hard_ttl_hours: Optional[int] = 168
+
+
+class BatchScrapeRequest(BaseModel):
+    """Request model for batch scraping (pre-warm and scheduled jobs)"""
+    business_type: str  # 'digital' or 'physical'
+    offering_type: str  # 'product' or 'service'
+    queries: List[str]
+    region: Optional[str] = 'global'
+    wait: Optional[bool] = False
 
 
 class ScrapeResponse(BaseModel):
@@ -58,6 +183,19 @@ class ScrapeResponse(BaseModel):
     message: str
     count: int
     data: List[Dict]
+    matched_query: Optional[str] = None
+    match_score: Optional[float] = None
+    age_hours: Optional[float] = None
+    stale: Optional[bool] = None
+
+
+def json_response(body: Dict) -> Response:
+    """
+    JSON response for listing payloads, serialized directly; FastAPI's
+    jsonable_encoder walks every field of every listing and costs most of a
+    cached read
+    """
+    return Response(content=json.dumps(body, default=str), media_type='application/json')
 
 
 @app.get("/")
@@ -76,10 +214,28 @@ async def health_check():
     return {
         "status": "healthy",
         "supabase_connected": bool(os.getenv('SUPABASE_URL')),
+        "listing_store": scraper_api.store.name,
+        "spool": {**write_spool.depth(), **spool_drainer.stats},
+        "aggregate_spool": {**delta_spool.depth(), **delta_drainer.stats},
+        "remote_backlog": {**backlog_drainer.spool.depth(), **backlog_drainer.stats} if backlog_drainer else None,
+        "fx_rates": get_fx_rates().status(),
+        "circuit_breakers": get_circuit_breaker().status(),
+        "admission": scraper_api.admission.status(),
+        "worker": scraper_api.instance_id,
+        "scrapes_running": len(scraper_api.coordinator.leases('scrape:')),
+        "work_queue": get_work_queue().stats() if WORK_QUEUE_ENABLED else None,
         "environment": os.getenv('ENVIRONMENT', 'development')
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics in text exposition format"""
+    record_spool_depth(write_spool.depth())
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.post("/scrape", response_model=ScrapeResponse)
 async def scrape_market_data(request: ScrapeRequest):
     """
@@ -105,13 +261,33 @@ async def scrape_market_data(request: ScrapeRequest):
                 detail="offering_type must be 'product' or 'service'"
             )
         
+        age_hours = None
+        stale = None
+        demand_tracker.record(
+            request.business_type, request.offering_type, request.query, normalize_region(request.region)
+        )
+        
         # Use cached data if available and requested
-        if request.use_cache:
-            results = scraper_api.get_cached_market_data(
+        if request.use_cache and request.stale_while_revalidate:
+            # Serve cached data right away, refreshing it in the background when stale
+            swr_result = await scraper_api.get_market_data_swr(
                 business_type=request.business_type,
                 offering_type=request.offering_type,
                 query=request.query,
-                max_age_hours=request.max_age_hours
+                region=request.region,
+                soft_ttl_hours=request.max_age_hours,
+                hard_ttl_hours=request.hard_ttl_hours
+            )
+            results = swr_result['data']
+            age_hours = swr_result['age_hours']
+            stale = swr_result['stale']
+        elif request.use_cache:
+            results = await scraper_api.get_cached_market_data(
+                business_type=request.business_type,
+                offering_type=request.offering_type,
+                query=request.query,
+                max_age_hours=request.max_age_hours,
+                region=request.region
             )
         else:
             # Trigger fresh scrape
@@ -126,9 +302,15 @@ async def scrape_market_data(request: ScrapeRequest):
             status="success",
             message=f"Found {len(results)} market listings",
             count=len(results),
-            data=results
+            data=results,
+            matched_query=results[0].get('matched_query') if results else None,
+            match_score=results[0].get('match_score') if results else None,
+            age_hours=age_hours,
+            stale=stale
         )
     
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -143,13 +325,32 @@ async def scrape_async(request: ScrapeRequest, background_tasks: BackgroundTasks
     Returns immediately, scraping happens in background
     """
     try:
-        # Add scraping to background tasks
+        if WORK_QUEUE_ENABLED:
+            # Workers run the spiders; poll GET /jobs/{job_id}
+            jobs = await asyncio.to_thread(
+                enqueue_crawls,
+                request.business_type,
+                request.offering_type,
+                [request.query],
+                request.region
+            )
+            return {
+                "status": "accepted",
+                "message": f"{len(jobs)} crawl jobs queued",
+                "query": request.query,
+                "jobs": jobs
+            }
+        
+        # Add scraping to background tasks, behind interactive scrapes
+        scraper_api.admission.check(BACKGROUND)
         background_tasks.add_task(
+            background_scrape,
             scraper_api.scrape_and_fetch,
             request.business_type,
             request.offering_type,
             request.query,
-            request.region
+            request.region,
+            priority=BACKGROUND
         )
         
         return {
@@ -158,6 +359,8 @@ async def scrape_async(request: ScrapeRequest, background_tasks: BackgroundTasks
             "query": request.query
         }
     
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -165,30 +368,137 @@ async def scrape_async(request: ScrapeRequest, background_tasks: BackgroundTasks
         )
 
 
+@app.post("/scrape/batch")
+async def scrape_batch(request: BatchScrapeRequest, background_tasks: BackgroundTasks):
+    """
+    Scrape many queries at once, one spider run per source and batch of
+    SPIDER_BATCH_SIZE queries
+    Runs in the background unless wait is set, in which case the aggregated
+    run results are returned
+    """
+    if request.business_type not in ['digital', 'physical']:
+        raise HTTPException(
+            status_code=400,
+            detail="business_type must be 'digital' or 'physical'"
+        )
+    
+    if request.offering_type not in ['product', 'service']:
+        raise HTTPException(
+            status_code=400,
+            detail="offering_type must be 'product' or 'service'"
+        )
+    
+    queries = list(dict.fromkeys(q.strip() for q in request.queries if q.strip()))
+    if not queries or len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"queries must contain between 1 and {BATCH_MAX_QUERIES} non-empty queries"
+        )
+    
+    try:
+        if request.wait:
+            result = await scraper_api.scrape_batch(
+                request.business_type,
+                request.offering_type,
+                queries,
+                request.region
+            )
+            return {"status": "success", "queries": len(queries), **result}
+        
+        if WORK_QUEUE_ENABLED:
+            jobs = await asyncio.to_thread(
+                enqueue_crawls,
+                request.business_type,
+                request.offering_type,
+                queries,
+                request.region
+            )
+            return {
+                "status": "accepted",
+                "message": f"Batch of {len(queries)} queries queued as {len(jobs)} crawl jobs",
+                "queries": len(queries),
+                "jobs": jobs
+            }
+        
+        scraper_api.admission.check(BACKGROUND)
+        background_tasks.add_task(
+            background_scrape,
+            scraper_api.scrape_batch,
+            request.business_type,
+            request.offering_type,
+            queries,
+            request.region,
+            priority=BACKGROUND
+        )
+        
+        return {
+            "status": "accepted",
+            "message": f"Batch of {len(queries)} queries queued in background",
+            "queries": len(queries)
+        }
+    
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Batch scraping failed: {str(e)}"
+        )
+
+
 @app.get("/cache/{query}")
 async def get_cached_data(
     query: str,
     business_type: str = 'digital',
     offering_type: str = 'service',
-    max_age_hours: int = 24
+    max_age_hours: int = 24,
+    region: str = 'global',
+    stale_while_revalidate: bool = False,
+    hard_ttl_hours: int = 168
 ):
     """
     Get cached market data without triggering new scrape
+    With stale_while_revalidate, data older than max_age_hours is still served
+    (flagged stale) while a background refresh runs
     """
     try:
-        results = scraper_api.get_cached_market_data(
+        demand_tracker.record(business_type, offering_type, query, normalize_region(region))
+        
+        if stale_while_revalidate:
+            swr_result = await scraper_api.get_market_data_swr(
+                business_type=business_type,
+                offering_type=offering_type,
+                query=query,
+                region=region,
+                soft_ttl_hours=max_age_hours,
+                hard_ttl_hours=hard_ttl_hours
+            )
+            results = swr_result['data']
+            return json_response({
+                "status": "success",
+                "count": len(results),
+                "data": results,
+                "age_hours": swr_result['age_hours'],
+                "stale": swr_result['stale'],
+                "refreshing": swr_result['refreshing']
+            })
+        
+        results = await scraper_api.get_cached_market_data(
             business_type=business_type,
             offering_type=offering_type,
             query=query,
-            max_age_hours=max_age_hours
+            max_age_hours=max_age_hours,
+            region=region
         )
         
-        return {
+        return json_response({
             "status": "success",
             "count": len(results),
             "data": results
-        }
+        })
     
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -196,15 +506,228 @@ async def get_cached_data(
         )
 
 
+@app.get("/stats/{query}")
+async def get_price_stats(
+    query: str,
+    region: str = 'global',
+    source: Optional[str] = None,
+    days: int = 30,
+    group_by: str = 'source',
+    include_outliers: bool = False
+):
+    """
+    Get price stats (count, min/max, mean, p10/p50/p90, quality-weighted
+    median) merged from the daily sketches maintained at ingest
+
+    region and source accept comma-separated lists (e.g. source=Fiverr,Upwork);
+    group_by=all merges the selected sources into one entry. Prices are in USD
+    whatever currency the listings were scraped in.
+    Prices flagged as outliers are excluded unless include_outliers=true
+    """
+    if group_by not in ['source', 'all']:
+        raise HTTPException(
+            status_code=400,
+            detail="group_by must be 'source' or 'all'"
+        )
+    
+    try:
+        stats = await asyncio.to_thread(
+            scraper_api.get_price_stats,
+            query=query,
+            regions=[r.strip() for r in region.split(',') if r.strip()],
+            sources=[s.strip() for s in source.split(',') if s.strip()] if source else None,
+            days=days,
+            group_by=group_by,
+            include_outliers=include_outliers
+        )
+        
+        return {
+            "status": "success",
+            "query": query,
+            "days": days,
+            "count": len(stats),
+            "stats": stats
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch price stats: {str(e)}"
+        )
+
+
+@app.get("/history/{query}")
+async def get_price_history(
+    query: str,
+    region: str = 'global',
+    source: Optional[str] = None,
+    resolution: str = 'day',
+    days: int = 30,
+    group_by: str = 'source',
+    include_outliers: bool = False
+):
+    """
+    Get price trend series (count, p10/p50/p90, mean per bucket) at hourly,
+    daily or weekly resolution; outliers are excluded unless include_outliers=true
+
+    Hourly buckets are kept for HOURLY_RETENTION_DAYS and daily buckets for
+    DAILY_RETENTION_DAYS; use a coarser resolution for longer trends
+    """
+    if resolution not in ['hour', 'day', 'week']:
+        raise HTTPException(
+            status_code=400,
+            detail="resolution must be 'hour', 'day' or 'week'"
+        )
+    
+    if group_by not in ['source', 'all']:
+        raise HTTPException(
+            status_code=400,
+            detail="group_by must be 'source' or 'all'"
+        )
+    
+    try:
+        series = await asyncio.to_thread(
+            scraper_api.get_price_history,
+            query=query,
+            regions=[r.strip() for r in region.split(',') if r.strip()],
+            sources=[s.strip() for s in source.split(',') if s.strip()] if source else None,
+            resolution=resolution,
+            days=days,
+            group_by=group_by,
+            include_outliers=include_outliers
+        )
+        
+        return {
+            "status": "success",
+            "query": query,
+            "resolution": resolution,
+            "days": days,
+            "series": series
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch price history: {str(e)}"
+        )
+
+
+@app.get("/refresh/plan")
+async def get_refresh_plan(budget_minutes: Optional[float] = None, max_crawls: Optional[int] = None):
+    """
+    Preview the crawls the next scheduled refresh would run: most demanded
+    and stalest first, within the crawl budget, plus the due crawls deferred
+    for lack of budget
+    """
+    plan = build_refresh_plan(
+        SPIDER_MAPPING,
+        seeds=SEED_CATEGORIES,
+        budget_seconds=budget_minutes * 60 if budget_minutes is not None else None,
+        max_crawls=max_crawls,
+    )
+    return {"status": "success", **plan}
+
+
+@app.get("/demand")
+async def get_demand(limit: int = 50):
+    """Most requested categories by decayed request count"""
+    return {"status": "success", "categories": demand_tracker.top(limit=limit)}
+
+
+@app.get("/runs")
+async def list_runs(
+    spider: Optional[str] = None,
+    query: Optional[str] = None,
+    status: Optional[str] = None,
+    hours: Optional[float] = None,
+    limit: int = 50,
+    summary: bool = False
+):
+    """
+    Crawl runs from the run ledger, newest first: items, requests, errors by
+    class, duration, finish reason and log file of each
+
+    With summary=true, per-spider totals (runs, failures, items, errors,
+    mean duration) over the last `hours` instead
+    """
+    if status and status not in [RUNNING, FINISHED, FAILED, TIMEOUT]:
+        raise HTTPException(
+            status_code=400,
+            detail="status must be 'running', 'finished', 'failed' or 'timeout'"
+        )
+    
+    if limit < 1 or limit > 500:
+        raise HTTPException(
+            status_code=400,
+            detail="limit must be between 1 and 500"
+        )
+    
+    since = datetime.now(timezone.utc) - timedelta(hours=hours) if hours else None
+    ledger = get_run_ledger()
+    if summary:
+        return {"status": "success", "hours": hours, "spiders": ledger.summary(since=since)}
+    
+    runs = ledger.query(spider=spider, query=query, status=status, since=since, limit=limit)
+    return {"status": "success", "count": len(runs), "runs": runs}
+
+
+@app.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    """One crawl run with its full Scrapy stats"""
+    run = get_run_ledger().get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Run {run_id} not found")
+    return {"status": "success", "run": run}
+
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """Crawl jobs on the work queue, newest first, with the queue's depth"""
+    if status and status not in [QUEUED, LEASED, DONE, DEAD]:
+        raise HTTPException(
+            status_code=400,
+            detail="status must be 'queued', 'leased', 'done' or 'dead'"
+        )
+    
+    if limit < 1 or limit > 500:
+        raise HTTPException(
+            status_code=400,
+            detail="limit must be between 1 and 500"
+        )
+    
+    queue = get_work_queue()
+    jobs = queue.jobs(status=status, limit=limit)
+    return {"status": "success", "queue": queue.stats(), "count": len(jobs), "jobs": jobs}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """One crawl job: status, attempts, lease holder and the run result"""
+    job = get_work_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return {"status": "success", "job": job}
+
+
 if __name__ == "__main__":
     import uvicorn
     
     port = int(os.getenv('PORT', 8000))
+    reload = os.getenv('ENVIRONMENT') == 'development'
+    workers = 1 if reload else int(os.getenv('WEB_CONCURRENCY', 1))
+    
+    # Metrics files of the previous run would be summed into this one
+    metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(metrics_dir, name))
     
     uvicorn.run(
         "server:app",
         host="0.0.0.0",
         port=port,
-        reload=os.getenv('ENVIRONMENT') == 'development'
+        reload=reload,
+        workers=workers
     )
 
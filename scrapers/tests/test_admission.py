@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from pricing_scrapers.admission import BACKGROUND, BATCH, INTERACTIVE, AdmissionController, Overloaded
+from pricing_scrapers.coordination import Coordinator
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_by_priority():
+    async def scenario():
+        admission = AdmissionController(limit=1, reserved_interactive=0)
+        await admission.acquire(BATCH)
+        order = []
+
+        async def scrape(priority, name):
+            await admission.acquire(priority)
+            order.append(name)
+            admission.release(priority)
+
+        waiters = [
+            asyncio.create_task(scrape(BACKGROUND, 'background')),
+            asyncio.create_task(scrape(BATCH, 'batch')),
+            asyncio.create_task(scrape(INTERACTIVE, 'interactive')),
+            asyncio.create_task(scrape(BATCH, 'batch-2')),
+        ]
+        await settle()
+        assert admission.status()['waiting'] == {'interactive': 1, 'batch': 2, 'background': 1}
+        admission.release(BATCH)
+        await asyncio.gather(*waiters)
+        return order
+
+    assert run(scenario()) == ['interactive', 'batch', 'batch-2', 'background']
+
+
+def test_reserved_slot_is_interactive_only():
+    async def scenario():
+        admission = AdmissionController(limit=2, reserved_interactive=1, max_wait_seconds=0.05)
+        await admission.acquire(BACKGROUND)
+        with pytest.raises(Overloaded):
+            await admission.acquire(BATCH)
+        assert await admission.acquire(INTERACTIVE) == 0
+        return admission.status()['running']
+
+    assert run(scenario()) == {'interactive': 1, 'batch': 0, 'background': 1}
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        admission = AdmissionController(limit=1, max_waiting=2, reserved_interactive=0)
+        await admission.acquire(INTERACTIVE)
+        waiters = [asyncio.create_task(admission.acquire(BACKGROUND)) for _ in range(2)]
+        await settle()
+        with pytest.raises(Overloaded) as rejected:
+            await admission.acquire(BATCH)
+        with pytest.raises(Overloaded):
+            admission.check(BACKGROUND)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return rejected.value
+
+    rejected = run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+
+
+def test_wait_timeout_is_rejected_with_503():
+    async def scenario():
+        admission = AdmissionController(limit=1, max_wait_seconds=0.05, reserved_interactive=0)
+        async with admission.slot(INTERACTIVE):
+            with pytest.raises(Overloaded) as rejected:
+                await admission.acquire(INTERACTIVE)
+        assert admission.status()['waiting']['interactive'] == 0
+        # The slot and the timed-out wait left nothing behind
+        assert await admission.acquire(INTERACTIVE) == 0
+        return rejected.value
+
+    assert run(scenario()).status_code == 503
+
+
+def test_slots_are_shared_through_the_coordinator(tmp_path):
+    path = str(tmp_path / 'coordination.db')
+
+    async def scenario():
+        first = AdmissionController(limit=2, reserved_interactive=1, max_wait_seconds=0.2,
+                                    coordinator=Coordinator(path), poll_interval=0.01)
+        second = AdmissionController(limit=2, reserved_interactive=1, max_wait_seconds=0.5,
+                                     coordinator=Coordinator(path), poll_interval=0.01)
+        second.owner = 'other-process'
+        await first.acquire(BATCH)
+        # The other process's only unreserved slot is taken
+        with pytest.raises(Overloaded):
+            await second.acquire(BATCH)
+        assert await second.acquire(INTERACTIVE) == 0
+        assert first.status()['running_all_processes'] == 2
+
+        waiter = asyncio.create_task(second.acquire(BATCH))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        first.release(BATCH)
+        await asyncio.wait_for(waiter, 1)
+        second.release(BATCH)
+        second.release(INTERACTIVE)
+        await asyncio.sleep(0.05)
+        return first.status()['running_all_processes']
+
+    assert run(scenario()) == 0
@@ -0,0 +1,96 @@
+import pytest
+
+from pricing_scrapers import circuit_breaker
+from pricing_scrapers.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def breaker(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, '_now', clock.utcnow)
+    return CircuitBreaker(str(tmp_path / 'breaker.db'), failure_threshold=3, cooldown_minutes=30,
+                          max_cooldown_minutes=90, probe_timeout_minutes=15)
+
+
+def fail(breaker, source='fiverr'):
+    return breaker.record(source, items=0, requests=10, errors=10)
+
+
+def succeed(breaker, source='fiverr'):
+    return breaker.record(source, items=25, requests=10, errors=0)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    assert fail(breaker) == CLOSED
+    assert fail(breaker) == CLOSED
+    assert fail(breaker) == OPEN
+    assert breaker.should_skip('fiverr')
+    assert not breaker.allow('fiverr')
+    assert not breaker.should_skip('upwork')
+
+
+def test_success_resets_the_failure_count(breaker):
+    fail(breaker)
+    fail(breaker)
+    succeed(breaker)
+    assert fail(breaker) == CLOSED
+
+
+def test_mostly_errored_runs_count_as_failures(breaker):
+    assert breaker.is_failure(items=5, requests=10, errors=5)
+    assert not breaker.is_failure(items=5, requests=10, errors=4)
+    assert breaker.is_failure(items=0, requests=0, errors=0)
+
+
+def test_single_probe_after_cooldown(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.advance(29 * 60)
+    assert not breaker.allow('fiverr')
+
+    clock.advance(60)
+    assert not breaker.should_skip('fiverr')
+    assert breaker.allow('fiverr')
+    assert breaker.status()[0]['state'] == HALF_OPEN
+    # Concurrent crawls wait for the probe
+    assert breaker.should_skip('fiverr')
+    assert not breaker.allow('fiverr')
+
+
+def test_lost_probe_is_replaced(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.advance(30 * 60)
+    assert breaker.allow('fiverr')
+    clock.advance(15 * 60)
+    assert breaker.allow('fiverr')
+
+
+def test_failed_probe_doubles_the_cooldown(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.advance(30 * 60)
+    for cooldown in (60, 90):  # 120 capped at max_cooldown_minutes
+        assert breaker.allow('fiverr')
+        assert fail(breaker) == OPEN
+        clock.advance((cooldown - 1) * 60)
+        assert not breaker.allow('fiverr')
+        clock.advance(60)
+    assert breaker.allow('fiverr')
+
+
+def test_successful_probe_closes(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.advance(30 * 60)
+    assert breaker.allow('fiverr')
+    assert succeed(breaker) == CLOSED
+    state = breaker.status()[0]
+    assert (state['consecutive_failures'], state['open_count'], state['recent_failures']) == (0, 0, 3)
+
+
+def test_reset(breaker):
+    for _ in range(3):
+        fail(breaker)
+    breaker.reset('fiverr')
+    assert breaker.allow('fiverr')
+    assert breaker.status() == []
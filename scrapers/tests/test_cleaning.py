@@ -0,0 +1,53 @@
+import pytest
+
+from pricing_scrapers.cleaning import clean_batch, clean_item, column_values
+
+ITEMS = [
+    {'source': 'Fiverr', 'title': 'Logo', 'price': '$1,200', 'currency': '$', 'region': 'ca',
+     'rating': '49', 'reviews': '1.2k', 'delivery_time': '2 weeks'},
+    {'source': 'Upwork', 'title': 'Site', 'price': 300, 'currency': 'usd', 'rating': 4.5, 'reviews': 12, 'delivery_time': None},
+    {'source': 'Etsy', 'title': '', 'price': '-5', 'currency': 'Rs.', 'region': 'in', 'rating': 'n/a', 'reviews': 'many'},
+    {'source': 'Fiverr', 'title': 'Contact', 'price': 'Contact', 'currency': 'USD', 'reviews': '-3'},
+]
+
+
+def test_batch_matches_per_item_cleaning():
+    cleaned, reasons = clean_batch(ITEMS)
+    values = column_values(cleaned)
+
+    for index, item in enumerate(ITEMS):
+        fields, reason = clean_item(dict(item))
+        assert (reasons[index] or None) == reason
+        if fields:
+            batch_fields = {field: column[index] for field, column in values.items()}
+            for field in ('price', 'currency', 'rating', 'reviews', 'delivery_time'):
+                assert batch_fields[field] == fields.get(field)
+
+
+def test_batch_reasons():
+    cleaned, reasons = clean_batch(ITEMS)
+    assert reasons.tolist() == [
+        '',
+        '',
+        'title: missing; price: below 0',
+        'price: missing or not a number; reviews: below 0',
+    ]
+    assert column_values(cleaned)['reviews'][:3] == [1200, 12, 0]
+
+
+def test_pipeline_releases_valid_items_and_drops_rejects(tmp_path):
+    scrapy = pytest.importorskip('scrapy')
+    from pricing_scrapers.pipelines import BatchCleaningPipeline
+
+    spider = scrapy.Spider('test')
+    pipeline = BatchCleaningPipeline(batch_size=2, rejects_dir=str(tmp_path), convert_currency=False)
+    released, dropped = [], []
+    for item in ITEMS:
+        deferred = pipeline.process_item(dict(item), spider)
+        deferred.addCallbacks(released.append, lambda failure: dropped.append(failure.check(scrapy.exceptions.DropItem)))
+    pipeline.close_spider(spider)
+
+    assert [item['price'] for item in released] == [1200.0, 300.0]
+    assert released[0]['currency'] == 'CAD' and released[0]['rating'] == 4.9
+    assert len(dropped) == 2
+    assert len(next(tmp_path.iterdir()).read_text().splitlines()) == 2
@@ -0,0 +1,64 @@
+import pytest
+
+from pricing_scrapers import coordination
+from pricing_scrapers.coordination import Coordinator
+
+
+@pytest.fixture
+def coordinator(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(coordination, 'time', clock)
+    return Coordinator(str(tmp_path / 'coordination.db'))
+
+
+def test_lease_is_exclusive_until_it_expires(coordinator, clock):
+    assert coordinator.acquire('scrape:logo', 'worker-1', ttl=30)
+    assert not coordinator.acquire('scrape:logo', 'worker-2', ttl=30)
+    assert coordinator.holder('scrape:logo')['owner'] == 'worker-1'
+
+    clock.advance(30)
+    assert coordinator.holder('scrape:logo') is None
+    assert coordinator.acquire('scrape:logo', 'worker-2', ttl=30)
+    assert not coordinator.renew('scrape:logo', 'worker-1', ttl=30)
+
+
+def test_renew_extends_the_lease(coordinator, clock):
+    coordinator.acquire('scrape:logo', 'worker-1', ttl=30)
+    acquired_at = coordinator.holder('scrape:logo')['acquired_at']
+    for _ in range(3):
+        clock.advance(20)
+        assert coordinator.renew('scrape:logo', 'worker-1', ttl=30)
+    assert not coordinator.acquire('scrape:logo', 'worker-2', ttl=30)
+    # Re-acquiring our own lease renews it without resetting acquired_at
+    assert coordinator.acquire('scrape:logo', 'worker-1', ttl=30)
+    assert coordinator.holder('scrape:logo')['acquired_at'] == acquired_at
+
+
+def test_release_only_by_the_owner(coordinator):
+    coordinator.acquire('scrape:logo', 'worker-1', ttl=30)
+    coordinator.release('scrape:logo', 'worker-2')
+    assert coordinator.holder('scrape:logo')['owner'] == 'worker-1'
+    coordinator.release('scrape:logo', 'worker-1')
+    assert coordinator.acquire('scrape:logo', 'worker-2', ttl=30)
+
+
+def test_leases_by_prefix(coordinator, clock):
+    coordinator.acquire('scrape-slot:0', 'worker-1', ttl=10)
+    coordinator.acquire('scrape-slot:1', 'worker-2', ttl=60)
+    coordinator.acquire('scrape:logo', 'worker-1', ttl=60)
+    assert [lease['name'] for lease in coordinator.leases('scrape-slot:')] == ['scrape-slot:0', 'scrape-slot:1']
+    clock.advance(10)
+    assert [lease['name'] for lease in coordinator.leases('scrape-slot:')] == ['scrape-slot:1']
+
+
+def test_cache_ttl_and_prefix_delete(coordinator, clock):
+    coordinator.cache_set('listings:logo', [{'price': 5}], ttl=5)
+    coordinator.cache_set('listings:seo', [{'price': 9}], ttl=60)
+    coordinator.cache_set('stats:logo', {'count': 1}, ttl=60)
+    assert coordinator.cache_get('listings:logo') == [{'price': 5}]
+
+    clock.advance(5)
+    assert coordinator.cache_get('listings:logo') is None
+    assert coordinator.cache_delete('listings:') == 2
+    assert coordinator.cache_get('listings:seo') is None
+    assert coordinator.cache_get('stats:logo') == {'count': 1}
+    assert coordinator.purge() == 0
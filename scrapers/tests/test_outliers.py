@@ -0,0 +1,67 @@
+import pytest
+
+from pricing_scrapers.aggregates import PriceAggregate
+from pricing_scrapers.outliers import OutlierDetector, RollingMAD
+
+
+def window_of(values, **kwargs):
+    rolling = RollingMAD(**kwargs)
+    for value in values:
+        rolling.add(value)
+    return rolling
+
+
+def test_nothing_is_flagged_while_warming_up():
+    rolling = window_of([100] * 5, min_samples=10)
+    assert rolling.score(10000) is None
+    assert not rolling.is_outlier(10000)
+
+
+def test_modified_z_score():
+    # median 100, MAD 7.5
+    rolling = window_of([80, 90, 90, 100, 100, 100, 110, 110, 120, 100, 95, 105])
+    assert rolling.score(100) == pytest.approx(0)
+    assert rolling.score(150) == pytest.approx(0.6745 * 50 / 7.5)
+    assert rolling.score(50) == pytest.approx(-0.6745 * 50 / 7.5)
+
+
+@pytest.mark.parametrize('price, outlier', [(100, False), (125, False), (130, True), (70, True), (76, False)])
+def test_threshold(price, outlier):
+    # median 100, MAD 5: |z| > 3.5 beyond 100 ± 25.9
+    rolling = window_of([90, 95, 95, 100, 100, 100, 100, 105, 105, 110], threshold=3.5)
+    assert rolling.is_outlier(price) is outlier
+
+
+def test_mean_absolute_deviation_when_most_prices_are_equal():
+    rolling = window_of([50] * 9 + [60, 70])
+    assert rolling.score(50) == pytest.approx(0)
+    assert rolling.is_outlier(500)
+
+
+def test_window_evicts_oldest_prices():
+    rolling = window_of([1000] * 10 + [10] * 10, window=10)
+    assert sorted(rolling.sorted_values) == [10] * 10
+    assert len(rolling) == 10
+
+
+def test_detector_keeps_a_window_per_source_and_currency():
+    detector = OutlierDetector(min_samples=5)
+    for price in (100, 102, 98, 101, 99, 100):
+        detector.check('logo', 'Fiverr', 'USD', price)
+
+    assert detector.check('logo', 'Fiverr', 'USD', 1000)
+    assert not detector.check('logo', 'Upwork', 'USD', 1000)
+    assert detector.flagged == 1
+
+
+def test_window_is_seeded_from_stored_aggregates():
+    history = PriceAggregate()
+    for price in range(90, 111):
+        history.add(price)
+
+    class Store:
+        def fetch_aggregates(self, category_key, **kwargs):
+            return [{'currency': 'USD', 'data': history.to_dict()}]
+
+    detector = OutlierDetector(store=Store(), min_samples=5)
+    assert detector.check('logo', 'Fiverr', 'USD', 500)
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+from pricing_scrapers.query_index import QueryIndex, char_ngrams, normalize_query
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def index_of(*keys):
+    index = QueryIndex()
+    for key in keys:
+        index.update(key, NOW)
+    return index
+
+
+def test_queries_are_normalized():
+    assert normalize_query('  Logo-Design!! ') == 'logo design'
+    assert normalize_query(None) == ''
+
+
+def test_ngrams_are_padded_per_word():
+    assert char_ngrams('x') == {' x ': 1}
+    assert char_ngrams('seo') == {' se': 1, 'seo': 1, 'eo ': 1}
+
+
+def test_closest_similar_query():
+    index = index_of('logo design', 'web development', 'seo audit')
+    key, score = index.best_match('Logo Designing', min_score=0.5)
+    assert key == 'logo design'
+    assert 0.5 <= score < 1
+    assert index.best_match('voice over', min_score=0.5) is None
+
+
+def test_exact_key_is_not_its_own_match():
+    assert index_of('logo design').best_match('logo design', min_score=0.1) is None
+
+
+def test_stale_keys_are_ignored():
+    index = index_of('logo design')
+    assert index.best_match('logo designs', min_score=0.5, fresh_since=NOW + timedelta(hours=1)) is None
+    index.update('logo design', NOW + timedelta(hours=2))
+    assert index.best_match('logo designs', min_score=0.5, fresh_since=NOW + timedelta(hours=1))[0] == 'logo design'
+    assert len(index) == 1
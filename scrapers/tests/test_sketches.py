@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from pricing_scrapers.aggregates import PriceAggregate, combine_aggregates
+from pricing_scrapers.sketches import KLLSketch, normalized_rank_error
+
+
+def true_rank(values, value):
+    return sum(1 for v in values if v <= value) / len(values)
+
+
+def sketch_of(values, k=200, seed=0):
+    sketch = KLLSketch(k)
+    sketch._random.seed(seed)
+    for value in values:
+        sketch.update(value)
+    return sketch
+
+
+@pytest.mark.parametrize('q', [0.1, 0.5, 0.9])
+def test_quantiles_within_rank_error(q):
+    rng = random.Random(1)
+    values = [rng.lognormvariate(4, 1) for _ in range(20000)]
+    sketch = sketch_of(values)
+
+    assert len(sketch) == 20000
+    assert abs(true_rank(values, sketch.quantile(q)) - q) <= normalized_rank_error()
+
+
+@pytest.mark.parametrize('q', [0.1, 0.5, 0.9])
+def test_merged_sketches_match_the_union(q):
+    rng = random.Random(2)
+    parts = [[rng.gauss(mean, 10) for _ in range(5000)] for mean in (50, 100, 400)]
+    merged = KLLSketch()
+    for seed, part in enumerate(parts):
+        merged.merge(sketch_of(part, seed=seed))
+    union = [value for part in parts for value in part]
+
+    assert len(merged) == len(union)
+    assert abs(true_rank(union, merged.quantile(q)) - q) <= normalized_rank_error()
+
+
+def test_small_sketches_are_exact():
+    sketch = sketch_of([5, 1, 4, 2, 3])
+    assert sketch.quantile(0) == 1
+    assert sketch.quantile(0.5) == 3
+    assert sketch.quantile(1) == 5
+
+
+def test_round_trip_through_dict():
+    sketch = sketch_of(range(1000))
+    restored = KLLSketch.from_dict(sketch.to_dict())
+    assert len(restored) == 1000
+    assert restored.quantile(0.5) == sketch.quantile(0.5)
+
+
+def test_aggregates_merge_exact_counts_and_bounds():
+    first, second = PriceAggregate(), PriceAggregate()
+    for price in (10, 20, 30):
+        first.add(price)
+    for price in (5, 50):
+        second.add(price)
+    first.merge(second)
+
+    assert (first.count, first.min, first.max, first.sum) == (5, 5, 50, 115)
+
+
+def test_combined_stats_merge_currencies_on_usd():
+    usd, inr = PriceAggregate(), PriceAggregate()
+    for price in (10, 20, 30):
+        usd.add(price)
+    for price in (12, 24):  # INR listings, aggregated on price_usd
+        inr.add(price)
+    legacy = PriceAggregate()
+    legacy.add(2000)
+    legacy_data = legacy.to_dict()
+    legacy_data.pop('unit')  # written before aggregates were kept in USD
+    rows = [
+        {'currency': 'USD', 'source': 'Fiverr', 'bucket': '2026-01-01', 'data': usd.to_dict()},
+        {'currency': 'INR', 'source': 'Fiverr', 'bucket': '2026-01-02', 'data': inr.to_dict()},
+        {'currency': 'INR', 'source': 'Fiverr', 'bucket': '2026-01-03', 'data': legacy_data},
+    ]
+
+    (stats,) = combine_aggregates(rows, 'all', False)
+    assert stats['currency'] == 'USD'
+    assert stats['scraped_currencies'] == ['INR', 'USD']
+    assert (stats['count'], stats['min'], stats['max']) == (5, 10, 30)
@@ -0,0 +1,196 @@
+import os
+import shutil
+
+from pricing_scrapers.spool import DEAD_SUFFIX, SpoolDrainer, WriteSpool
+
+
+class MemoryStore:
+    """Listing store keeping rows in memory; rejects the ids in `bad`, or everything while `down`"""
+
+    def __init__(self, bad=()):
+        self.rows = {}
+        self.bad = set(bad)
+        self.down = False
+
+    def insert_listings(self, listings):
+        if self.down or any(listing['id'] in self.bad for listing in listings):
+            raise RuntimeError('insert failed')
+        for listing in listings:
+            self.rows[listing['id']] = listing
+        return len(listings)
+
+
+def listings(count, start=0):
+    return [{'id': f'id-{i}', 'title': f'Listing {i}', 'price': i, 'source': 'Fiverr'} for i in range(start, start + count)]
+
+
+def drainer(spool, store, **kwargs):
+    return SpoolDrainer(spool, store, batch_size=kwargs.pop('batch_size', 50), max_batches_per_second=0, **kwargs)
+
+
+def test_append_and_drain_round_trip(tmp_path):
+    spool = WriteSpool(str(tmp_path), segment_max_records=10)
+    spool.append(listings(25))
+    spool.seal()
+    store = MemoryStore()
+
+    assert drainer(spool, store).drain_once() == 25
+    assert sorted(store.rows) == sorted(f'id-{i}' for i in range(25))
+    assert spool.depth()['records'] == 0
+
+
+def test_corrupt_and_torn_lines_are_skipped(tmp_path):
+    spool = WriteSpool(str(tmp_path))
+    spool.append(listings(3))
+    spool.seal()
+    (path,) = spool._segments()
+    with open(path, encoding='utf8') as segment:
+        lines = segment.readlines()
+    lines[1] = lines[1].replace('Listing 1', 'Listing X')  # payload no longer matches its CRC
+    with open(path, 'w', encoding='utf8') as segment:
+        segment.writelines(lines + ['0badc0de {"id": "torn'])
+
+    records, corrupt = WriteSpool.read_segment(path)
+    assert [record['id'] for record in records] == ['id-0', 'id-2']
+    assert corrupt == 2
+
+
+def test_abandoned_segments_are_recovered(tmp_path):
+    crashed = WriteSpool(str(tmp_path))
+    crashed.append(listings(4))  # left .open, as by a process that died mid-crawl
+    (open_path,) = crashed._segments()
+    os.utime(open_path, (0, 0))
+
+    spool = WriteSpool(str(tmp_path))
+    store = MemoryStore()
+    assert drainer(spool, store).drain_once() == 4
+    assert len(store.rows) == 4
+
+
+def test_fresh_open_segments_are_left_alone(tmp_path):
+    WriteSpool(str(tmp_path)).append(listings(2))
+    store = MemoryStore()
+    assert drainer(WriteSpool(str(tmp_path)), store).drain_once() == 0
+    assert not store.rows
+
+
+def test_replayed_records_are_deduplicated(tmp_path):
+    spool = WriteSpool(str(tmp_path))
+    store = MemoryStore()
+    drain = drainer(spool, store)
+    spool.append(listings(5))
+    spool.seal()
+    drain.drain_once()
+
+    # A crash between the write and the delete replays the same records
+    spool.append(listings(5))
+    spool.seal()
+    assert drain.drain_once() == 0
+    assert drain.stats['duplicates'] == 5
+
+
+def test_rejected_records_are_quarantined(tmp_path):
+    spool = WriteSpool(str(tmp_path))
+    spool.append(listings(100))
+    spool.seal()
+    store = MemoryStore(bad={'id-17', 'id-80'})
+    drain = drainer(spool, store, batch_size=32)
+
+    assert drain.drain_once() == 98
+    assert drain.stats['quarantined'] == 2
+    assert spool.depth() == {'segments': 0, 'records': 0, 'bytes': 0, 'dead_records': 2}
+    (dead,) = spool._segments((DEAD_SUFFIX,))
+    assert sorted(record['id'] for record in WriteSpool.read_segment(dead)[0]) == ['id-17', 'id-80']
+
+
+def test_outage_keeps_the_spool(tmp_path):
+    spool = WriteSpool(str(tmp_path), segment_max_records=10)
+    spool.append(listings(30))
+    spool.seal()
+    store = MemoryStore()
+    store.down = True
+    drain = drainer(spool, store)
+
+    assert drain.drain_once() == 0
+    assert spool.depth()['records'] == 30
+    assert drain.stats['quarantined'] == 0
+
+    store.down = False
+    assert drain.drain_once() == 30
+
+
+def test_lone_bad_record_is_quarantined_after_max_failures(tmp_path):
+    spool = WriteSpool(str(tmp_path))
+    spool.append(listings(1))
+    spool.seal()
+    drain = drainer(spool, MemoryStore(bad={'id-0'}), max_record_failures=3)
+
+    for _ in range(2):
+        drain.drain_once()
+        assert spool.depth()['records'] == 1
+    drain.drain_once()
+    assert spool.depth()['records'] == 0
+    assert spool.depth()['dead_records'] == 1
+
+
+def test_requeued_dead_records_drain_once_fixed(tmp_path):
+    spool = WriteSpool(str(tmp_path))
+    spool.append(listings(10))
+    spool.seal()
+    store = MemoryStore(bad={'id-3'})
+    drainer(spool, store).drain_once()
+
+    store.bad.clear()
+    assert spool.requeue_dead() == 1
+    assert drainer(spool, store).drain_once() == 1
+    assert 'id-3' in store.rows
+
+
+def test_depth_is_counted_without_reading_segments(tmp_path, monkeypatch):
+    spool = WriteSpool(str(tmp_path), segment_max_records=10)
+    monkeypatch.setattr(WriteSpool, '_count_lines', None)  # depth() must not scan the spool
+    spool.append(listings(25))
+    spool.seal()
+    sizes = sum(os.path.getsize(path) for path in spool._segments())
+
+    assert spool.depth() == {'segments': 3, 'records': 25, 'bytes': sizes, 'dead_records': 0}
+    # Shared with the other processes using the spool directory
+    assert WriteSpool(str(tmp_path)).depth()['records'] == 25
+
+    drainer(spool, MemoryStore(bad={'id-4'})).drain_once()
+    assert spool.depth() == {'segments': 0, 'records': 0, 'bytes': 0, 'dead_records': 1}
+
+
+def test_requeue_moves_dead_records_back_to_pending(tmp_path):
+    spool = WriteSpool(str(tmp_path))
+    spool.append(listings(10))
+    spool.seal()
+    drainer(spool, MemoryStore(bad={'id-3', 'id-6'})).drain_once()
+
+    spool.requeue_dead()
+    assert spool.depth()['records'] == 2
+    assert spool.depth()['dead_records'] == 0
+
+
+def test_counters_are_rebuilt_after_a_crash(tmp_path):
+    crashed = WriteSpool(str(tmp_path))
+    crashed.append(listings(4))
+    (open_path,) = crashed._segments()
+    with open(open_path, 'a', encoding='utf8') as segment:
+        segment.write('0badc0de {"id": "torn')  # written, never counted
+    os.utime(open_path, (0, 0))
+
+    spool = WriteSpool(str(tmp_path))
+    assert spool.claim_segments()
+    assert spool.depth()['records'] == 5
+
+
+def test_counters_start_from_an_existing_spool(tmp_path):
+    old = WriteSpool(str(tmp_path / 'old'))
+    old.append(listings(7))
+    old.seal()
+    os.makedirs(tmp_path / 'new')
+    for path in old._segments():
+        shutil.copy(path, tmp_path / 'new')
+
+    assert WriteSpool(str(tmp_path / 'new')).depth()['records'] == 7
@@ -0,0 +1,176 @@
+import sqlite3
+
+import pytest
+
+from pricing_scrapers.aggregates import (
+    AggregateConflict,
+    PriceAggregate,
+    delta_records,
+    merge_delta,
+    merge_into_store,
+)
+from pricing_scrapers.spool import WriteSpool, aggregate_drainer
+from pricing_scrapers.storage import CachedStore, SQLiteStore
+
+KEY = ('logo design', 'Fiverr', 'global', 'USD', 'day', '2026-01-05T00:00:00+00:00')
+FIELDS = dict(zip(('category_key', 'source', 'region', 'currency', 'resolution', 'bucket'), KEY))
+
+
+def delta(*prices):
+    aggregate = PriceAggregate()
+    for price in prices:
+        aggregate.add(price)
+    return {KEY: aggregate}
+
+
+def stored_count(store):
+    row = store.fetch_aggregate(FIELDS)
+    return row['data']['count'] if row else 0
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Stands in for Supabase, the store every node writes to"""
+    return SQLiteStore(str(tmp_path / 'remote.db'))
+
+
+class Flaky:
+    """Wraps a store so that every call fails while `down`"""
+
+    def __init__(self, store):
+        self.store = store
+        self.down = False
+
+    def __getattr__(self, name):
+        if self.down:
+            raise ConnectionError('store unavailable')
+        return getattr(self.store, name)
+
+
+def node(tmp_path, remote, name, recheck_seconds=60, **kwargs):
+    return CachedStore(
+        SQLiteStore(str(tmp_path / f'{name}.db')), remote, recheck_seconds=recheck_seconds,
+        backlog=WriteSpool(str(tmp_path / f'{name}-backlog')), **kwargs
+    )
+
+
+def test_nodes_merge_into_the_remote_aggregate(tmp_path, remote):
+    first, second = node(tmp_path, remote, 'first'), node(tmp_path, remote, 'second')
+    merge_into_store(first, delta(10, 20))
+    # second's local copy is empty, not a stale base for its merge
+    second.fetch_aggregates('logo design')
+    merge_into_store(second, delta(30))
+    merge_into_store(first, delta(40))
+
+    assert stored_count(remote) == 4
+    assert stored_count(first.local) == 4
+
+
+def test_concurrent_write_between_read_and_swap_is_retried(remote):
+    class Racing:
+        """Lets another writer merge right after the first read"""
+
+        def __init__(self, store):
+            self.store = store
+            self.raced = False
+
+        def fetch_aggregate(self, key):
+            row = self.store.fetch_aggregate(key)
+            if not self.raced:
+                self.raced = True
+                merge_into_store(self.store, delta(99))
+            return row
+
+        def swap_aggregate(self, row, version):
+            return self.store.swap_aggregate(row, version)
+
+    merge_into_store(remote, delta(1))
+    assert merge_into_store(Racing(remote), delta(2, 3)) == 1
+    assert stored_count(remote) == 4
+    assert remote.fetch_aggregate(FIELDS)['version'] == 2
+
+
+def test_replayed_delta_is_merged_once(remote):
+    (record,) = delta_records(delta(5, 6))
+    assert merge_delta(remote, record)
+    assert not merge_delta(remote, record)
+    assert stored_count(remote) == 2
+
+
+def test_gives_up_after_losing_every_swap(remote):
+    class AlwaysLosing:
+        def fetch_aggregate(self, key):
+            return remote.fetch_aggregate(key)
+
+        def swap_aggregate(self, row, version):
+            return False
+
+    (record,) = delta_records(delta(5))
+    with pytest.raises(AggregateConflict):
+        merge_delta(AlwaysLosing(), record, attempts=2)
+
+
+def test_cached_reads_recheck_the_remote(tmp_path, remote):
+    reader = node(tmp_path, remote, 'reader', recheck_seconds=0)
+    merge_into_store(remote, delta(10))
+    assert reader.fetch_aggregates('logo design')[0]['data']['count'] == 1
+
+    merge_into_store(remote, delta(20))  # written by another node
+    assert reader.fetch_aggregates('logo design')[0]['data']['count'] == 2
+
+
+def test_cached_reads_within_recheck_interval_stay_local(tmp_path, remote):
+    reader = node(tmp_path, remote, 'reader', recheck_seconds=60)
+    merge_into_store(remote, delta(10))
+    reader.fetch_aggregates('logo design')
+    merge_into_store(remote, delta(20))
+    assert reader.fetch_aggregates('logo design')[0]['data']['count'] == 1
+
+
+def test_price_stats_without_versions_are_migrated(tmp_path):
+    path = str(tmp_path / 'old.db')
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE market_price_stats (category_key TEXT, source TEXT, region TEXT, currency TEXT, '
+        "resolution TEXT DEFAULT 'day', bucket TEXT, data TEXT, updated_at TEXT, "
+        'PRIMARY KEY (category_key, region, source, currency, resolution, bucket))'
+    )
+    connection.commit()
+    connection.close()
+
+    store = SQLiteStore(path)
+    merge_into_store(store, delta(1))
+    merge_into_store(store, delta(2))
+    assert store.fetch_aggregate(FIELDS)['version'] == 1
+
+
+def test_spooled_deltas_are_replayed_once_the_store_is_back(tmp_path, remote):
+    store = Flaky(remote)
+    spool = WriteSpool(str(tmp_path / 'aggregates'), prepare=dict)
+    spool.append(delta_records(delta(10, 20)))
+    spool.seal()
+
+    store.down = True
+    assert aggregate_drainer(spool, store, max_batches_per_second=0).drain_once() == 0
+    assert spool.depth()['records'] == 1
+
+    store.down = False
+    assert aggregate_drainer(spool, store, max_batches_per_second=0).drain_once() == 1
+    assert spool.depth()['records'] == 0
+    assert stored_count(remote) == 2
+
+
+def test_listing_writes_survive_a_remote_outage(tmp_path, remote):
+    flaky = Flaky(remote)
+    cached = node(tmp_path, flaky, 'a', backlog_retry_seconds=0)
+    listing = {'title': 'Logo', 'price': 20, 'source': 'Fiverr', 'category': 'logo design'}
+
+    flaky.down = True
+    assert cached.insert_listings([listing]) == 1
+    assert len(cached.local.fetch_listings('logo design')) == 1
+    assert cached.backlog.depth()['records'] == 1
+
+    flaky.down = False
+    cached.insert_listings([{**listing, 'title': 'Logo 2'}])
+    assert cached.backlog.depth()['records'] == 0
+    assert len(remote.fetch_listings('logo design')) == 2
@@ -0,0 +1,104 @@
+import pytest
+
+from pricing_scrapers import work_queue
+from pricing_scrapers.work_queue import DEAD, DONE, LEASED, QUEUED, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(work_queue, '_now', clock.utcnow)
+    return WorkQueue(str(tmp_path / 'queue.db'), visibility_timeout=120, max_attempts=3, retry_backoff=60)
+
+
+def test_identical_active_jobs_are_deduplicated(queue):
+    first = queue.enqueue('fiverr', ['logo design'], priority=1)
+    assert queue.enqueue('fiverr', ['logo design'], priority=5) == first
+    assert queue.get(first)['priority'] == 5
+    assert queue.enqueue('fiverr', ['logo design'], region='india') != first
+
+    job = queue.lease('worker-1')
+    queue.complete(job['job_id'], 'worker-1', {'items': 3})
+    assert queue.enqueue('fiverr', ['logo design']) != first
+
+
+def test_highest_priority_first_then_oldest(queue, clock):
+    low = queue.enqueue('fiverr', ['a'], priority=0)
+    clock.advance(1)
+    high = queue.enqueue('upwork', ['b'], priority=10)
+    clock.advance(1)
+    low_later = queue.enqueue('etsy', ['c'], priority=0)
+
+    assert [queue.lease('worker')['job_id'] for _ in range(3)] == [high, low, low_later]
+    assert queue.lease('worker') is None
+
+
+def test_expired_lease_is_taken_over(queue, clock):
+    job_id = queue.enqueue('fiverr', ['logo design'])
+    queue.lease('worker-1')
+    clock.advance(119)
+    assert queue.lease('worker-2') is None
+
+    clock.advance(1)
+    job = queue.lease('worker-2')
+    assert (job['job_id'], job['leased_by'], job['attempts']) == (job_id, 'worker-2', 2)
+    # The first worker lost the job
+    assert not queue.heartbeat(job_id, 'worker-1')
+    assert not queue.complete(job_id, 'worker-1', {})
+
+
+def test_heartbeat_keeps_the_lease(queue, clock):
+    job_id = queue.enqueue('fiverr', ['logo design'])
+    queue.lease('worker-1')
+    for _ in range(3):
+        clock.advance(100)
+        assert queue.heartbeat(job_id, 'worker-1')
+    assert queue.lease('worker-2') is None
+    assert queue.complete(job_id, 'worker-1', {'items': 7})
+    assert queue.get(job_id)['status'] == DONE
+    assert queue.get(job_id)['result'] == {'items': 7}
+
+
+def test_failures_back_off_then_die(queue, clock):
+    job_id = queue.enqueue('fiverr', ['logo design'])
+    for backoff in (60, 120):
+        queue.lease('worker')
+        assert queue.fail(job_id, 'worker', 'blocked') == QUEUED
+        clock.advance(backoff - 1)
+        assert queue.lease('worker') is None
+        clock.advance(1)
+
+    queue.lease('worker')
+    assert queue.fail(job_id, 'worker', 'blocked') == DEAD
+    job = queue.get(job_id)
+    assert (job['status'], job['attempts'], job['error']) == (DEAD, 3, 'blocked')
+    clock.advance(3600)
+    assert queue.lease('worker') is None
+
+
+def test_crash_on_the_last_attempt_is_dead(queue, clock):
+    job_id = queue.enqueue('fiverr', ['logo design'], max_attempts=1)
+    queue.lease('worker-1')
+    clock.advance(121)
+    assert queue.lease('worker-2') is None
+    assert queue.get(job_id)['status'] == DEAD
+    assert 'worker-1' in queue.get(job_id)['error']
+
+
+def test_release_returns_the_attempt(queue):
+    job_id = queue.enqueue('fiverr', ['logo design'])
+    queue.lease('worker-1')
+    queue.release(job_id, 'worker-1')
+    job = queue.get(job_id)
+    assert (job['status'], job['attempts']) == (QUEUED, 0)
+    assert queue.lease('worker-2')['status'] == LEASED
+
+
+def test_retry_revives_dead_jobs(queue):
+    job_id = queue.enqueue('fiverr', ['logo design'], max_attempts=1)
+    queue.lease('worker')
+    queue.fail(job_id, 'worker', 'blocked')
+
+    assert queue.retry(job_id)
+    assert not queue.retry(job_id)
+    job = queue.lease('worker')
+    assert (job['job_id'], job['attempts']) == (job_id, 1)
@@ -0,0 +1,158 @@
+"""
+Crawl worker
+Leases spider runs from the work queue (pricing_scrapers.work_queue) and
+runs them. Start as many workers as there is capacity on the host that
+holds the queue file (see work_queue.py); they share the run ledger and
+listing store:
+
+    python worker.py                      # WORKER_CONCURRENCY runs at a time
+    python worker.py --concurrency 4 --worker-id crawler-2
+
+A running job's lease is renewed by heartbeats; when a worker dies its jobs'
+leases expire and other workers take them over. SIGTERM/SIGINT stop leasing
+new jobs and let running crawls finish; a second signal hands the running
+jobs back to the queue and exits at once.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+from dotenv import load_dotenv
+from pricing_scrapers.circuit_breaker import OPEN_REASON, get_circuit_breaker
+from pricing_scrapers.tracing import trace
+from pricing_scrapers.work_queue import DEAD, get_work_queue
+from workflows.scraping_flow import run_spider, skipped_result
+
+load_dotenv()
+
+
+class Worker:
+    """
+    Pool of worker slots, each leasing and running one job at a time
+
+    Args:
+        worker_id: Lease owner name (slots are '<worker_id>/<n>')
+        concurrency: Crawls run at the same time
+        poll_interval: Seconds to wait when the queue is empty
+    """
+
+    def __init__(self, worker_id: str, concurrency: int = 1, poll_interval: float = 2.0):
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.queue = get_work_queue()
+        self.stopping = threading.Event()
+        self.running = {}  # slot id -> leased job id
+        self.running_lock = threading.Lock()
+
+    def run(self):
+        """Run the slots until stop() is called and running jobs have finished"""
+        slots = [
+            threading.Thread(target=self.slot, args=(f"{self.worker_id}/{n}",), name=f"slot-{n}")
+            for n in range(self.concurrency)
+        ]
+        for slot in slots:
+            slot.start()
+        for slot in slots:
+            slot.join()
+
+    def stop(self):
+        self.stopping.set()
+
+    def release_running(self) -> int:
+        """Hand the running jobs back to the queue (before exiting mid-crawl); returns how many"""
+        with self.running_lock:
+            running = list(self.running.items())
+            self.running.clear()
+        for slot_id, job_id in running:
+            self.queue.release(job_id, slot_id)
+        return len(running)
+
+    def slot(self, slot_id: str):
+        while not self.stopping.is_set():
+            job = self.queue.lease(slot_id)
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            if self.stopping.is_set():
+                # Stopped while leasing: leave the job to another worker
+                self.queue.release(job['job_id'], slot_id)
+                break
+            with self.running_lock:
+                self.running[slot_id] = job['job_id']
+            try:
+                self.process(job, slot_id)
+            finally:
+                with self.running_lock:
+                    self.running.pop(slot_id, None)
+
+    def process(self, job: dict, slot_id: str):
+        """Run one leased job, heartbeating while it runs, and record its outcome"""
+        spider, queries, region = job['spider'], job['queries'], job['region']
+        print(f"[{slot_id}] job {job['job_id']}: {spider} {'|'.join(queries)} ({region}), "
+              f"attempt {job['attempts']}/{job['max_attempts']}")
+
+        if get_circuit_breaker().should_skip(spider):
+            self.queue.complete(job['job_id'], slot_id, skipped_result(spider, queries, region, OPEN_REASON))
+            return
+
+        finished = threading.Event()
+
+        def heartbeat():
+            while not finished.wait(self.queue.visibility_timeout / 3):
+                if not self.queue.heartbeat(job['job_id'], slot_id):
+                    print(f"[{slot_id}] lost the lease on job {job['job_id']}; another worker may run it too")
+                    return
+
+        beating = threading.Thread(target=heartbeat, daemon=True)
+        beating.start()
+        try:
+            with trace('crawl_job', job['traceparent'], job_id=job['job_id'], worker=slot_id, attempt=job['attempts']):
+                result = run_spider.fn(spider, queries[0] if len(queries) == 1 else queries, region)
+        except Exception as e:
+            result = {'spider': spider, 'region': region, 'success': False, 'error': str(e)}
+        finally:
+            finished.set()
+            beating.join()
+
+        if result.get('success'):
+            self.queue.complete(job['job_id'], slot_id, result)
+            print(f"[{slot_id}] job {job['job_id']} done: {result.get('items_scraped', 0)} items")
+        else:
+            error = result.get('error') or f"crawl {result.get('status')}"
+            if not result.get('error') and result.get('reason') not in (None, result.get('status')):
+                error += f" ({result['reason']})"
+            status = self.queue.fail(job['job_id'], slot_id, error, result)
+            print(f"[{slot_id}] job {job['job_id']} failed ({error}); "
+                  f"{'giving up' if status == DEAD else 'will retry' if status else 'lease was lost'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run crawl jobs from the work queue')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('WORKER_CONCURRENCY', 1)))
+    parser.add_argument('--worker-id', default=os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}")
+    args = parser.parse_args()
+
+    worker = Worker(args.worker_id, concurrency=max(args.concurrency, 1))
+    purged = worker.queue.purge(float(os.getenv('WORK_QUEUE_RETENTION_DAYS', 7)))
+
+    def shutdown(signum, frame):
+        if worker.stopping.is_set():
+            released = worker.release_running()
+            print(f"Exiting now; handed {released} running jobs back to the queue")
+            os._exit(1)
+        print(f"Stopping after running jobs finish (signal {signum}); signal again to exit now")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"Worker {args.worker_id}: {args.concurrency} slots, queue {worker.queue.path}"
+          f"{f', purged {purged} old jobs' if purged else ''}")
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,51 +4,251 @@ Schedules and manages data collection from multiple platforms
 """
 
 from prefect import flow, task
-from prefect.tasks import task_input_hash
-from datetime import timedelta
+from prefect.task_runners import ThreadPoolTaskRunner
+from prefect.cache_policies import NO_CACHE
+from datetime import datetime, timezone
 import subprocess
 import os
-from typing import List, Dict
+import signal
+import threading
+import time
+from typing import List, Dict, Optional, Tuple, Union
+from pricing_scrapers import settings as scrapy_settings
+from pricing_scrapers.circuit_breaker import OPEN_REASON, get_circuit_breaker
+from pricing_scrapers.demand import build_refresh_plan, get_demand_tracker
+from pricing_scrapers.early_stop import CONVERGED_REASON, is_converged
+from pricing_scrapers.metrics import SPIDERS_RUNNING, record_spider_run
+from pricing_scrapers.profiling import finish_spider_profile, spider_profile_args
+from pricing_scrapers.regions import normalize_region
+from pricing_scrapers.run_ledger import (
+    FAILED, FINISHED, TIMEOUT, crawl_log_path, get_run_ledger, new_run_id, stream_output,
+)
+from pricing_scrapers.spiders.base import QUERY_SEPARATOR
+from pricing_scrapers.storage import get_listing_store
+from pricing_scrapers.tracing import current_traceparent, span
+from pricing_scrapers.work_queue import WORK_QUEUE_ENABLED, QueuedRun, get_work_queue
 
+# Spiders to run for each (business_type, offering_type)
+SPIDER_MAPPING = {
+    ('digital', 'service'): ['fiverr', 'upwork', 'freelancer'],
+    ('digital', 'product'): ['etsy', 'appsumo', 'producthunt'],
+    ('physical', 'product'): ['indiamart', 'ebay', 'amazon'],
+    ('physical', 'service'): ['indiamart', 'justdial', 'urbanclap'],
+}
 
-@task(cache_key_fn=task_input_hash, cache_expiration=timedelta(hours=1))
-def run_spider(spider_name: str, query: str) -> Dict:
+# Batch and background scrapes run a category's sources one after another and
+# skip the rest once the query's median price has converged (see
+# check_price_convergence); interactive scrapes always fan out in parallel
+ADAPTIVE_SCRAPING = os.getenv('ADAPTIVE_SCRAPING', 'true').lower() == 'true'
+
+
+# Never cached: every call (API scrape, refresh, retry) must really crawl
+@task(cache_policy=NO_CACHE)
+def run_spider(spider_name: str, query: Union[str, List[str]], region: str = 'global', profile: str = None) -> Dict:
     """
     Run a Scrapy spider with given parameters
     
     Args:
         spider_name: Name of the spider (fiverr, upwork, etc.)
-        query: Search query for the spider
+        query: Search query for the spider, or a list of queries crawled
+            in one run (items are tagged with their own query)
+        region: Region key passed to the spider for locale and tagging
+        profile: Run the spider under a profiler, 'cpu' or 'memory'
+            (default: the SPIDER_PROFILE environment variable); the files
+            are listed under 'profile' in the result
         
     Returns:
         Dict with spider results metadata
     """
+    started = time.monotonic()
+    queries = [query] if isinstance(query, str) else list(query)
+    query = QUERY_SEPARATOR.join(queries)
+    query_args = ['-a', f'query={query}'] if len(queries) == 1 else ['-a', f'queries={query}']
+    profile = profile or os.getenv('SPIDER_PROFILE') or None
+    run_id = new_run_id()
+    ledger = get_run_ledger()
     try:
-        # Run spider using scrapy command
-        result = subprocess.run(
-            ['scrapy', 'crawl', spider_name, '-a', f'query={query}'],
-            cwd=os.path.join(os.path.dirname(__file__), '..'),
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout
-        )
+        profile_args, profile_base = spider_profile_args(spider_name, profile) if profile else ([], None)
+        # Run spider using scrapy command; the crawl joins the caller's trace
+        # and writes its stats to the run ledger, its log to a rotating file
+        with SPIDERS_RUNNING.track_inprogress(), span('run_spider', spider=spider_name, region=region) as run_span:
+            ledger.start(run_id, spider_name, query, region,
+                         log_path=crawl_log_path(spider_name), trace_id=run_span.trace_id if run_span else None)
+            env = {**os.environ, 'TRACEPARENT': current_traceparent()} if run_span else None
+            exit_code, log_tail = run_crawl_process(
+                ['scrapy', 'crawl', spider_name] + query_args + ['-a', f'region={region}',
+                 '-s', f'RUN_ID={run_id}'] + profile_args,
+                spider_name,
+                run_id,
+                env=env,
+                # 5 minute timeout, plus 2 minutes per extra query of a batch
+                timeout=300 + 120 * (len(queries) - 1)
+            )
+            if run_span:
+                run_span.set(returncode=exit_code, run_id=run_id)
         
-        return {
-            'spider': spider_name,
-            'query': query,
-            'success': result.returncode == 0,
-            'output': result.stdout,
-            'errors': result.stderr,
-        }
+        duration = time.monotonic() - started
+        run = ledger.complete(run_id, exit_code, TIMEOUT if exit_code is None else None, duration)
+        if run['status'] != FINISHED and run['items_scraped'] is None:
+            # The crawl died before recording its outcome; tell the breaker
+            get_circuit_breaker().record(spider_name, items=0, reason=run['status'])
+        record_spider_run(spider_name, 'success' if run['status'] == FINISHED else run['status'],
+                          duration=duration, stats=run['stats'])
+        spider_result = spider_run_result(run)
+        if len(queries) > 1:
+            spider_result['queries'] = queries
+        if run['status'] != FINISHED:
+            spider_result['log_tail'] = log_tail
+        if profile_base:
+            spider_result['profile'] = finish_spider_profile(profile_base, profile, run['stats'])
+        return spider_result
     except Exception as e:
+        record_spider_run(spider_name, 'failed', duration=time.monotonic() - started)
+        ledger.complete(run_id, None, FAILED, time.monotonic() - started)
         return {
             'spider': spider_name,
             'query': query,
+            'region': region,
             'success': False,
-            'errors': str(e),
+            'run_id': run_id,
+            'error': str(e),
         }
 
 
+def run_crawl_process(command: List[str], spider_name: str, run_id: str, env: Dict = None,
+                      timeout: float = 300) -> Tuple[Optional[int], List[str]]:
+    """
+    Run a crawl process, streaming its output to the spider's rotating log
+    
+    Args:
+        command: `scrapy crawl` command line
+        spider_name: Spider, selects the log file
+        run_id: Tags the log lines
+        env: Process environment (default: inherited)
+        timeout: Seconds before the process (and its browsers) are killed
+        
+    Returns:
+        (exit code, or None when killed on timeout; last lines of output)
+    """
+    process = subprocess.Popen(
+        command,
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors='replace',
+        env=env,
+        start_new_session=True,
+    )
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError):
+            process.kill()
+
+    watchdog = threading.Timer(timeout, kill)
+    watchdog.start()
+    try:
+        log_tail = stream_output(process.stdout, spider_name, run_id)
+        exit_code = process.wait()
+    finally:
+        watchdog.cancel()
+    return (None if timed_out.is_set() else exit_code), log_tail
+
+
+def spider_run_result(run: Dict) -> Dict:
+    """Flow result entry for a run ledger record"""
+    return {
+        'spider': run['spider'],
+        'query': run['query'],
+        'region': run['region'],
+        'success': run['status'] == FINISHED,
+        'run_id': run['run_id'],
+        'status': run['status'],
+        'reason': run['reason'],
+        'items_scraped': run['items_scraped'] or 0,
+        'items_dropped': run['items_dropped'] or 0,
+        'requests': run['requests'] or 0,
+        'errors': run['errors'] or 0,
+        'error_classes': run['error_classes'],
+        'duration_seconds': run['duration_seconds'],
+        'log': run['log_path'],
+    }
+
+
+def skipped_result(spider_name: str, query: Union[str, List[str]], region: str, reason: str) -> Dict:
+    """Result entry for a spider that was deliberately not run"""
+    record_spider_run(spider_name, 'skipped')
+    return {
+        'spider': spider_name,
+        'query': query if isinstance(query, str) else QUERY_SEPARATOR.join(query),
+        'region': region,
+        'success': True,
+        'skipped': reason,
+    }
+
+
+def submit_spider(spider_name: str, query: Union[str, List[str]], region: str, priority: float = 0):
+    """
+    Submit run_spider unless the source's circuit breaker is open
+    
+    With WORK_QUEUE_ENABLED the run is enqueued for the worker processes
+    (worker.py) instead of being started here.
+    
+    Args:
+        spider_name: Spider to run
+        query: Query, or list of queries for one run
+        region: Region key
+        priority: Queue priority of the run (higher runs first)
+    
+    Returns:
+        Prefect future, QueuedRun, or the skipped result itself
+    """
+    if get_circuit_breaker().should_skip(spider_name):
+        return skipped_result(spider_name, query, region, OPEN_REASON)
+    if WORK_QUEUE_ENABLED:
+        queries = [query] if isinstance(query, str) else list(query)
+        job_id = get_work_queue().enqueue(spider_name, queries, region, priority=priority,
+                                          traceparent=current_traceparent())
+        return QueuedRun(job_id, spider_name, QUERY_SEPARATOR.join(queries), region)
+    return run_spider.submit(spider_name, query, region)
+
+
+def resolve(futures: List) -> List[Dict]:
+    """Results of submit_spider calls (futures and queued runs)"""
+    return [future if isinstance(future, dict) else future.result() for future in futures]
+
+
+@task
+def check_price_convergence(query: str, region: str, since: datetime) -> bool:
+    """
+    Whether the listings stored for a query since `since` already pin down
+    its median USD price (same rule as the spider-level early stop)
+    
+    Args:
+        query: Search query/niche
+        region: Region key
+        since: Start of the current flow run
+        
+    Returns:
+        True once further sources are not expected to move the estimate
+    """
+    listings = get_listing_store().fetch_listings(query, region, since=since, limit=5000, exact=True)
+    prices = sorted(
+        listing['price_usd'] for listing in listings
+        if listing.get('price_usd') and listing['price_usd'] > 0
+    )
+    return is_converged(
+        prices,
+        precision=scrapy_settings.EARLY_STOP_PRECISION,
+        min_samples=scrapy_settings.EARLY_STOP_MIN_ITEMS,
+        confidence=scrapy_settings.EARLY_STOP_CONFIDENCE,
+    )
+
+
 @task
 def aggregate_results(spider_results: List[Dict]) -> Dict:
     """
@@ -62,11 +262,22 @@ def aggregate_results(spider_results: List[Dict]) -> Dict:
     """
     successful = sum(1 for r in spider_results if r['success'])
     failed = len(spider_results) - successful
+    skipped = sum(1 for r in spider_results if r.get('skipped'))
+    error_classes: Dict[str, int] = {}
+    for r in spider_results:
+        for name, count in (r.get('error_classes') or {}).items():
+            error_classes[name] = error_classes.get(name, 0) + count
     
     return {
         'total_spiders': len(spider_results),
         'successful': successful,
         'failed': failed,
+        'skipped': skipped,
+        'items_scraped': sum(r.get('items_scraped', 0) for r in spider_results),
+        'items_dropped': sum(r.get('items_dropped', 0) for r in spider_results),
+        'requests': sum(r.get('requests', 0) for r in spider_results),
+        'errors': sum(r.get('errors', 0) for r in spider_results),
+        'error_classes': error_classes,
         'results': spider_results,
     }
 
@@ -76,7 +287,8 @@ def scrape_market_data_flow(
     business_type: str,
     offering_type: str,
     query: str,
-    region: str = 'global'
+    region: str = 'global',
+    adaptive: bool = False
 ) -> Dict:
     """
     Main flow for scraping market data based on business parameters
@@ -86,28 +298,31 @@ def scrape_market_data_flow(
         offering_type: 'product' or 'service'
         query: Search query/niche
         region: Geographic region
+        adaptive: Run spiders one after another and skip the remaining
+            sources once the query's median price has converged; slower
+            than the parallel fan-out, so only for runs nobody waits on
         
     Returns:
         Aggregated scraping results
     """
     
     # Determine which spiders to run based on business type
-    spiders_to_run = []
-    
-    if business_type == 'digital' and offering_type == 'service':
-        spiders_to_run = ['fiverr', 'upwork', 'freelancer']
-    elif business_type == 'digital' and offering_type == 'product':
-        spiders_to_run = ['etsy', 'appsumo', 'producthunt']
-    elif business_type == 'physical' and offering_type == 'product':
-        spiders_to_run = ['indiamart', 'ebay', 'amazon']
-    elif business_type == 'physical' and offering_type == 'service':
-        spiders_to_run = ['indiamart', 'justdial', 'urbanclap']
-    
-    # Run spiders in parallel
-    spider_results = []
-    for spider in spiders_to_run:
-        result = run_spider(spider, query)
-        spider_results.append(result)
+    spiders_to_run = SPIDER_MAPPING.get((business_type, offering_type), [])
+    region = normalize_region(region)
+    
+    if adaptive:
+        started_at = datetime.now(timezone.utc)
+        spider_results = []
+        for spider in spiders_to_run:
+            if spider_results and check_price_convergence(query, region, started_at):
+                spider_results.append(skipped_result(spider, query, region, CONVERGED_REASON))
+                continue
+            spider_results.extend(resolve([submit_spider(spider, query, region)]))
+        return aggregate_results(spider_results)
+    
+    # Run spiders in parallel (sources with an open circuit breaker are skipped)
+    futures = [submit_spider(spider, query, region) for spider in spiders_to_run]
+    spider_results = resolve(futures)
     
     # Aggregate results
     final_results = aggregate_results(spider_results)
@@ -115,36 +330,200 @@ def scrape_market_data_flow(
     return final_results
 
 
-@flow(name="scheduled-market-refresh")
-def scheduled_market_refresh():
+@flow(name="scrape-market-data-regions")
+def scrape_regions_flow(
+    business_type: str,
+    offering_type: str,
+    query: str,
+    regions: List[str]
+) -> Dict:
+    """
+    Scrape one query for several regions
+    Each (spider, region) pair is an independent shard, so regions can be
+    pre-warmed separately and a failing shard doesn't affect the others
+    
+    Args:
+        business_type: 'digital' or 'physical'
+        offering_type: 'product' or 'service'
+        query: Search query/niche
+        regions: Region keys or names to scrape
+        
+    Returns:
+        Aggregated results per region
+    """
+    spiders_to_run = SPIDER_MAPPING.get((business_type, offering_type), [])
+    shard_regions = sorted({normalize_region(region) for region in regions})
+    
+    futures = {
+        region: [submit_spider(spider, query, region) for spider in spiders_to_run]
+        for region in shard_regions
+    }
+    
+    return {
+        region: aggregate_results(resolve(region_futures))
+        for region, region_futures in futures.items()
+    }
+
+
+def unique_queries(queries: List[str]) -> List[str]:
+    """Stripped queries in order, without blanks and duplicates"""
+    return list(dict.fromkeys(query.strip() for query in queries if query and query.strip()))
+
+
+def query_batches(queries: List[str], batch_size: int) -> List[List[str]]:
+    """Split queries into batches of at most batch_size, dropping duplicates"""
+    unique = unique_queries(queries)
+    return [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+
+
+@flow(name="scrape-market-data-batch")
+def scrape_batch_flow(
+    business_type: str,
+    offering_type: str,
+    queries: List[str],
+    region: str = 'global',
+    batch_size: int = None,
+    adaptive: bool = None
+) -> Dict:
+    """
+    Scrape many queries with one spider run per source and batch
+    Process and browser startup is paid once per batch instead of once per
+    query, which is what dominates pre-warm and scheduled jobs
+    
+    Args:
+        business_type: 'digital' or 'physical'
+        offering_type: 'product' or 'service'
+        queries: Search queries/niches
+        region: Geographic region
+        batch_size: Queries per spider run (default SPIDER_BATCH_SIZE)
+        adaptive: Run the sources one after another (the batches of a
+            source in parallel) and leave out of later sources the queries
+            whose median price has converged (default ADAPTIVE_SCRAPING)
+        
+    Returns:
+        Aggregated results of all spider runs
+    """
+    spiders_to_run = SPIDER_MAPPING.get((business_type, offering_type), [])
+    region = normalize_region(region)
+    batch_size = batch_size or int(os.getenv('SPIDER_BATCH_SIZE', 10))
+    
+    if ADAPTIVE_SCRAPING if adaptive is None else adaptive:
+        started_at = datetime.now(timezone.utc)
+        pending = unique_queries(queries)
+        spider_results = []
+        for index, spider in enumerate(spiders_to_run):
+            if index and pending:
+                converged = [query for query in pending if check_price_convergence(query, region, started_at)]
+                if converged:
+                    spider_results.append(skipped_result(spider, converged, region, CONVERGED_REASON))
+                pending = [query for query in pending if query not in converged]
+            spider_results.extend(resolve([
+                submit_spider(spider, batch, region) for batch in query_batches(pending, batch_size)
+            ]))
+        return aggregate_results(spider_results)
+    
+    batches = query_batches(queries, batch_size)
+    futures = [submit_spider(spider, batch, region) for batch in batches for spider in spiders_to_run]
+    return aggregate_results(resolve(futures))
+
+
+def enqueue_crawls(
+    business_type: str,
+    offering_type: str,
+    queries: List[str],
+    region: str = 'global',
+    batch_size: int = None
+) -> List[Dict]:
     """
-    Scheduled flow to refresh market data periodically
-    Runs daily to keep pricing data current
+    Put the spider runs for queries on the work queue without waiting for
+    them (WORK_QUEUE_ENABLED; workers run them)
+    
+    Returns:
+        One entry per spider run: spider, query and job_id, or the skipped
+        result of a spider whose circuit breaker is open
     """
+    spiders_to_run = SPIDER_MAPPING.get((business_type, offering_type), [])
+    region = normalize_region(region)
+    batches = query_batches(queries, batch_size or int(os.getenv('SPIDER_BATCH_SIZE', 10)))
     
-    # Common categories to scrape
-    categories = [
-        {'business': 'digital', 'offering': 'service', 'query': 'web development'},
-        {'business': 'digital', 'offering': 'service', 'query': 'graphic design'},
-        {'business': 'digital', 'offering': 'product', 'query': 'saas tools'},
-        {'business': 'physical', 'offering': 'product', 'query': 'electronics'},
-    ]
+    jobs = []
+    for batch in batches:
+        for spider in spiders_to_run:
+            submitted = submit_spider(spider, batch, region)
+            if isinstance(submitted, QueuedRun):
+                submitted = {'spider': spider, 'query': submitted.query, 'job_id': submitted.job_id}
+            jobs.append(submitted)
+    return jobs
+
+
+# Categories refreshed while no demand has been recorded yet (fresh deploy)
+SEED_CATEGORIES = [
+    {'business_type': 'digital', 'offering_type': 'service', 'query': 'web development'},
+    {'business_type': 'digital', 'offering_type': 'service', 'query': 'graphic design'},
+    {'business_type': 'digital', 'offering_type': 'product', 'query': 'saas tools'},
+    {'business_type': 'physical', 'offering_type': 'product', 'query': 'electronics'},
+]
+
+
+@flow(
+    name="scheduled-market-refresh",
+    task_runner=ThreadPoolTaskRunner(max_workers=int(os.getenv('REFRESH_CONCURRENCY', 3)))
+)
+def scheduled_market_refresh(budget_minutes: float = None, max_crawls: int = None) -> Dict:
+    """
+    Scheduled flow refreshing market data where the traffic is
+    Plans crawls from query demand (/scrape and /cache traffic) × staleness
+    of each (spider, query, region), merging spiders shared by several
+    categories, and runs them within the crawl budget, batched per spider
+    and region (SPIDER_BATCH_SIZE queries per run) and REFRESH_CONCURRENCY
+    runs at a time; see pricing_scrapers.demand
     
-    results = []
-    for cat in categories:
-        result = scrape_market_data_flow(
-            business_type=cat['business'],
-            offering_type=cat['offering'],
-            query=cat['query']
-        )
-        results.append(result)
+    Args:
+        budget_minutes: Expected crawl time to spend (default REFRESH_BUDGET_MINUTES)
+        max_crawls: Most crawls to run (default REFRESH_MAX_CRAWLS)
+        
+    Returns:
+        The plan's size and budget with the aggregated crawl results
+    """
+    plan = build_refresh_plan(
+        SPIDER_MAPPING,
+        seeds=SEED_CATEGORIES,
+        budget_seconds=budget_minutes * 60 if budget_minutes is not None else None,
+        max_crawls=max_crawls,
+    )
+    # Crawls of one spider and region share spider runs
+    grouped: Dict[tuple, Dict[str, float]] = {}
+    for crawl in plan['crawls']:
+        grouped.setdefault((crawl['spider'], crawl['region']), {})[crawl['query']] = crawl['priority']
+    batch_size = int(os.getenv('SPIDER_BATCH_SIZE', 10))
+    futures = [
+        submit_spider(spider, batch, region, priority=max(priorities.get(query, 0) for query in batch))
+        for (spider, region), priorities in grouped.items()
+        for batch in query_batches(list(priorities), batch_size)
+    ]
+    get_demand_tracker().prune()
     
     return {
-        'categories_scraped': len(categories),
-        'results': results,
+        'planned': len(plan['crawls']),
+        'deferred': len(plan['deferred']),
+        'budget_seconds': plan['budget_seconds'],
+        'planned_seconds': plan['planned_seconds'],
+        **aggregate_results(resolve(futures)),
     }
 
 
+@flow(name="price-history-retention")
+def price_history_retention_flow() -> Dict:
+    """
+    Scheduled flow enforcing the price history retention policy
+    Runs daily; raw listings and hourly/daily buckets past their retention
+    are deleted, the weekly buckets keep the long-term trend
+    """
+    from pricing_scrapers.history import apply_retention
+    
+    return apply_retention(get_listing_store())
+
+
 if __name__ == '__main__':
     # Example: Run a single scraping flow
     result = scrape_market_data_flow(
@@ -497,6 +497,9 @@ CREATE TABLE IF NOT EXISTS market_listings (
   price numeric NOT NULL CHECK (price >= 0),
   currency text DEFAULT 'USD',
   price_usd numeric, -- Normalized to USD
+  price_target numeric, -- Converted to target_currency (optional)
+  target_currency text,
+  is_outlier boolean DEFAULT false, -- Flagged by the scraper outlier stage
   
   -- Quality Metrics
   rating numeric CHECK (rating >= 0 AND rating <= 5),
@@ -510,6 +513,7 @@ CREATE TABLE IF NOT EXISTS market_listings (
   
   -- Classification
   category text,
+  region text DEFAULT 'global',
   tags text[],
   business_type text,
   offering_type text,
@@ -592,6 +596,23 @@ BEGIN
     ALTER TABLE market_listings ADD COLUMN price_usd numeric;
   END IF;
   
+  -- Add price_target / target_currency if they don't exist
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns 
+    WHERE table_name = 'market_listings' AND column_name = 'price_target'
+  ) THEN
+    ALTER TABLE market_listings ADD COLUMN price_target numeric;
+    ALTER TABLE market_listings ADD COLUMN target_currency text;
+  END IF;
+  
+  -- Add is_outlier if it doesn't exist
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns 
+    WHERE table_name = 'market_listings' AND column_name = 'is_outlier'
+  ) THEN
+    ALTER TABLE market_listings ADD COLUMN is_outlier boolean DEFAULT false;
+  END IF;
+  
   -- Add is_active if it doesn't exist
   IF NOT EXISTS (
     SELECT 1 FROM information_schema.columns 
@@ -607,6 +628,14 @@ BEGIN
   ) THEN
     ALTER TABLE market_listings ADD COLUMN seller_country text;
   END IF;
+  
+  -- Add region if it doesn't exist
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns 
+    WHERE table_name = 'market_listings' AND column_name = 'region'
+  ) THEN
+    ALTER TABLE market_listings ADD COLUMN region text DEFAULT 'global';
+  END IF;
 END $$;
 
 -- Create indexes AFTER columns are added
@@ -615,6 +644,8 @@ CREATE INDEX IF NOT EXISTS idx_market_category ON market_listings(category);
 CREATE INDEX IF NOT EXISTS idx_market_price ON market_listings(price);
 CREATE INDEX IF NOT EXISTS idx_market_scraped ON market_listings(scraped_at DESC);
 CREATE INDEX IF NOT EXISTS idx_market_business_type ON market_listings(business_type, offering_type);
+CREATE INDEX IF NOT EXISTS idx_market_category_region ON market_listings(category, region, scraped_at DESC);
+CREATE INDEX IF NOT EXISTS idx_market_category_price_usd ON market_listings(category, price_usd);
 
 COMMENT ON TABLE market_listings IS 'Scraped pricing data from various marketplaces';
 
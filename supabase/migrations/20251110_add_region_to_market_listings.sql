@@ -0,0 +1,17 @@
+/*
+  # Add region to market listings
+  
+  Listings are scraped per region (global, us, uk, eu, in, ca, au) and the
+  scraper service cache is keyed on (category, region)
+*/
+
+ALTER TABLE market_listings
+ADD COLUMN IF NOT EXISTS region text DEFAULT 'global';
+
+UPDATE market_listings SET region = 'global' WHERE region IS NULL;
+
+-- Cache lookups filter on category + region, newest first
+CREATE INDEX IF NOT EXISTS idx_market_listings_category_region
+  ON market_listings(category, region, scraped_at DESC);
+
+COMMENT ON COLUMN market_listings.region IS 'Region key the listing was scraped for (see scrapers/pricing_scrapers/regions.py)';
@@ -0,0 +1,34 @@
+/*
+  # Market Price Stats Table
+  
+  Per-category price aggregates maintained by the scraper pipeline at ingest
+  (count, min/max, sum and recent price samples) and served by GET /stats
+*/
+
+CREATE TABLE IF NOT EXISTS market_price_stats (
+  category_key text NOT NULL,
+  source text NOT NULL,
+  region text NOT NULL DEFAULT 'global',
+  currency text NOT NULL DEFAULT 'USD',
+  data jsonb NOT NULL,
+  updated_at timestamptz DEFAULT now(),
+  PRIMARY KEY (category_key, region, source, currency)
+);
+
+-- Enable Row Level Security
+ALTER TABLE market_price_stats ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Anyone can read market stats (it's public)
+CREATE POLICY "Public read access for market price stats"
+  ON market_price_stats FOR SELECT
+  TO authenticated, anon
+  USING (true);
+
+-- Policy: Only service role can insert/update
+CREATE POLICY "Service role can manage market price stats"
+  ON market_price_stats FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+COMMENT ON TABLE market_price_stats IS 'Incrementally maintained price aggregates per (category, region, source, currency)';
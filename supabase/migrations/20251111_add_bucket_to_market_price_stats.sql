@@ -0,0 +1,24 @@
+/*
+  # Daily Buckets for Market Price Stats
+  
+  Price stats are now kept per day and hold mergeable quantile sketches, so
+  /stats can merge any set of sources, regions and days. Existing rows become
+  the bucket of their last update.
+*/
+
+ALTER TABLE market_price_stats
+  ADD COLUMN IF NOT EXISTS bucket date;
+
+UPDATE market_price_stats
+  SET bucket = (updated_at AT TIME ZONE 'UTC')::date
+  WHERE bucket IS NULL;
+
+ALTER TABLE market_price_stats
+  ALTER COLUMN bucket SET NOT NULL,
+  ALTER COLUMN bucket SET DEFAULT (now() AT TIME ZONE 'UTC')::date;
+
+ALTER TABLE market_price_stats DROP CONSTRAINT IF EXISTS market_price_stats_pkey;
+ALTER TABLE market_price_stats
+  ADD PRIMARY KEY (category_key, region, source, currency, bucket);
+
+COMMENT ON TABLE market_price_stats IS 'Daily price aggregates (exact count/min/max/sum plus KLL sketches) per (category, region, source, currency)';
@@ -0,0 +1,33 @@
+/*
+  # Hourly, Daily and Weekly Price History
+  
+  market_price_stats now holds hourly, daily and weekly buckets (resolution)
+  so GET /history can return trend series. Buckets are identified by their
+  UTC start time; existing daily rows keep resolution 'day'.
+*/
+
+ALTER TABLE market_price_stats
+  ADD COLUMN IF NOT EXISTS resolution text NOT NULL DEFAULT 'day';
+
+ALTER TABLE market_price_stats
+  ALTER COLUMN bucket DROP DEFAULT;
+
+ALTER TABLE market_price_stats
+  ALTER COLUMN bucket TYPE timestamptz USING (bucket::timestamp AT TIME ZONE 'UTC');
+
+ALTER TABLE market_price_stats
+  ALTER COLUMN bucket SET DEFAULT date_trunc('day', now());
+
+ALTER TABLE market_price_stats DROP CONSTRAINT IF EXISTS market_price_stats_pkey;
+ALTER TABLE market_price_stats
+  ADD PRIMARY KEY (category_key, region, source, currency, resolution, bucket);
+
+-- Retention deletes scan by resolution and bucket age
+CREATE INDEX IF NOT EXISTS idx_market_price_stats_bucket
+  ON market_price_stats(resolution, bucket);
+
+ALTER TABLE market_price_stats
+  ADD CONSTRAINT market_price_stats_resolution_check
+  CHECK (resolution IN ('hour', 'day', 'week'));
+
+COMMENT ON TABLE market_price_stats IS 'Hourly/daily/weekly price aggregates (exact count/min/max/sum plus KLL sketches) per (category, region, source, currency)';
@@ -0,0 +1,17 @@
+/*
+  # Converted Prices on Market Listings
+  
+  The scraper pipeline normalizes currencies to ISO codes and stores each
+  listing's price converted to USD (price_usd) and, optionally, to a target
+  currency, so stats and sorts across sources run on one numeric column.
+*/
+
+ALTER TABLE market_listings
+  ADD COLUMN IF NOT EXISTS price_usd numeric,
+  ADD COLUMN IF NOT EXISTS price_target numeric,
+  ADD COLUMN IF NOT EXISTS target_currency text;
+
+CREATE INDEX IF NOT EXISTS idx_market_category_price_usd
+  ON market_listings(category, price_usd);
+
+COMMENT ON COLUMN market_listings.price_usd IS 'Price converted to USD at ingest from the cached FX rate table';
@@ -0,0 +1,15 @@
+/*
+  # Outlier Flag on Market Listings
+  
+  The scraper pipeline flags prices far from the rolling median of their
+  category/source (robust z-score over median/MAD) and non-positive prices.
+  Flagged rows are kept but excluded from listings served to the backend and
+  from stats unless explicitly requested.
+*/
+
+ALTER TABLE market_listings
+  ADD COLUMN IF NOT EXISTS is_outlier boolean DEFAULT false;
+
+CREATE INDEX IF NOT EXISTS idx_market_category_region_inliers
+  ON market_listings(category, region, scraped_at DESC)
+  WHERE is_outlier IS NOT TRUE;
@@ -0,0 +1,13 @@
+/*
+  # Row Versions for Market Price Stats
+
+  Scrapers on several nodes merge their deltas into the same aggregates. A
+  merge reads a row, folds the delta in and writes it back only if the row's
+  version is still the one it read (bumping it), retrying otherwise, so
+  concurrent merges never overwrite each other. Existing rows start at 0.
+*/
+
+ALTER TABLE market_price_stats
+  ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN market_price_stats.version IS 'Bumped by every merge; a merge only writes the version it read (optimistic concurrency)';